@@ -0,0 +1,50 @@
+import com.garmin.fit.csv.CSVTool;
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+
+/**
+ * Long-lived driver for FitCSVTool.jar, kept warm by power_core/workshop/jvm_pool.py.
+ * Protocol (one line each, UTF-8):
+ *   stdout on start:  READY
+ *   stdin job:        <flag>\t<input path>\t<output path>
+ *   stdout reply:     OK | ERR <message>
+ * CSVTool's own console output is redirected to stderr, so stdout only carries the protocol.
+ */
+public final class FitCsvWorker {
+
+    public static void main(String[] args) throws IOException {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, StandardCharsets.UTF_8);
+        System.setOut(System.err);
+
+        BufferedReader jobs = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.println("READY");
+
+        String line;
+        while ((line = jobs.readLine()) != null) {
+            String[] job = line.split("\t", -1);
+            if (job.length != 3) {
+                protocol.println("ERR malformed job");
+                continue;
+            }
+            File output = new File(job[2]);
+            try {
+                output.delete();
+                CSVTool.main(job);
+                if (output.isFile() && output.length() > 0) {
+                    protocol.println("OK");
+                } else {
+                    protocol.println("ERR FitCSVTool produced no output for " + job[1]);
+                }
+            } catch (Throwable t) {
+                protocol.println("ERR " + t.toString().replace('\n', ' '));
+            }
+        }
+    }
+}
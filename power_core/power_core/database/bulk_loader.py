@@ -0,0 +1,210 @@
+"""
+Bulk loader of track points for backlog imports (years of Dropbox rides at once).
+- Rows are pre-encoded in PostgreSQL binary COPY format by NumPy (one structured array per
+  activity, .tobytes()), so there is no Python work per row as with copy.write_row.
+- Activities are split across PG_BULK_CONNECTIONS pooled connections (balanced by row count,
+  at most PG_POOL_MAX_SIZE), each one runs a single COPY ... (FORMAT BINARY) in its own transaction.
+- The COPY goes into a temporary staging table (no primary key, dropped on commit) and is moved
+  with INSERT ... ON CONFLICT DO NOTHING, so points already in the table (a re-imported ride)
+  are skipped instead of rolling back the whole group.
+- The result reports rows, seconds and rows/sec, in total and per connection.
+- The CLI reads the folder in chunks of --chunk files, so memory does not grow with the backlog.
+    python -m power_core.database.bulk_loader <folder with FitCSVTool .csv files> [--table t] [--connections n] [--chunk n]
+"""
+import argparse
+import heapq
+import os
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import psycopg
+from psycopg import sql
+from psycopg_pool import PoolTimeout
+
+from power_core.database.db_conect import db_connection, pool_stats, track_table_query
+from power_core.project_env.config import PG_BULK_CONNECTIONS, PG_POOL_MAX_SIZE
+from power_core.workshop.csv_to_base import GARMIN_EPOCH, SEMICIRCLE_CONVERSION_FACTOR
+from power_core.workshop.vector_cleaner import load_record_columns
+
+import logging
+logger = logging.getLogger(__name__)
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") + (0).to_bytes(4, "big")
+COPY_TRAILER = (-1).to_bytes(2, "big", signed=True)
+# Binary timestamptz: microseconds since 2000-01-01 UTC
+PG_EPOCH_OFFSET_S = int((GARMIN_EPOCH - datetime(2000, 1, 1, tzinfo=timezone.utc)).total_seconds())
+# One tuple: field count, then (length, value) per column; numpy packs it without padding
+ROW_DTYPE = np.dtype([
+    ("fields", ">i2"),
+    ("ts_len", ">i4"), ("ts", ">i8"),
+    ("lat_len", ">i4"), ("lat", ">f8"),
+    ("lon_len", ">i4"), ("lon", ">f8"),
+])
+
+STAGING_TABLE = "bulk_staging"
+BULK_CHUNK_FILES = 200
+
+# (FIT timestamps in seconds since the Garmin epoch, latitude deg, longitude deg)
+TrackPoints = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def track_points_from_csv(raw_csv: str) -> TrackPoints:
+    """Record rows of a FitCSVTool CSV with a timestamp and a position, as columns."""
+    _, columns = load_record_columns(raw_csv.splitlines())
+    timestamp, lat, lon = columns["timestamp"], columns["position_lat"], columns["position_long"]
+    valid = ~np.isnan(timestamp) & ~np.isnan(lat) & ~np.isnan(lon)
+    return (timestamp[valid],
+            lat[valid] * SEMICIRCLE_CONVERSION_FACTOR,
+            lon[valid] * SEMICIRCLE_CONVERSION_FACTOR)
+
+
+def encode_copy_rows(points: TrackPoints) -> bytes:
+    """Binary COPY tuples (recorded_at, latitude, longitude) of one activity, without header/trailer."""
+    timestamp, lat, lon = points
+    rows = np.empty(len(timestamp), dtype=ROW_DTYPE)
+    rows["fields"] = 3
+    rows["ts_len"] = rows["lat_len"] = rows["lon_len"] = 8
+    rows["ts"] = (timestamp.astype(np.int64) + PG_EPOCH_OFFSET_S) * 1_000_000
+    rows["lat"] = lat
+    rows["lon"] = lon
+    return rows.tobytes()
+
+
+def split_balanced(activities: list[TrackPoints], groups: int) -> list[list[TrackPoints]]:
+    """Largest activities first, each to the group with the fewest rows so far."""
+    heap = [(0, i) for i in range(groups)]
+    result = [[] for _ in range(groups)]
+    for points in sorted(activities, key=lambda p: len(p[0]), reverse=True):
+        rows, i = heapq.heappop(heap)
+        result[i].append(points)
+        heapq.heappush(heap, (rows + len(points[0]), i))
+    return [group for group in result if group]
+
+
+def _copy_group(table_name: str, group: list[TrackPoints]) -> dict:
+    """
+    One connection, one transaction: streams every activity of the group into a staging table,
+    then inserts the points that are not in table_name yet.
+    """
+    started = time.perf_counter()
+    rows = 0
+    staging = sql.Identifier(STAGING_TABLE)
+    copy_query = sql.SQL("COPY {} (recorded_at, latitude, longitude) FROM STDIN (FORMAT BINARY)").format(staging)
+    with db_connection() as conn:
+        # LIKE copies the columns only, so duplicates are allowed in the staging table
+        conn.execute(sql.SQL("CREATE TEMP TABLE {} (LIKE {}) ON COMMIT DROP").format(
+            staging, sql.Identifier(table_name)))
+        with conn.cursor() as cur:
+            with cur.copy(copy_query) as copy:
+                copy.write(COPY_HEADER)
+                for points in group:
+                    copy.write(encode_copy_rows(points))
+                    rows += len(points[0])
+                copy.write(COPY_TRAILER)
+            cur.execute(sql.SQL("""
+                INSERT INTO {} (recorded_at, latitude, longitude)
+                SELECT recorded_at, latitude, longitude FROM {}
+                ON CONFLICT (recorded_at) DO NOTHING
+            """).format(sql.Identifier(table_name), staging))
+            inserted = cur.rowcount
+    seconds = time.perf_counter() - started
+    return {"activities": len(group), "rows": rows, "inserted": inserted, "skipped": rows - inserted,
+            "seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds) if seconds else 0}
+
+
+def bulk_load_track_points(
+        activities: list[TrackPoints],
+        table_name: str = "heatmap_test",
+        connections: int = PG_BULK_CONNECTIONS) -> dict:
+    """
+    Loads many activities in parallel with binary COPY.
+    Points already in the table are skipped; a failed connection rolls back only its own group.
+    :return: {"rows", "inserted", "skipped", "seconds", "rows_per_sec",
+              "connections": [per-connection stats], "failed"}
+    """
+    with db_connection() as conn:
+        conn.execute(track_table_query(table_name))
+
+    # More groups than pooled connections would only queue for a connection
+    groups = split_balanced([a for a in activities if len(a[0])], max(1, min(connections, PG_POOL_MAX_SIZE)))
+    started = time.perf_counter()
+    per_connection, failed = [], 0
+    with ThreadPoolExecutor(max_workers=len(groups) or 1) as executor:
+        futures = [executor.submit(_copy_group, table_name, group) for group in groups]
+        for future in futures:
+            try:
+                per_connection.append(future.result())
+            except (psycopg.Error, PoolTimeout) as e:
+                logger.error(f"Bulk COPY group failed and was rolled back: {e}")
+                failed += 1
+
+    seconds = time.perf_counter() - started
+    rows = sum(stats["rows"] for stats in per_connection)
+    inserted = sum(stats["inserted"] for stats in per_connection)
+    result = {
+        "rows": rows,
+        "inserted": inserted,
+        "skipped": rows - inserted,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds else 0,
+        "connections": per_connection,
+        "failed": failed,
+    }
+    logger.info(
+        f"Bulk loaded {rows} track points ({inserted} new) from {len(activities)} activities into '{table_name}' "
+        f"over {len(groups)} connection(s) in {result['seconds']} s ({result['rows_per_sec']} rows/sec), "
+        f"{failed} group(s) failed. Pool: {pool_stats()}")
+    return result
+
+
+def iter_csv_chunks(folder: str, chunk_files: int = BULK_CHUNK_FILES) -> Iterator[list[TrackPoints]]:
+    """Track points of the folder's .csv files (one activity each), chunk_files activities at a time."""
+    chunk = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(".csv"):
+            with open(os.path.join(folder, name), "r", encoding="utf-8") as f:
+                chunk.append(track_points_from_csv(f.read()))
+            if len(chunk) >= chunk_files:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_load_folder(
+        folder: str,
+        table_name: str = "heatmap_test",
+        connections: int = PG_BULK_CONNECTIONS,
+        chunk_files: int = BULK_CHUNK_FILES) -> dict:
+    """
+    Loads a folder of FitCSVTool CSVs chunk by chunk; only one chunk of activities is in memory.
+    :return: {"activities", "rows", "inserted", "skipped", "seconds", "rows_per_sec", "failed"}
+    """
+    totals = {"activities": 0, "rows": 0, "inserted": 0, "skipped": 0, "failed": 0}
+    started = time.perf_counter()
+    for chunk in iter_csv_chunks(folder, chunk_files):
+        result = bulk_load_track_points(chunk, table_name, connections)
+        totals["activities"] += len(chunk)
+        for key in ("rows", "inserted", "skipped", "failed"):
+            totals[key] += result[key]
+    seconds = time.perf_counter() - started
+    totals["seconds"] = round(seconds, 3)
+    totals["rows_per_sec"] = round(totals["rows"] / seconds) if seconds else 0
+    return totals
+
+
+if __name__ == "__main__":
+    from gcp_actions.common_utils.handle_logs import run_handle_logs
+    run_handle_logs()
+
+    parser = argparse.ArgumentParser(description="Bulk load FitCSVTool CSV track points into PostgreSQL")
+    parser.add_argument("folder", help="folder with .csv files (one activity each)")
+    parser.add_argument("--table", default="heatmap_test")
+    parser.add_argument("--connections", type=int, default=PG_BULK_CONNECTIONS)
+    parser.add_argument("--chunk", type=int, default=BULK_CHUNK_FILES, help="activities loaded per round")
+    args = parser.parse_args()
+
+    print(bulk_load_folder(args.folder, args.table, args.connections, args.chunk))
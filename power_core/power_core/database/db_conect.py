@@ -1,8 +1,14 @@
+import atexit
 import os
+import threading
+import time
 import psycopg
+from contextlib import contextmanager
 from psycopg import sql
+from psycopg_pool import ConnectionPool, PoolTimeout
 from urllib.parse import quote_plus
 from typing import Iterator, Optional
+from power_core.project_env.config import PG_POOL_MIN_SIZE, PG_POOL_MAX_SIZE, PG_POOL_TIMEOUT
 
 
 import logging
@@ -31,39 +37,118 @@ logger = logging.getLogger(__name__)
 #         logger.error(f"Error connecting to PostgreSQL database: {connection_uri}")
 
 
-def connect_to_db():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        conn = psycopg.connect(
-            host=os.environ.get("PG_HOST", "localhost"),
-            port=os.environ.get("PG_PORT", 5432),
-            dbname=os.environ.get("PG_DATABASE", "postgres"),
-            user=os.environ.get("PG_USER", "postgres"),
-            password=os.environ.get("PG_PASS", "")
-        )
-        conn.autocommit = True
-        logger.info("Database connection established.")
-        return conn
-    except psycopg.OperationalError as e:
-        logger.warning(f"Could not connect to database (local dev without PG?): {e}")
-        return None
+def get_dsn() -> str:
+    """Connection string (libpq URI) from the PG_* environment variables."""
+    user = os.environ.get("PG_USER", "postgres")
+    password = os.environ.get("PG_PASS", "")
+    host = os.environ.get("PG_HOST", "localhost")
+    port = os.environ.get("PG_PORT", 5432)
+    dbname = os.environ.get("PG_DATABASE", "postgres")
+    safe_password = quote_plus(password)
+    return f"postgresql://{user}:{safe_password}@{host}:{port}/{dbname}"
 
 
-def load_stream_to_postgres(data_iterator: Iterator[tuple], table_name: str = "heatmap_test"):
+class _PoolTimings:
+    """Acquire (wait for a pooled connection) and use (connection held) times, in ms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.acquire_ms = 0.0
+        self.acquire_max_ms = 0.0
+        self.use_ms = 0.0
+        self.use_max_ms = 0.0
+
+    def add(self, acquire_ms: float, use_ms: float):
+        with self._lock:
+            self.count += 1
+            self.acquire_ms += acquire_ms
+            self.acquire_max_ms = max(self.acquire_max_ms, acquire_ms)
+            self.use_ms += use_ms
+            self.use_max_ms = max(self.use_max_ms, use_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "connections_used": self.count,
+                "acquire_avg_ms": round(self.acquire_ms / self.count, 2) if self.count else 0.0,
+                "acquire_max_ms": round(self.acquire_max_ms, 2),
+                "use_avg_ms": round(self.use_ms / self.count, 2) if self.count else 0.0,
+                "use_max_ms": round(self.use_max_ms, 2),
+            }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+_timings = _PoolTimings()
+
+
+def get_pool() -> ConnectionPool:
     """
-    Streams data directly into PostgreSQL using Psycopg 3's efficient copy writer.
+    Process-wide pool, created on first use (the service also runs without PostgreSQL).
+    max_size follows the gunicorn threads (PG_POOL_MAX_SIZE defaults to GUNICORN_THREADS);
+    connections are checked before they are handed out and replaced when broken.
     """
-    # Connection string (Libpq format is often preferred in Psycopg 3)
-    user = os.environ.get("PG_USER")
-    password = os.environ.get("PG_PASS")
-    host = os.environ.get("PG_HOST")
-    print("HH", host)
-    port = os.environ.get("PG_PORT")
-    dbname = os.environ.get("PG_DATABASE")
-    safe_password = quote_plus(password)
-    DB_DSN = f"postgresql://{user}:{safe_password}@{host}:{port}/{dbname}"
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    get_dsn(),
+                    min_size=PG_POOL_MIN_SIZE,
+                    max_size=PG_POOL_MAX_SIZE,
+                    timeout=PG_POOL_TIMEOUT,
+                    check=ConnectionPool.check_connection,
+                    name="power_core",
+                    open=False,
+                )
+                # Don't block the first request until min_size connections exist
+                pool.open(wait=False)
+                atexit.register(close_pool)
+                _pool = pool
+                logger.info(f"PostgreSQL pool created (min {PG_POOL_MIN_SIZE}, max {PG_POOL_MAX_SIZE}).")
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            logger.info(f"PostgreSQL pool closed: {pool_stats()}")
+            _pool.close()
+            _pool = None
 
-    create_query = sql.SQL("""
+
+@contextmanager
+def db_connection(timeout: float | None = None) -> Iterator[psycopg.Connection]:
+    """
+    Borrows a pooled connection; the transaction is committed at the end of the block
+    (rolled back on error) and the connection goes back to the pool.
+    :param timeout: seconds to wait for a free connection (default PG_POOL_TIMEOUT)
+    :raises PoolTimeout: no connection became available in time
+    """
+    started = time.perf_counter()
+    with get_pool().connection(timeout=timeout) as conn:
+        acquired = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            acquire_ms = (acquired - started) * 1000
+            use_ms = (time.perf_counter() - acquired) * 1000
+            _timings.add(acquire_ms, use_ms)
+            logger.debug(f"DB connection: acquire {acquire_ms:.1f} ms, use {use_ms:.1f} ms")
+
+
+def pool_stats() -> dict:
+    """Timing metrics of db_connection plus the pool's own counters (psycopg_pool get_stats)."""
+    stats = _timings.snapshot()
+    if _pool is not None:
+        stats.update(_pool.get_stats())
+    return stats
+
+
+def track_table_query(table_name: str) -> sql.Composed:
+    return sql.SQL("""
         CREATE TABLE IF NOT EXISTS {} (
             recorded_at TIMESTAMPTZ PRIMARY KEY,
             latitude DOUBLE PRECISION,
@@ -71,9 +156,17 @@ def load_stream_to_postgres(data_iterator: Iterator[tuple], table_name: str = "h
         );
     """).format(sql.Identifier(table_name))
 
+
+def load_stream_to_postgres(data_iterator: Iterator[tuple], table_name: str = "heatmap_test"):
+    """
+    Streams data directly into PostgreSQL using Psycopg 3's efficient copy writer.
+    For many activities at once use database/bulk_loader.py (binary COPY over several connections).
+    """
+    create_query = track_table_query(table_name)
+
     try:
-        # Connect using the new Psycopg 3 context manager
-        with psycopg.connect(DB_DSN) as conn:
+        # Pooled connection: committed and returned to the pool when the block ends
+        with db_connection() as conn:
 
             # 1. Create Table (if needed)
             conn.execute(create_query)
@@ -93,7 +186,7 @@ def load_stream_to_postgres(data_iterator: Iterator[tuple], table_name: str = "h
             # No manual commit needed if no exception raised (conn context manager handles it)
             logger.info(f"Streamed {count} records to PostgreSQL successfully.")
 
-    except psycopg.Error as e:
+    except (psycopg.Error, PoolTimeout) as e:
         logger.error(f"PostgreSQL Error: {e}")
         raise
     except Exception as e:
@@ -6,6 +6,8 @@ from gcp_actions.pubsub import publish_to_pubsub
 from power_core.project_env.config import (
     GCP_PROJECT_ID,
     DROPBOX_TOPIC_NAME,
+    DROPBOX_BATCH_TOPIC_NAME,
+    DROPBOX_BATCH_SIZE,
     DROPBOX_WATCHED_FOLDER
 )
 from power_core.dropbox_usage.utils import DropboxAuth
@@ -66,7 +68,9 @@ def connect_to_dropbox():
 
     logger.info(f"--- Processing {len(all_entries)} total entries ---")
     fit_entries = [e for e in all_entries if isinstance(e, FileMetadata) and e.name.endswith(".fit")]
-    if fit_entries:
+    if fit_entries and DROPBOX_BATCH_SIZE > 0 and DROPBOX_BATCH_TOPIC_NAME:
+        publish_batches(fit_entries, DROPBOX_BATCH_SIZE)
+    elif fit_entries:
         logger.info(f"Found {len(fit_entries)} new/modified .fit files. Publishing pointers to Pub/Sub...")
         for entry in fit_entries:
             upload_id = str(uuid.uuid4())
@@ -84,5 +88,27 @@ def connect_to_dropbox():
     logger.debug("Sync complete. New cursor saved.")
     return True
 
+def publish_batches(fit_entries: list, batch_size: int):
+    """
+    Publishes the .fit pointers in groups of batch_size to DROPBOX_BATCH_TOPIC_NAME,
+    so one push request runs many files (see workshop/batch_runner.py).
+    """
+    logger.info(f"Found {len(fit_entries)} new/modified .fit files. Publishing batches of {batch_size}...")
+    for i in range(0, len(fit_entries), batch_size):
+        files = [
+            {
+                'dropbox_path': entry.path_lower,
+                'original_filename': entry.name,
+                'upload_id': str(uuid.uuid4())
+            }
+            for entry in fit_entries[i:i + batch_size]
+        ]
+        message_payload = {'batch_id': str(uuid.uuid4()), 'files': files}
+        try:
+            publish_to_pubsub(DROPBOX_BATCH_TOPIC_NAME, message_payload)
+            logger.info(f"Published batch of {len(files)} pointers to {DROPBOX_BATCH_TOPIC_NAME}.")
+        except Exception as e:
+            logger.error(f"Failed to publish batch starting at {files[0]['original_filename']}: {e}")
+
 if __name__ == "__main__":
     connect_to_dropbox()
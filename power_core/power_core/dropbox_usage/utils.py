@@ -8,7 +8,6 @@ import os
 from functools import lru_cache
 from gcp_actions.common_utils.timer import run_timer
 from gcp_actions.secret_manager import SecretManagerClient
-from power_core.database.db_conect import connect_to_db
 logger = logging.getLogger(__name__)
 
 
@@ -29,7 +28,6 @@ class DropboxAuth:
         self.DROPBOX_APP_KEY = os.environ.get("DROPBOX_APP_KEY")
         self.DROPBOX_APP_SECRET = os.environ.get("DROPBOX_APP_SECRET")
         self.DROPBOX_REFRESH_TOKEN = os.environ.get("DROPBOX_REFRESH_TOKEN")
-        connect_to_db()
 
     def auth_dropbox(self):
             """
@@ -4,69 +4,87 @@ After all, delete an original GPX file of activity
 """
 import os
 import re
-from power_core.project_env.config import LOCAL_TMP
+from typing import BinaryIO
+from power_core.project_env.config import (
+    LOCAL_TMP, HEATMAP_COMPOSE_MODE, HEATMAP_GRID, HEATMAP_SIMPLIFY_TOLERANCE_M)
 from gcp_actions.client import get_bucket
 from gcp_actions.blob_manipulation import delete_blob, StorageManipulations
-from google.cloud import firestore
-from gcp_actions.firestore_box.json_manipulations import FirestoreMagic
 from gcp_actions.common_utils.timer import run_timer
+from power_core.heatmap_gpx.compose_tree import add_fragment
+from power_core.heatmap_gpx.density_grid import update_grid_from_gpx
+from power_core.heatmap_gpx.simplify import simplify_gpx_file
+from power_core.heatmap_gpx.heatmap_state import (
+    StaleHeatmapState,
+    claim_date,
+    load_bike_models,
+    load_specs,
+    release_date,
+    save_spec)
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 bucket_name = "GCS_BUCKET_NAME"
+SPEC_WRITE_RETRIES = 3
+GPX_CHUNK_SIZE = 1024 * 1024
+TIME_PATTERN = re.compile(rb"<time>([^<]*)</time>")
+TIME_WINDOW = 128
 
 @run_timer
-def extract_first_time_tag(file_path: str) -> str | None:
+def strip_gpx_fragment(file_path: str, out: BinaryIO, chunk_size: int = GPX_CHUNK_SIZE) -> str | None:
     """
-    Get a timestamp of activity from a GPX file
-    :param file_path:
-    :return:
-    """
-    try:
-        time_pattern = re.compile(r"<time>(.*?)</time>")
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                match = time_pattern.search(line)
-                if match:
-                    return match.group(1)
-        return None
-    except FileNotFoundError:
-        logger.error(f"File not found at path: {file_path}")
-        raise
-    except IOError as e:
-        logger.error(f"IOError processing file '{file_path}': {e}")
-        raise
-    except Exception as e:
-        logger.error(f"An unexpected error occurred in extract_first_time_tag for '{file_path}': {e}")
-        raise
-
-@run_timer
-def strip_source_content(file_path: str) -> None:
-    """
-    Strips the GPX file header and footer in-place to prepare it for concatenation.
-    This function reads a GPX file, removes the first two lines (XML declaration
-    and <gpx> tag) and the last line (</gpx> tag), and overwrites the file
-    with the stripped content.
+    One streaming pass over a GPX file: finds the first <time> value and writes the body
+    without the header (first two lines: XML declaration and <gpx> tag) and the footer
+    (last line: </gpx>) to out, ready for concatenation. Memory stays at one chunk plus one line.
+    A file with two lines or fewer is written unchanged, as there is nothing to strip.
     Args:
-        file_path: The absolute path to the GPX file to be modified.
+        file_path: The absolute path to the GPX file (left unchanged).
+        out: binary stream receiving the fragment (a local file or a GCS writer).
+    Returns:
+        The first <time> value, or None if the file has none.
     Raises:
         FileNotFoundError: If the specified file_path does not exist.
         IOError: If there is an error reading from or writing to the file.
-        Exception: For any other unexpected errors.
     """
+    first_time = None
+    time_window = b""       # end of the previous chunk, for a tag split between chunks
+    header = b""            # the first two lines, kept to re-emit a file too short to strip
+    header_lines = 0
+    pending = b""           # everything after the last line break that is not the final byte
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-        if len(lines) <= 2:
-            logger.warning(f"File '{file_path}' has too few lines to be stripped. Skipping.")
-            return
-        # Remove the first two lines and the last line
-        stripped_lines = lines[2:-1]
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.writelines(stripped_lines)
-        logger.debug(f"Successfully stripped header/footer from '{file_path}'.")
+        with open(file_path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                if first_time is None:
+                    match = TIME_PATTERN.search(time_window + chunk)
+                    if match:
+                        first_time = match.group(1).decode("utf-8")
+                    time_window = (time_window + chunk)[-TIME_WINDOW:]
+
+                # Header: consume the first two lines
+                while header_lines < 2 and chunk:
+                    newline = chunk.find(b"\n")
+                    if newline < 0:
+                        header += chunk
+                        chunk = b""
+                    else:
+                        header += chunk[:newline + 1]
+                        chunk = chunk[newline + 1:]
+                        header_lines += 1
+
+                # Body: write all but the last line, which may still be the footer
+                pending += chunk
+                cut = pending.rfind(b"\n", 0, len(pending) - 1)
+                if cut >= 0:
+                    out.write(pending[:cut + 1])
+                    pending = pending[cut + 1:]
+
+        if header_lines < 2 or (header_lines == 2 and not pending):
+            logger.warning(f"File '{file_path}' has too few lines to be stripped. Writing it unchanged.")
+            out.write(header + pending)
+        else:
+            logger.debug(f"Successfully stripped header/footer from '{file_path}'.")
+        return first_time
 
     except FileNotFoundError:
         logger.error(f"File not found at path: {file_path}")
@@ -75,7 +93,7 @@ def strip_source_content(file_path: str) -> None:
         logger.error(f"IOError processing file '{file_path}': {e}")
         raise
     except Exception as e:
-        logger.error(f"An unexpected error occurred in strip_source_content for '{file_path}': {e}")
+        logger.error(f"An unexpected error occurred in strip_gpx_fragment for '{file_path}': {e}")
         raise
 
 @run_timer
@@ -89,13 +107,8 @@ def append_gpx_via_compose(local_gpx: str, bike_model: str, gpx_gcs_path: str =
     # Can only decrease if needed, not increase, its platform restricts
     max_compose = 32
 
-    # Forming name list for branch
-    bm = FirestoreMagic(
-        "bikes",
-        "models"
-    )
-    load_bike_models = bm.load_firejson()
-    branch = load_bike_models.get(bike_model)
+    # Forming name list for branch (cached bikes/models)
+    branch = load_bike_models().get(bike_model)
     if branch is None:
         logger.warning(f"Unknown bike_model: {bike_model}")
         return
@@ -103,68 +116,154 @@ def append_gpx_via_compose(local_gpx: str, bike_model: str, gpx_gcs_path: str =
     gpx_name, index_name, compose_name, name_bike = branch
     index_doc_name = index_name.replace('.txt', '')
 
+    # Extract date and strip header/footer in one pass; the original GPX stays untouched
+    local_fragment = f"{local_gpx}.fragment"
+    local_simplified = f"{local_gpx}.simplified"
+    try:
+        with open(local_fragment, "wb") as fragment:
+            first_date = strip_gpx_fragment(local_gpx, fragment)
+        if not first_date:
+            logger.warning(f"File '{local_gpx}' not include tag time.")
+            return
+
+        # One doc per date: checks and marks the date in a single round trip
+        if not claim_date(index_doc_name, first_date):
+            logger.warning(f"Date {first_date} already in the index. File not added.")
+            return
+
+        try:
+            heatmap_fragment = local_fragment
+            if HEATMAP_SIMPLIFY_TOLERANCE_M > 0:
+                # Only the heatmap copy is simplified, and only once the date is ours
+                simplify_gpx_file(local_fragment, local_simplified, HEATMAP_SIMPLIFY_TOLERANCE_M)
+                heatmap_fragment = local_simplified
+            if HEATMAP_COMPOSE_MODE == "tree":
+                add_fragment(heatmap_fragment, os.path.basename(local_gpx), gpx_name)
+            else:
+                _append_fragment(bucket, heatmap_fragment, os.path.basename(local_gpx), gpx_name, max_compose)
+        except Exception:
+            release_date(index_doc_name, first_date)
+            raise
+        logger.debug("Index activities updated in Firestore.")
+
+        if HEATMAP_GRID == "enable":
+            # The date is claimed once, so the grid counts each activity once; a failed grid
+            # update only leaves the grid behind the GPX heatmap
+            try:
+                update_grid_from_gpx(local_gpx, gpx_name)
+            except Exception as e:
+                logger.error(f"Density grid of '{gpx_name}' not updated with '{local_gpx}': {e}")
+    finally:
+        for temp_path in (local_fragment, local_simplified):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # Delete GPX from the bucket. But I need a single file for GIS analyze later. So, it will be deleted after this analyze (coming soon...)
+    # delete_blob(bucket_name, gpx_gcs_path)
+    # logger.info(f"GPX '{gpx_gcs_path}' deleting after union.")
+
+
+def _claim_spec(gpx_name: str, max_compose: int) -> tuple[str, str | None, dict]:
+    """
+    Counts the next compose in heatmap/specs (cached, written with a version precondition).
+    The precondition only keeps the counters from being overwritten with a stale copy; it does
+    not serialise the GCS composes of concurrent rides. Undo it with _restore_spec if the compose fails.
+    :return: (blob to compose into, successor blob if this compose reaches max_compose, previous state)
+    """
     ver = '00'
     base_data = {
                 "main_blob_name": f"heatmap/{gpx_name}_v{ver}.gpx",
                 "compose_count": 0,
                 "version": 0,
             }
+    for attempt in range(SPEC_WRITE_RETRIES):
+        specs, update_time = load_specs()
+        # Get value {"main_blob_name": "heatmap/...._v00.gpx", "compose_count": 0, "version": 0}
+        state = specs.get(gpx_name) or base_data
 
-    fs = FirestoreMagic(
-        "heatmap",
-        "specs",
-        placeholder_full=base_data
-    )
+        main_blob_name = state["main_blob_name"]
+        compose_count = state["compose_count"] + 1
+        version = state["version"]
+        successor_name = None
 
-    state = fs.load_firejson()
-    """ Loaded state from the Firestore.\n 
-    Get value {"main_blob_name": "heatmap/...._v00.gpx", "compose_count": 0, "version": 0}
-    """
-
-    # Load data form loaded state
-    main_blob_name = state[gpx_name]["main_blob_name"]
-    compose_count = state[gpx_name]["compose_count"]
-    version = state[gpx_name]["version"]
-
-    # Loading index from Firestore
-    template_index = {"dates": []}
-    fs_index = FirestoreMagic(
-        "heatmap",
-        index_doc_name,
-        placeholder_full=template_index
-    )
-    index_data = fs_index.load_firejson()
+        # If the limit is reached - create a new version
+        if compose_count >= max_compose:
+            version += 1
+            successor_name = f"heatmap/{gpx_name}_v{version:02d}.gpx"
+            compose_count = 1  # the first composition already gone
 
-    indexed_dates = set(index_data.get('dates', []))
+        new_state = {
+            "main_blob_name": successor_name or main_blob_name,
+            "compose_count": compose_count,
+            "version": version
+        }
+        try:
+            save_spec(gpx_name, new_state, update_time)
+            logger.debug(f"State updated in Firestore: compose_count={compose_count}, version={version}")
+            return main_blob_name, successor_name, state
+        except StaleHeatmapState as e:
+            logger.warning(f"{e} (attempt {attempt + 1}/{SPEC_WRITE_RETRIES})")
+    raise StaleHeatmapState(f"Could not update heatmap/specs for '{gpx_name}' after {SPEC_WRITE_RETRIES} attempts")
 
-    # Extract date
-    first_date = extract_first_time_tag(local_gpx)
-    if not first_date:
-        logger.warning(f"File '{local_gpx}' not include tag time.")
-        return
 
-    if first_date in indexed_dates:
-        logger.warning(f"Date {first_date} already in the index. File not added.")
-        return
+def _restore_spec(gpx_name: str, previous_state: dict) -> None:
+    """
+    Puts back the spec from before _claim_spec, so specs never point at a successor blob
+    that a failed compose did not create (the next ride would start an empty heatmap).
+    """
+    _, update_time = load_specs()
+    try:
+        save_spec(gpx_name, previous_state, update_time)
+        logger.info(f"heatmap/specs of '{gpx_name}' restored after a failed compose.")
+    except StaleHeatmapState as e:
+        logger.error(f"heatmap/specs of '{gpx_name}' not restored, check it by hand ({previous_state}): {e}")
 
-    strip_source_content(local_gpx)
 
+def _append_fragment(bucket, local_fragment: str, fragment_name: str, gpx_name: str, max_compose: int) -> None:
+    """ Uploads the stripped GPX fragment and composes it into the bike's heatmap blob."""
     # Loaded fragment to bucket
-    fragment_blob_name = f"heatmap/fragments/{os.path.basename(local_gpx)}"
-    # At this time local_gpx is stripped
+    fragment_blob_name = f"heatmap/fragments/{fragment_name}"
     up_frag = StorageManipulations(
         bucket_name,
         fragment_blob_name,
-        local_gpx,
+        local_fragment,
     )
     up_frag.upload_to_gcp_bucket("filename")
 
     # Union
     fragment_blob = bucket.blob(fragment_blob_name)
     if not fragment_blob.exists():
-        logger.error(f"Error: Fragment '{fragment_blob_name}' doesn't exist.")
-        return
+        raise FileNotFoundError(f"Fragment '{fragment_blob_name}' doesn't exist.")
+
+    main_blob_name, successor_name, previous_state = _claim_spec(gpx_name, max_compose)
+    try:
+        main_blob = _compose_into(bucket, fragment_blob, fragment_blob_name, gpx_name, main_blob_name)
+    except Exception:
+        _restore_spec(gpx_name, previous_state)
+        raise
+
+    if successor_name:
+        # Only one compose operation remained, we used it to create a successor
+        try:
+            bucket.blob(successor_name).compose([main_blob])
+        except Exception as e:
+            # The ride is already in main_blob: keep it there, the next ride retries the rollover
+            logger.error(f"Successor '{successor_name}' not created: {e}")
+            _restore_spec(gpx_name, previous_state)
+        else:
+            try:
+                delete_blob(bucket_name, main_blob_name)
+                logger.info(f"Previous version '{main_blob_name}' deleted.")
+            except Exception as e:
+                logger.error(f"Unable to delete {main_blob_name}: {e}")
+            logger.info(f"Create new version: '{successor_name}'")
 
+    # Delete fragment
+    delete_blob(bucket_name, fragment_blob_name)
+
+
+def _compose_into(bucket, fragment_blob, fragment_blob_name: str, gpx_name: str, main_blob_name: str):
+    """Composes the fragment into main_blob_name (created with the XML header if missing); returns the blob."""
     main_blob = bucket.blob(main_blob_name)
     if not main_blob.exists():
         logger.warning(f"Heatmap file doesn't exist. Creating empty blob with XML header. His compose version is 0")
@@ -183,44 +282,5 @@ def append_gpx_via_compose(local_gpx: str, bike_model: str, gpx_gcs_path: str =
         logger.debug(f"Heatmap created for '{gpx_name.upper()}' bike.")
 
     main_blob.compose([main_blob, fragment_blob])
-    compose_count += 1
     logger.debug(f"Fragment '{fragment_blob_name}' added to '{main_blob_name}'.")
-
-    # If the limit is reached - create a new version
-    if compose_count >= max_compose:
-        version += 1
-        new_main_blob_name = f"heatmap/{gpx_name}_v{version:02d}.gpx"
-        # Only one compose operation remained, we used it to create a successor
-        bucket.blob(new_main_blob_name).compose([main_blob])
-
-        try:
-            delete_blob(bucket_name, main_blob_name)
-            logger.info(f"Previous version '{main_blob_name}' deleted.")
-        except Exception as e:
-            logger.error(f"Unable to delete {main_blob_name}: {e}")
-
-        main_blob_name = new_main_blob_name
-        compose_count = 1  # the first composition already gone
-        logger.info(f"Create new version: '{main_blob_name}'")
-
-    # Update state in Firestore
-    state = {
-        "main_blob_name": main_blob_name,
-        "compose_count": compose_count,
-        "version": version
-    }
-    upd_spec = {f'{gpx_name}': state}
-    fs.set_firejson(upd_spec, True)
-    logger.debug(f"State updated in Firestore: compose_count={compose_count}, version={version}")
-
-    # Update index in Firestore
-    upd_index = {'dates': firestore.ArrayUnion([first_date])}
-    fs_index.set_firejson(upd_index, True)
-    logger.debug("Index activities updated in Firestore.")
-
-    # Delete fragment
-    delete_blob(bucket_name, fragment_blob_name)
-
-    # Delete GPX from the bucket. But I need a single file for GIS analyze later. So, it will be deleted after this analyze (coming soon...)
-    # delete_blob(bucket_name, gpx_gcs_path)
-    # logger.info(f"GPX '{gpx_gcs_path}' deleting after union.")
+    return main_blob
@@ -0,0 +1,194 @@
+"""
+Hierarchical compose tree for the GCS heatmap (HEATMAP_COMPOSE_MODE='tree').
+Instead of composing every ride into the growing main blob, a ride only uploads its fragment
+to level 0 of the bike's tree. Full groups of 32 objects (the compose limit) are merged into one
+object of the next level, so every byte is rewritten once per level (log32 of the ride count)
+and a ride costs O(1) object operations. The readable heatmap/<gpx_name>.gpx is assembled from
+the tree by publish_heatmap, on a schedule (/heatmap-compose-handler) rather than per ride.
+    heatmap/tree/<gpx_name>/L0/<ride fragment>
+    heatmap/tree/<gpx_name>/L1/<merge of 32 L0 objects>
+    ...
+Every operation that lists and composes or deletes tree objects holds the tree_<gpx_name> lease.
+Switching from HEATMAP_COMPOSE_MODE='linear': as long as a tree has no object above L0, every
+compaction and publish (under the lease) first seeds it with the current linear heatmap
+(specs main_blob_name, header stripped) as heatmap/tree/<gpx_name>/L1/<SEED_NAME>,
+so the published heatmap keeps every earlier ride (_seed_from_linear).
+"""
+import time
+import uuid
+
+from google.api_core.exceptions import PreconditionFailed
+from gcp_actions.client import get_bucket
+from power_core.heatmap_gpx.heatmap_state import acquire_lease, release_lease, load_bike_models, load_doc
+from power_core.project_env.config import HEATMAP_COMPOSE_THRESHOLD
+
+import logging
+logger = logging.getLogger(__name__)
+
+bucket_name = "GCS_BUCKET_NAME"
+MAX_COMPOSE = 32
+TREE_ROOT = "heatmap/tree"
+LEASE_SECONDS = 300
+SEED_NAME = "00000000000000000000-linear.gpx"    # sorts before every merge of its level
+SEED_CHUNK_SIZE = 8 * 1024 * 1024
+GPX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+        <gpx version="1.1" creator="SPipeline">
+         """
+
+
+def level_prefix(gpx_name: str, level: int) -> str:
+    return f"{TREE_ROOT}/{gpx_name}/L{level}/"
+
+
+def _list_levels(bucket, gpx_name: str) -> dict[int, list]:
+    """All tree objects of a bike as {level: blobs sorted by name}; levels may have gaps."""
+    levels = {}
+    for blob in bucket.list_blobs(prefix=f"{TREE_ROOT}/{gpx_name}/L"):
+        level = int(blob.name[len(f"{TREE_ROOT}/{gpx_name}/L"):].split("/", 1)[0])
+        levels.setdefault(level, []).append(blob)
+    for blobs in levels.values():
+        blobs.sort(key=lambda b: b.name)
+    return levels
+
+
+def _merge(bucket, sources: list, gpx_name: str, level: int):
+    """Composes sources into one new object of level, then deletes them; returns the new blob."""
+    # Time-ordered names keep the rides roughly in upload order
+    target = bucket.blob(f"{level_prefix(gpx_name, level)}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.gpx")
+    target.compose(sources)
+    for source in sources:
+        source.delete()
+    return target
+
+
+def _compact(bucket, gpx_name: str, force: bool) -> int:
+    """compact_tree without the lease (the caller holds it)."""
+    composes = 0
+    levels = _list_levels(bucket, gpx_name)
+    # The first L0 -> L1 merge would otherwise make the tree look seeded
+    _seed_from_linear(bucket, gpx_name, levels)
+    level = 0
+    while level <= max(levels, default=-1):
+        blobs = levels.get(level, [])
+        for i in range(0, len(blobs), MAX_COMPOSE):
+            group = blobs[i:i + MAX_COMPOSE]
+            if len(group) == MAX_COMPOSE or (force and len(blobs) > 1):
+                # The level above may grow past a full group and is merged in turn
+                levels.setdefault(level + 1, []).append(_merge(bucket, group, gpx_name, level + 1))
+                composes += 1
+        level += 1
+    if composes:
+        logger.info(f"Compose tree '{gpx_name}' compacted with {composes} compose call(s).")
+    return composes
+
+
+def compact_tree(gpx_name: str, force: bool = False) -> int:
+    """
+    Merges full groups of MAX_COMPOSE objects into the level above, level by level.
+    :param force: also merge partial groups, until every level holds at most one object
+    :return: number of compose calls (0 if another instance holds the lease)
+    """
+    lease = acquire_lease(f"tree_{gpx_name}", LEASE_SECONDS)
+    if lease is None:
+        logger.debug(f"Compose tree '{gpx_name}' is being compacted elsewhere.")
+        return 0
+    try:
+        return _compact(get_bucket(bucket_name), gpx_name, force)
+    finally:
+        release_lease(f"tree_{gpx_name}", lease)
+
+
+def _seed_from_linear(bucket, gpx_name: str, levels: dict[int, list]) -> bool:
+    """
+    Copies the bike's linear heatmap (heatmap/specs main_blob_name) into L1 of its tree, without
+    the XML header, so rides composed before HEATMAP_COMPOSE_MODE='tree' stay in the heatmap.
+    The caller holds the tree lease. Runs only while the tree has no object above L0, and the seed
+    is written with if_generation_match=0. The linear blob itself is left as it is.
+    :param levels: the tree as listed by _list_levels; the seed is added to it
+    :return: True if a seed was written
+    """
+    if any(level > 0 for level in levels):
+        return False
+    # Read fresh: a cached copy may predate the bike's last linear compose on another instance
+    specs, _ = load_doc("heatmap", "specs", max_age=0)
+    linear_name = (specs.get(gpx_name) or {}).get("main_blob_name")
+    linear_blob = bucket.get_blob(linear_name) if linear_name else None
+    if linear_blob is None:
+        return False
+
+    seed = bucket.blob(f"{level_prefix(gpx_name, 1)}{SEED_NAME}")
+    header = GPX_HEADER.encode("utf-8")
+    try:
+        with linear_blob.open("rb", chunk_size=SEED_CHUNK_SIZE) as src, \
+                seed.open("wb", chunk_size=SEED_CHUNK_SIZE, if_generation_match=0) as dst:
+            first = src.read(len(header))
+            if first != header:
+                dst.write(first)     # not our header: keep the bytes rather than lose a ride
+                logger.warning(f"'{linear_name}' does not start with the heatmap header, copied as is.")
+            while chunk := src.read(SEED_CHUNK_SIZE):
+                dst.write(chunk)
+    except PreconditionFailed:
+        return False
+    levels[1] = [seed]
+    logger.info(f"Compose tree '{gpx_name}' seeded with the linear heatmap '{linear_name}'.")
+    return True
+
+
+def add_fragment(local_fragment: str, fragment_name: str, gpx_name: str) -> None:
+    """
+    Per-ride step: uploads the stripped fragment to level 0 and merges when enough are waiting.
+    """
+    bucket = get_bucket(bucket_name)
+    bucket.blob(f"{level_prefix(gpx_name, 0)}{fragment_name}").upload_from_filename(local_fragment)
+    waiting = sum(1 for _ in bucket.list_blobs(prefix=level_prefix(gpx_name, 0)))
+    logger.debug(f"Fragment '{fragment_name}' added to the '{gpx_name}' tree ({waiting} waiting).")
+    if waiting >= HEATMAP_COMPOSE_THRESHOLD:
+        compact_tree(gpx_name)
+
+
+def publish_heatmap(gpx_name: str) -> str | None:
+    """
+    Assembles heatmap/<gpx_name>.gpx (XML header + every tree object, top level first).
+    The tree is force-compacted until the objects fit one compose call. Listing and compose run
+    under the tree lease, so a compaction elsewhere cannot delete the sources in between.
+    :return: name of the published blob, or None if the tree is empty or busy
+    """
+    lease = acquire_lease(f"tree_{gpx_name}", LEASE_SECONDS)
+    if lease is None:
+        logger.info(f"Compose tree '{gpx_name}' is busy, publishing skipped until the next run.")
+        return None
+    bucket = get_bucket(bucket_name)
+
+    def tree_objects() -> list:
+        levels = _list_levels(bucket, gpx_name)
+        return [blob for level in sorted(levels, reverse=True) for blob in levels[level]]
+
+    try:
+        # A tree still below MAX_COMPOSE objects was never compacted, so it may not be seeded yet
+        _seed_from_linear(bucket, gpx_name, _list_levels(bucket, gpx_name))
+        objects = tree_objects()
+        if len(objects) >= MAX_COMPOSE:
+            _compact(bucket, gpx_name, force=True)
+            objects = tree_objects()
+        if not objects:
+            return None
+        header = bucket.blob(f"{TREE_ROOT}/{gpx_name}/header.gpx")
+        if not header.exists():
+            header.upload_from_string(GPX_HEADER, content_type="application/gpx+xml")
+
+        main_name = f"heatmap/{gpx_name}.gpx"
+        bucket.blob(main_name).compose([header] + objects)
+    finally:
+        release_lease(f"tree_{gpx_name}", lease)
+    logger.info(f"Heatmap '{main_name}' published from {len(objects)} tree object(s).")
+    return main_name
+
+
+def publish_all_heatmaps() -> dict[str, str | None]:
+    """Scheduled job: publishes the heatmap of every bike in bikes/models."""
+    published = {}
+    for branch in load_bike_models().values():
+        gpx_name = branch[0]
+        if gpx_name not in published:
+            published[gpx_name] = publish_heatmap(gpx_name)
+    return published
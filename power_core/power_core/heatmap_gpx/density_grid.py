@@ -0,0 +1,147 @@
+"""
+Pre-aggregated heatmap: a per-bike density grid at several zoom levels (HEATMAP_GRID='enable').
+Every track point of an activity is binned into Web Mercator pixels (256 px tiles, like OSM)
+at each zoom of HEATMAP_GRID_ZOOMS. A zoom level is stored sparsely as two sorted arrays,
+pixel keys and counts, in one .npz per bike (heatmap/grid/<gpx_name>.npz in GCS_BUCKET_NAME).
+Keys are ordered tile first, so the pixels of one tile are a contiguous slice:
+    key = (tile_y * 2**zoom + tile_x) << 16 | pixel_y << 8 | pixel_x
+Adding an activity merges its counts into the arrays; rendering a tile is a binary search
+plus one slice, instead of re-parsing every trackpoint of the concatenated GPX.
+"""
+import io
+import re
+
+import numpy as np
+from google.api_core.exceptions import PreconditionFailed
+
+from gcp_actions.client import get_bucket
+from power_core.project_env.config import HEATMAP_GRID_ZOOMS
+
+import logging
+logger = logging.getLogger(__name__)
+
+bucket_name = "GCS_BUCKET_NAME"
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+TRKPT_PATTERN = re.compile(r'<trkpt\s+lat="(-?[\d.]+)"\s+lon="(-?[\d.]+)"')
+SAVE_RETRIES = 3
+
+DensityGrid = dict[int, tuple[np.ndarray, np.ndarray]]   # zoom -> (sorted keys, counts)
+
+
+def points_from_gpx(file_path: str) -> tuple[np.ndarray, np.ndarray]:
+    """Reads the trackpoints of a GPX file (line by line) into (lat, lon) arrays in degrees."""
+    lat, lon = [], []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            for match in TRKPT_PATTERN.finditer(line):
+                lat.append(float(match.group(1)))
+                lon.append(float(match.group(2)))
+    return np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+
+
+def pixel_keys(lat: np.ndarray, lon: np.ndarray, zoom: int) -> np.ndarray:
+    """Web Mercator pixel of every point at zoom, encoded as a tile-ordered int64 key."""
+    world = TILE_SIZE << zoom
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    x = (lon + 180.0) / 360.0 * world
+    sin_lat = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * world
+    x = np.clip(x.astype(np.int64), 0, world - 1)
+    y = np.clip(y.astype(np.int64), 0, world - 1)
+    tile = (y >> 8) * (1 << zoom) + (x >> 8)
+    return (tile << 16) | ((y & 0xFF) << 8) | (x & 0xFF)
+
+
+def add_points(grid: DensityGrid, lat: np.ndarray, lon: np.ndarray, zooms: tuple[int, ...]) -> DensityGrid:
+    """Bins the points at every zoom and merges them into grid (returned, updated)."""
+    valid = ~np.isnan(lat) & ~np.isnan(lon)
+    lat, lon = lat[valid], lon[valid]
+    for zoom in zooms:
+        new_keys, new_counts = np.unique(pixel_keys(lat, lon, zoom), return_counts=True)
+        keys, counts = grid.get(zoom, (np.empty(0, np.int64), np.empty(0, np.uint32)))
+        merged_keys, inverse = np.unique(np.concatenate((keys, new_keys)), return_inverse=True)
+        merged_counts = np.zeros(len(merged_keys), dtype=np.uint32)
+        np.add.at(merged_counts, inverse, np.concatenate((counts, new_counts)).astype(np.uint32))
+        grid[zoom] = (merged_keys, merged_counts)
+    return grid
+
+
+def render_tile(grid: DensityGrid, zoom: int, tile_x: int, tile_y: int) -> np.ndarray:
+    """Point counts of one 256x256 tile (row = pixel y); zeros if the zoom or tile is empty."""
+    tile = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint32)
+    if zoom not in grid:
+        return tile
+    keys, counts = grid[zoom]
+    tile_key = (tile_y * (1 << zoom) + tile_x) << 16
+    start, end = np.searchsorted(keys, [tile_key, tile_key + (1 << 16)])
+    pixels = keys[start:end] & 0xFFFF
+    tile[pixels >> 8, pixels & 0xFF] = counts[start:end]
+    return tile
+
+
+def tiles_at(grid: DensityGrid, zoom: int) -> list[tuple[int, int]]:
+    """(tile_x, tile_y) of every non-empty tile at zoom."""
+    if zoom not in grid:
+        return []
+    tiles = np.unique(grid[zoom][0] >> 16)
+    side = 1 << zoom
+    return [(int(t % side), int(t // side)) for t in tiles]
+
+
+def grid_to_bytes(grid: DensityGrid) -> bytes:
+    arrays = {}
+    for zoom, (keys, counts) in grid.items():
+        arrays[f"z{zoom}_keys"] = keys
+        arrays[f"z{zoom}_counts"] = counts
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def grid_from_bytes(data: bytes) -> DensityGrid:
+    grid = {}
+    with np.load(io.BytesIO(data)) as arrays:
+        for name in arrays.files:
+            if name.endswith("_keys"):
+                zoom = int(name[1:-len("_keys")])
+                grid[zoom] = (arrays[name], arrays[f"z{zoom}_counts"])
+    return grid
+
+
+def load_grid(gpx_name: str) -> tuple[DensityGrid, int]:
+    """
+    Downloads the bike's grid.
+    :return: (grid, generation of the object; 0 if there is no grid yet)
+    """
+    blob = get_bucket(bucket_name).get_blob(f"heatmap/grid/{gpx_name}.npz")
+    if blob is None:
+        return {}, 0
+    return grid_from_bytes(blob.download_as_bytes(if_generation_match=blob.generation)), blob.generation
+
+
+def update_grid_from_gpx(local_gpx: str, gpx_name: str, zooms: tuple[int, ...] = HEATMAP_GRID_ZOOMS) -> int:
+    """
+    Per-activity step: adds the GPX trackpoints to the bike's grid in GCS.
+    The upload only succeeds if nobody replaced the grid meanwhile (generation precondition).
+    :return: number of points added
+    """
+    lat, lon = points_from_gpx(local_gpx)
+    if not len(lat):
+        logger.warning(f"No trackpoints in '{local_gpx}', density grid unchanged.")
+        return 0
+
+    blob_name = f"heatmap/grid/{gpx_name}.npz"
+    for attempt in range(SAVE_RETRIES):
+        grid, generation = load_grid(gpx_name)
+        add_points(grid, lat, lon, zooms)
+        try:
+            get_bucket(bucket_name).blob(blob_name).upload_from_string(
+                grid_to_bytes(grid), content_type="application/octet-stream", if_generation_match=generation)
+        except PreconditionFailed:
+            logger.warning(f"Density grid '{blob_name}' changed concurrently (attempt {attempt + 1}/{SAVE_RETRIES})")
+            continue
+        pixels = {zoom: len(grid[zoom][0]) for zoom in zooms}
+        logger.debug(f"Density grid '{blob_name}' updated with {len(lat)} points, pixels per zoom: {pixels}")
+        return len(lat)
+    raise RuntimeError(f"Could not update density grid '{blob_name}' after {SAVE_RETRIES} attempts")
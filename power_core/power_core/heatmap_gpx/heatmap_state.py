@@ -0,0 +1,206 @@
+"""
+Cached, incremental Firestore state for the heatmap append.
+- bikes/models and heatmap/specs are kept in a bounded in-process cache together with their
+  update_time. Specs are written with a last_update_time precondition, so a cache made stale by
+  another instance is detected at write time (the write fails, the cache is dropped, the caller retries).
+  This keeps the counters consistent only; the GCS composes of concurrent rides are not serialised.
+  The models mapping is only read here; it is re-read after HEATMAP_STATE_CACHE_TTL seconds.
+- The date index is one doc per activity date (heatmap/<index>/dates/<date>) instead of a growing
+  'dates' array: create() is the membership check and the mark in one round trip.
+  Legacy array indexes are migrated to date docs on first use (migrate_date_index).
+- Leases (heatmap/lease_<name>) keep two instances from compacting the same compose tree.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud import firestore
+from gcp_actions.client import get_any_client
+from power_core.project_env.config import HEATMAP_STATE_CACHE_TTL
+
+import logging
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_DOCS = 64
+MIGRATION_BATCH = 500
+DATES_COLLECTION = "dates"
+
+
+class StaleHeatmapState(Exception):
+    """The cached specs were changed by someone else; reload and try again."""
+
+
+class _DocCache:
+    """Bounded LRU of {(collection, doc): (data, update_time, loaded_at)}."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, str]):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key: tuple[str, str], data: dict, update_time):
+        with self._lock:
+            self._items[key] = (data, update_time, time.monotonic())
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def drop(self, key: tuple[str, str]):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+_cache = _DocCache(CACHE_MAX_DOCS)
+_migrated_indexes = set()
+
+
+def _doc_ref(collection: str, doc: str):
+    return get_any_client("firestore").collection(collection).document(doc)
+
+
+def load_doc(collection: str, doc: str, max_age: float | None = None) -> tuple[dict, object]:
+    """
+    Returns (data, update_time) of a doc, from the cache when possible.
+    :param max_age: seconds after which a cached copy is re-read (None: kept until dropped)
+    A missing doc is returned as ({}, None).
+    """
+    key = (collection, doc)
+    cached = _cache.get(key)
+    if cached is not None and (max_age is None or time.monotonic() - cached[2] < max_age):
+        return cached[0], cached[1]
+
+    snapshot = _doc_ref(collection, doc).get()
+    data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    update_time = snapshot.update_time if snapshot.exists else None
+    if cached is not None and cached[1] != update_time:
+        logger.debug(f"{collection}/{doc} changed since it was cached.")
+    _cache.put(key, data, update_time)
+    return data, update_time
+
+
+def load_bike_models() -> dict:
+    """The bikes/models mapping {bike_model: [gpx_name, index_name, compose_name, name_bike]}."""
+    data, _ = load_doc("bikes", "models", max_age=HEATMAP_STATE_CACHE_TTL)
+    return data
+
+
+def load_specs() -> tuple[dict, object]:
+    """The heatmap/specs doc {gpx_name: {main_blob_name, compose_count, version}} and its update_time."""
+    return load_doc("heatmap", "specs")
+
+
+def save_spec(gpx_name: str, spec: dict, update_time) -> None:
+    """
+    Writes one bike's spec only if heatmap/specs still has update_time, then refreshes the cache.
+    :raises StaleHeatmapState: the doc was written by someone else since it was loaded
+    """
+    key = ("heatmap", "specs")
+    doc_ref = _doc_ref(*key)
+    try:
+        if update_time is None:
+            result = doc_ref.create({gpx_name: spec})
+        else:
+            option = get_any_client("firestore").write_option(last_update_time=update_time)
+            result = doc_ref.update({gpx_name: spec}, option=option)
+    except (AlreadyExists, FailedPrecondition, NotFound) as e:
+        _cache.drop(key)
+        raise StaleHeatmapState(f"heatmap/specs changed concurrently: {e}") from e
+
+    cached = _cache.get(key)
+    data = dict(cached[0]) if cached is not None else {}
+    data[gpx_name] = spec
+    _cache.put(key, data, result.update_time)
+
+
+def _date_key(date: str) -> str:
+    # Document ids may not contain '/'
+    return date.replace("/", "_")
+
+
+def claim_date(index_doc_name: str, date: str) -> bool:
+    """
+    Marks date as indexed for this bike.
+    :return: False if it was already indexed (the activity is in the heatmap)
+    """
+    if index_doc_name not in _migrated_indexes:
+        migrate_date_index(index_doc_name)
+    date_ref = _doc_ref("heatmap", index_doc_name).collection(DATES_COLLECTION).document(_date_key(date))
+    try:
+        date_ref.create({"date": date, "indexed_at": firestore.SERVER_TIMESTAMP})
+        return True
+    except AlreadyExists:
+        return False
+
+
+def release_date(index_doc_name: str, date: str) -> None:
+    """Undoes claim_date when the append failed, so the activity can be added again."""
+    _doc_ref("heatmap", index_doc_name).collection(DATES_COLLECTION).document(_date_key(date)).delete()
+
+
+def migrate_date_index(index_doc_name: str) -> int:
+    """
+    Moves a legacy {'dates': [...]} index into one doc per date and removes the array.
+    Safe to run more than once.
+    :return: number of dates migrated
+    """
+    index_ref = _doc_ref("heatmap", index_doc_name)
+    snapshot = index_ref.get()
+    dates = (snapshot.to_dict() or {}).get("dates", []) if snapshot.exists else []
+
+    if dates:
+        db = get_any_client("firestore")
+        dates_ref = index_ref.collection(DATES_COLLECTION)
+        for i in range(0, len(dates), MIGRATION_BATCH):
+            batch = db.batch()
+            for date in dates[i:i + MIGRATION_BATCH]:
+                batch.set(dates_ref.document(_date_key(date)), {"date": date, "indexed_at": firestore.SERVER_TIMESTAMP})
+            batch.commit()
+        index_ref.update({"dates": firestore.DELETE_FIELD})
+        logger.info(f"Date index '{index_doc_name}' migrated: {len(dates)} dates moved to '{DATES_COLLECTION}' docs.")
+
+    _migrated_indexes.add(index_doc_name)
+    return len(dates)
+
+
+def acquire_lease(name: str, ttl_seconds: float):
+    """
+    Takes the lease heatmap/lease_<name> if it is free or expired.
+    :return: the lease token (update_time of our write) to pass to release_lease,
+        or None if another holder's lease is still valid
+    """
+    lease_ref = _doc_ref("heatmap", f"lease_{name}")
+    now = datetime.now(timezone.utc)
+    lease = {"expires_at": now + timedelta(seconds=ttl_seconds)}
+    try:
+        return lease_ref.create(lease).update_time
+    except AlreadyExists:
+        pass
+
+    snapshot = lease_ref.get()
+    expires_at = (snapshot.to_dict() or {}).get("expires_at") if snapshot.exists else None
+    if expires_at is not None and expires_at > now:
+        return None
+    try:
+        # Take over the expired lease, unless someone else just did
+        option = get_any_client("firestore").write_option(last_update_time=snapshot.update_time)
+        return lease_ref.update(lease, option=option).update_time
+    except (FailedPrecondition, NotFound):
+        return None
+
+
+def release_lease(name: str, token) -> None:
+    """Deletes the lease only if it is still ours (nobody took it over after it expired)."""
+    try:
+        option = get_any_client("firestore").write_option(last_update_time=token)
+        _doc_ref("heatmap", f"lease_{name}").delete(option=option)
+    except (FailedPrecondition, NotFound):
+        logger.warning(f"Lease '{name}' expired and was taken over before it was released.")
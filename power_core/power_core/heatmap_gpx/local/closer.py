@@ -1,40 +1,146 @@
 """
 Adding closer tag to heatmap file before direct using in OSM or JOSM
 Work locally
+Only a small tail buffer is read (seek to the end), so the size of the heatmap does not matter.
+    python closer.py mtb.gpx gravel.gpx              close local files in place
+    python closer.py --download mtb --out mtb.gpx    stream the latest composed version from
+                                                     GCS_BUCKET_NAME and close it on the fly
 """
+import argparse
+import os
+import shutil
 import sys
-import re
-
-closer_tag="</gpx>"
-
-def check_if_exist(filename1: str) -> str | None:
-    with open(filename1, "r", encoding="utf-8") as file:
-        lines=file.readlines()[-2:]
-        combined = "".join(lines)
-        find = re.search(closer_tag,combined)
-        if find:
-            print("Error! Closer tag already present"+"\n"+f"{combined}")
-            return None
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+closer_tag = b"</gpx>"
+TAIL_SIZE = 4096
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def read_tail(f, tail_size: int = TAIL_SIZE) -> bytes:
+    """Last tail_size bytes of a binary file (position is left at the end)."""
+    f.seek(0, os.SEEK_END)
+    f.seek(max(0, f.tell() - tail_size))
+    return f.read()
+
+
+def has_closer(tail: bytes) -> bool:
+    return tail.rstrip().endswith(closer_tag)
+
+
+def lock_file(f) -> bool:
+    """
+    Non-blocking exclusive lock of an open file: msvcrt.locking of its first byte on Windows
+    (power.sh runs the closer there), flock elsewhere. The OS drops it if the process dies.
+    :return: False if another run holds the lock
+    """
+    try:
+        if os.name == "nt":
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
         else:
-            add_closer(filename1)
-            print("Two last line"+"\n"+f"{combined}")
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def unlock_file(f) -> None:
+    if os.name == "nt":
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def check_if_exist(filename1: str) -> bool:
+    """
+    Appends the closer tag unless the file already ends with it.
+    The check and the append happen under an exclusive lock on the file itself (lock_file),
+    and the tag is one write + fsync.
+    :return: True if the tag was added
+    """
+    with open(filename1, "r+b") as file:
+        if not lock_file(file):
+            print(f"Error! '{filename1}' is being closed by another run")
+            return False
+        try:
+            tail = read_tail(file)
+            if has_closer(tail):
+                print("Error! Closer tag already present" + "\n" + tail[-200:].decode("utf-8", "replace"))
+                return False
             print("Tag doesnt exist, adding...")
-            return None
+            add_closer(file, tail)
+            return True
+        finally:
+            unlock_file(file)
+
 
-def add_closer(filename2: str) -> str | None:
-    with open(filename2, "a", encoding="utf-8") as f:
-        f.write(closer_tag)
+def add_closer(f, tail: bytes) -> None:
+    """Writes the tag at the end of an open binary file (on its own line) and flushes it to disk."""
+    f.seek(0, os.SEEK_END)
+    f.write(closer_tag if not tail or tail.endswith(b"\n") else b"\n" + closer_tag)
+    f.flush()
+    os.fsync(f.fileno())
     print("Adding successfully")
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python script.py <filename>")
-        sys.exit(1)
 
-    filename = sys.argv[1]
-    check_if_exist(filename)
+def latest_heatmap_blob(bucket, gpx_name: str):
+    """
+    Newest composed heatmap of a bike: heatmap/<gpx_name>.gpx (compose tree)
+    or the highest heatmap/<gpx_name>_vNN.gpx (linear compose).
+    """
+    candidates = [
+        blob for blob in bucket.list_blobs(prefix=f"heatmap/{gpx_name}")
+        if blob.name == f"heatmap/{gpx_name}.gpx"
+        or (blob.name.startswith(f"heatmap/{gpx_name}_v") and blob.name.endswith(".gpx"))
+    ]
+    return max(candidates, key=lambda b: b.updated, default=None)
 
 
+def download_closed(gpx_name: str, out_path: str) -> bool:
+    """
+    Streams the latest heatmap of gpx_name to out_path, appending the closer tag if missing.
+    The copy goes to '<out_path>.part' and is renamed at the end, so out_path is never half-written.
+    :return: False if the bike has no heatmap in the bucket
+    """
+    from gcp_actions.client import get_bucket
 
+    blob = latest_heatmap_blob(get_bucket("GCS_BUCKET_NAME"), gpx_name)
+    if blob is None:
+        print(f"Error! No heatmap found for '{gpx_name}'")
+        return False
 
+    part_path = f"{out_path}.part"
+    print(f"Downloading '{blob.name}' ({blob.size} bytes)...")
+    with blob.open("rb", chunk_size=DOWNLOAD_CHUNK_SIZE) as src, open(part_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_SIZE)
+    with open(part_path, "r+b") as file:
+        tail = read_tail(file)
+        if not has_closer(tail):
+            add_closer(file, tail)
+    os.replace(part_path, out_path)
+    print(f"Saved to '{out_path}'")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the closing </gpx> tag to heatmap files")
+    parser.add_argument("files", nargs="*", help="local heatmap files to close in place")
+    parser.add_argument("--download", metavar="GPX_NAME", help="bike heatmap to download from GCS_BUCKET_NAME")
+    parser.add_argument("--out", help="local path of the downloaded heatmap (default: <GPX_NAME>.gpx)")
+    args = parser.parse_args()
+
+    if not args.files and not args.download:
+        parser.print_usage()
+        sys.exit(1)
 
+    if args.download:
+        if not download_closed(args.download, args.out or f"{args.download}.gpx"):
+            sys.exit(1)
+    for filename in args.files:
+        check_if_exist(filename)
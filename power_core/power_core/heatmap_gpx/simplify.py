@@ -0,0 +1,152 @@
+"""
+Douglas–Peucker simplification of GPX tracks before the heatmap append
+(HEATMAP_SIMPLIFY_TOLERANCE_M > 0). A 1 Hz ride has far more points than a heatmap can show;
+every point closer than the tolerance to the simplified line is dropped.
+The algorithm runs level by level instead of recursing: each pass measures every point
+against the segment between its kept neighbours (one NumPy expression over the whole track)
+and keeps the farthest point of every segment still above the tolerance.
+Files are streamed: only one <trkseg> is held in memory at a time.
+"""
+import re
+
+import numpy as np
+
+from power_core.workshop.vector_cleaner import EARTH_RADIUS_M
+
+import logging
+logger = logging.getLogger(__name__)
+
+TRKSEG_PATTERN = re.compile(r"(<trkseg\b[^>]*>)(.*?)(</trkseg>)", re.DOTALL)
+# A whole trackpoint element with the whitespace before it, so a dropped point leaves no blank line
+TRKPT_PATTERN = re.compile(r'\s*<trkpt\s+lat="(-?[\d.]+)"\s+lon="(-?[\d.]+)"\s*(?:/>|>.*?</trkpt>)', re.DOTALL)
+TRKSEG_OPEN = "<trkseg"
+TRKSEG_CLOSE = "</trkseg>"
+READ_CHUNK_CHARS = 1024 * 1024
+
+
+def to_local_meters(lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Equirectangular projection around the track's mean latitude (fine at track scale)."""
+    cos_lat = np.cos(np.radians(np.mean(lat)))
+    return np.radians(lon) * EARTH_RADIUS_M * cos_lat, np.radians(lat) * EARTH_RADIUS_M
+
+
+def douglas_peucker_mask(x: np.ndarray, y: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    :param x, y: point coordinates in meters
+    :return: boolean mask of the points to keep (first and last are always kept)
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+    keep[[0, n - 1]] = True
+    index = np.arange(n)
+
+    while True:
+        kept = np.flatnonzero(keep)
+        # Segment of every point: between the kept points around it
+        segment = np.searchsorted(kept, index, side="right") - 1
+        segment[-1] = len(kept) - 2
+        start, end = kept[segment], kept[segment + 1]
+
+        # Distance to the segment start-end (clamped to the segment)
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length2 > 0, ((x - x[start]) * dx + (y - y[start]) * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distance = np.hypot(x - (x[start] + t * dx), y - (y[start] + t * dy))
+        distance[keep] = 0.0
+
+        # Farthest point of every segment (segments are contiguous runs of points)
+        farthest = np.maximum.reduceat(distance, kept[:-1])
+        split = farthest > tolerance_m
+        if not split.any():
+            return keep
+        candidates = (distance == farthest[segment]) & split[segment] & ~keep
+        _, first = np.unique(segment[candidates], return_index=True)
+        keep[np.flatnonzero(candidates)[first]] = True
+
+
+def simplify_gpx_text(text: str, tolerance_m: float) -> tuple[str, dict]:
+    """
+    Drops the trackpoints of every <trkseg> that Douglas–Peucker does not keep; the rest of
+    the document is copied as is.
+    :return: (simplified GPX, {"points_in", "points_kept", "points_dropped", "kept_ratio"})
+    """
+    points_in = points_kept = 0
+
+    def simplify_segment(match: re.Match) -> str:
+        nonlocal points_in, points_kept
+        body = match.group(2)
+        points = list(TRKPT_PATTERN.finditer(body))
+        if len(points) <= 2:
+            points_in += len(points)
+            points_kept += len(points)
+            return match.group(0)
+        lat = np.array([float(p.group(1)) for p in points])
+        lon = np.array([float(p.group(2)) for p in points])
+        keep = douglas_peucker_mask(*to_local_meters(lat, lon), tolerance_m)
+        points_in += len(points)
+        points_kept += int(keep.sum())
+
+        parts, position = [], 0
+        for point, kept in zip(points, keep):
+            if not kept:
+                parts.append(body[position:point.start()])
+                position = point.end()
+        parts.append(body[position:])
+        return match.group(1) + "".join(parts) + match.group(3)
+
+    simplified = TRKSEG_PATTERN.sub(simplify_segment, text)
+    stats = {
+        "points_in": points_in,
+        "points_kept": points_kept,
+        "points_dropped": points_in - points_kept,
+        "kept_ratio": round(points_kept / points_in, 3) if points_in else 1.0,
+    }
+    return simplified, stats
+
+
+def simplify_gpx_file(in_path: str, out_path: str, tolerance_m: float) -> dict:
+    """
+    Writes the simplified copy of in_path to out_path and logs the point stats.
+    in_path is read in READ_CHUNK_CHARS parts; text outside the segments is copied as it comes.
+    """
+    points_in = points_kept = chars_in = chars_out = 0
+    with open(in_path, "r", encoding="utf-8") as src, open(out_path, "w", encoding="utf-8") as dst:
+        pending = ""
+        for chunk in iter(lambda: src.read(READ_CHUNK_CHARS), ""):
+            chars_in += len(chunk)
+            # The closing tag may straddle the previous chunk boundary
+            search_from = max(0, len(pending) - len(TRKSEG_CLOSE))
+            pending += chunk
+            while (end := pending.find(TRKSEG_CLOSE, search_from)) >= 0:
+                end += len(TRKSEG_CLOSE)
+                simplified, segment_stats = simplify_gpx_text(pending[:end], tolerance_m)
+                points_in += segment_stats["points_in"]
+                points_kept += segment_stats["points_kept"]
+                dst.write(simplified)
+                chars_out += len(simplified)
+                pending, search_from = pending[end:], 0
+            # Copy the text before the next segment; without one, keep a tail that may hold a split "<trkseg"
+            start = pending.find(TRKSEG_OPEN)
+            flush = start if start >= 0 else max(0, len(pending) - len(TRKSEG_OPEN))
+            if flush:
+                dst.write(pending[:flush])
+                chars_out += flush
+                pending = pending[flush:]
+        dst.write(pending)
+        chars_out += len(pending)
+
+    stats = {
+        "points_in": points_in,
+        "points_kept": points_kept,
+        "points_dropped": points_in - points_kept,
+        "kept_ratio": round(points_kept / points_in, 3) if points_in else 1.0,
+    }
+    logger.info(
+        f"Track '{in_path}' simplified at {tolerance_m} m: {stats['points_kept']}/{stats['points_in']} points kept, "
+        f"{stats['points_dropped']} dropped ({chars_in} -> {chars_out} chars)")
+    return stats
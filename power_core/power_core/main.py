@@ -93,6 +93,8 @@ def create_app():
     """
 
     from flask import Flask
+    from power_core.project_env.config import PUBSUB_ASYNC_MODE
+    from power_core.workshop.work_queue import install_drain_handler
     from power_core.routes.transfer import bp1 as upload_bp
     from power_core.routes.transfer import bp2 as transfer_bp
     from power_core.routes.transfer import bp3 as transfer_pubic
@@ -106,6 +108,9 @@ def create_app():
     app.register_blueprint(transfer_pubic)
     app.register_blueprint(transfer_private)
 
+    if PUBSUB_ASYNC_MODE == "enable":
+        install_drain_handler()
+
     return app
 
 # --- 2. Create the App Instance ---
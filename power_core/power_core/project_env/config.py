@@ -44,6 +44,77 @@ try:
     GCS_PUB_OUTPUT_BUCKET=os.environ.get("GCS_PUB_OUTPUT_BUCKET")
     EMAIL_MODE=os.environ.get("EMAIL_MODE")
     STRAVA_UPLOAD = os.environ.get("STRAVA_UPLOAD")
+    # 'jar' (FitCSVTool.jar subprocess) or 'native' (in-process fit_codec decode + encode)
+    FIT_CODEC = os.environ.get("FIT_CODEC", "jar")
+    # 'csv' (decode -> regex cleaning -> encode) or 'binary' (patch the FIT records in place)
+    FIT_REPAIR_MODE = os.environ.get("FIT_REPAIR_MODE", "csv")
+    # 'enable': the public repair flow keeps the file in memory between stages (no /tmp copies)
+    PIPELINE_IN_MEMORY = os.environ.get("PIPELINE_IN_MEMORY", "disable")
+    # 'enable': write the fixed CSV (private) and the re-encoded FIT (public, native codec)
+    # into resumable GCS uploads while they are produced, instead of uploading a finished local file
+    GCS_STREAMING_UPLOAD = os.environ.get("GCS_STREAMING_UPLOAD", "disable")
+    # Threads for pipeline stages that can run at the same time (uploads, Strava, email)
+    PIPELINE_MAX_WORKERS = int(os.environ.get("PIPELINE_MAX_WORKERS", "4"))
+    # 'enable': Pub/Sub push handlers queue the pipeline in-process and answer 204 right away
+    # (workshop/work_queue.py); 429 when ASYNC_QUEUE_MAX_PENDING jobs are already accepted
+    # Jobs run after the response: on Cloud Run this needs CPU always allocated (--no-cpu-throttling)
+    PUBSUB_ASYNC_MODE = os.environ.get("PUBSUB_ASYNC_MODE", "disable")
+    ASYNC_QUEUE_WORKERS = int(os.environ.get("ASYNC_QUEUE_WORKERS", "4"))
+    ASYNC_QUEUE_MAX_PENDING = int(os.environ.get("ASYNC_QUEUE_MAX_PENDING", "16"))
+    # Seconds running jobs get on SIGTERM (Cloud Run allows 10 s before SIGKILL)
+    ASYNC_DRAIN_TIMEOUT = float(os.environ.get("ASYNC_DRAIN_TIMEOUT", "8"))
+    # Streaming-pull worker (power_core/pull_main.py): subscription, flow control and process pool
+    PULL_SUBSCRIPTION = os.environ.get("PULL_SUBSCRIPTION")
+    PULL_MAX_MESSAGES = int(os.environ.get("PULL_MAX_MESSAGES", "4"))
+    PULL_MAX_BYTES = int(os.environ.get("PULL_MAX_BYTES", str(100 * 1024 * 1024)))
+    PULL_PROCESSES = int(os.environ.get("PULL_PROCESSES", "2"))
+    # In-process cache of recently seen message ids in front of the Firestore idempotency docs
+    IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000"))
+    IDEMPOTENCY_CACHE_TTL = float(os.environ.get("IDEMPOTENCY_CACHE_TTL", "600"))
+    # Seconds the cached bikes/models mapping is used before it is re-read (heatmap_gpx/heatmap_state.py)
+    HEATMAP_STATE_CACHE_TTL = float(os.environ.get("HEATMAP_STATE_CACHE_TTL", "300"))
+    # 'tree': rides are stored as fragments and merged in groups of 32 (heatmap_gpx/compose_tree.py);
+    # 'linear': every ride is composed into the main heatmap blob
+    HEATMAP_COMPOSE_MODE = os.environ.get("HEATMAP_COMPOSE_MODE", "linear")
+    # Fragments waiting at the bottom of the tree before a merge is triggered by a ride
+    HEATMAP_COMPOSE_THRESHOLD = int(os.environ.get("HEATMAP_COMPOSE_THRESHOLD", "32"))
+    # 'enable': every new activity is also binned into the bike's density grid (heatmap_gpx/density_grid.py),
+    # at these Web Mercator zoom levels
+    HEATMAP_GRID = os.environ.get("HEATMAP_GRID", "disable")
+    HEATMAP_GRID_ZOOMS = tuple(int(z) for z in os.environ.get("HEATMAP_GRID_ZOOMS", "8,11,14").split(","))
+    # Douglas–Peucker tolerance (m) for the track copy appended to the heatmap; 0 keeps every point
+    HEATMAP_SIMPLIFY_TOLERANCE_M = float(os.environ.get("HEATMAP_SIMPLIFY_TOLERANCE_M", "0"))
+    # Parallel connections of the binary COPY bulk loader (database/bulk_loader.py)
+    PG_BULK_CONNECTIONS = int(os.environ.get("PG_BULK_CONNECTIONS", "4"))
+    # PostgreSQL connection pool (database/db_conect.py); max size follows the gunicorn threads
+    # (Dockerfile: --threads $GUNICORN_THREADS), acquire timeout in seconds
+    GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", "8"))
+    PG_POOL_MIN_SIZE = int(os.environ.get("PG_POOL_MIN_SIZE", "1"))
+    PG_POOL_MAX_SIZE = int(os.environ.get("PG_POOL_MAX_SIZE", str(GUNICORN_THREADS)))
+    PG_POOL_TIMEOUT = float(os.environ.get("PG_POOL_TIMEOUT", "10"))
+    # Warm FitCSVTool JVMs (workshop/jvm_pool.py): max concurrent JVMs, per-job timeout (s),
+    # jobs before a JVM is recycled, heap per JVM
+    FIT_JVM_POOL_SIZE = int(os.environ.get("FIT_JVM_POOL_SIZE", "2"))
+    FIT_JVM_JOB_TIMEOUT = int(os.environ.get("FIT_JVM_JOB_TIMEOUT", "120"))
+    FIT_JVM_MAX_JOBS = int(os.environ.get("FIT_JVM_MAX_JOBS", "200"))
+    FIT_JVM_XMX = os.environ.get("FIT_JVM_XMX", "256m")
+    # Sensor -> Strava gear table: JSON {"<ant_device_number>": "<gear_id>"} overriding the built-in one,
+    # and an optional Firestore doc in 'bikes' with the same shape, merged on top
+    GEAR_SENSORS = os.environ.get("GEAR_SENSORS")
+    GEAR_SENSORS_FIRESTORE_DOC = os.environ.get("GEAR_SENSORS_FIRESTORE_DOC")
+    # 'regex' (line by line) or 'vector' (NumPy record columns, workshop/vector_cleaner.py)
+    CLEANING_ENGINE = os.environ.get("CLEANING_ENGINE", "regex")
+    # Vector engine limits, m/s: recorded speed spike, implied speed of a teleport jump
+    CLEAN_SPEED_SPIKE_MS = float(os.environ.get("CLEAN_SPEED_SPIKE_MS", "40"))
+    CLEAN_TELEPORT_SPEED_MS = float(os.environ.get("CLEAN_TELEPORT_SPEED_MS", "100"))
+    # Regex engine: detectors run per batch of lines, in this order (workshop/detectors.py)
+    CLEANING_DETECTORS = os.environ.get("CLEANING_DETECTORS", "negative_lat,serial_number")
+    CLEANING_BATCH_SIZE = int(os.environ.get("CLEANING_BATCH_SIZE", "1000"))
+    CLEAN_ALTITUDE_SPIKE_M = float(os.environ.get("CLEAN_ALTITUDE_SPIKE_M", "50"))
+    # altitude_spike re-anchors on a real step: after this many rejections in a row, or after a time gap (s)
+    CLEAN_ALTITUDE_SPIKE_RUN = int(os.environ.get("CLEAN_ALTITUDE_SPIKE_RUN", "3"))
+    CLEAN_ALTITUDE_GAP_S = int(os.environ.get("CLEAN_ALTITUDE_GAP_S", "30"))
+    CLEAN_GPS_ACCURACY_M = int(os.environ.get("CLEAN_GPS_ACCURACY_M", "50"))
 
 
     # -------------- Brevo Email --------------
@@ -62,6 +133,10 @@ try:
     EVENTARC_TRIGGER=os.environ.get("EVENTARC_TRIGGER")
     GCP_TOPIC_NAME=os.environ.get("GCP_TOPIC_NAME")
     DROPBOX_TOPIC_NAME=os.environ.get("DROPBOX_TOPIC_NAME")
+    # Batch mode: files per Pub/Sub message on DROPBOX_BATCH_TOPIC_NAME (0 = one message per file)
+    DROPBOX_BATCH_TOPIC_NAME=os.environ.get("DROPBOX_BATCH_TOPIC_NAME")
+    DROPBOX_BATCH_SIZE = int(os.environ.get("DROPBOX_BATCH_SIZE", "0"))
+    BATCH_MAX_PARALLEL = int(os.environ.get("BATCH_MAX_PARALLEL", "4"))
     DROpbox_WEBHOOK_PATH=os.environ.get("DROpbox_WEBHOOK_PATH")
     COOKIE_DOMAIN=os.environ.get("COOKIE_DOMAIN")
     # Dropbox and Strava
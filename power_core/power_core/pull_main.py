@@ -0,0 +1,40 @@
+"""
+Entry point of the streaming-pull worker (see workshop/pull_worker.py):
+    python -m power_core.pull_main public|private [--subscription NAME]
+"""
+import argparse
+import sys
+from gcp_actions.common_utils.init_config import InjectConfig
+from gcp_actions.common_utils.handle_logs import run_handle_logs
+import logging
+
+run_handle_logs()
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ActivityProcessingPipeline from a Pub/Sub pull subscription.")
+    parser.add_argument("style", choices=["public", "private"], help="pipeline strategy of the subscribed topic")
+    parser.add_argument("--subscription", help="subscription name (default: PULL_SUBSCRIPTION)")
+    args = parser.parse_args()
+
+    try:
+        ic = InjectConfig(["APP_JSON_KEYS"], [None])
+        ic.load_and_inject_config()
+    except Exception as e:
+        logger.critical(f"FATAL ERROR: Could not load configuration. {e}")
+        sys.exit(1)
+
+    # Imported after the config is injected, like the blueprints in main.create_app
+    from power_core.project_env.config import PULL_SUBSCRIPTION
+    from power_core.workshop.pull_worker import PullWorker
+
+    subscription = args.subscription or PULL_SUBSCRIPTION
+    if not subscription:
+        logger.critical("No subscription: pass --subscription or set PULL_SUBSCRIPTION.")
+        sys.exit(1)
+    PullWorker(args.style).run_forever(subscription)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 import base64
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from flask import request
+from google.api_core.exceptions import AlreadyExists
 from google.cloud import firestore
 from google.cloud.firestore import SERVER_TIMESTAMP
 from gcp_actions.client import get_any_client
 from gcp_actions.firestore_box.json_manipulations import FirestoreMagic
 from power_core.workshop.workers import ActivityProcessingPipeline
+from power_core.workshop.batch_runner import open_batch_clients, run_private_batch
+from power_core.workshop.work_queue import get_work_queue
+from power_core.project_env.config import PUBSUB_ASYNC_MODE, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL
+from power_core.utilites.seen_cache import SeenCache
 
 logger = logging.getLogger(__name__)
 
@@ -20,59 +26,109 @@ PIPELINE_CONFIG = {
         "pipeline_args": ["original_filename", "dropbox_path"]
     },
     "public": {
-        "required_fields": ["file_data", "user_email", "original_filename", "upload_id"],
+        "required_fields": ["user_email", "original_filename", "upload_id"],
+        # the file comes inline (base64) or as a pointer to the staging object in GCS_PUB_OUTPUT_BUCKET
+        "file_fields": ["file_data", "staging_blob"],
         "collection": "processed_messages",
         "method": "run_repair_flow",
-        "pipeline_args": ["original_filename", "user_email", "file_data", "locale"]
+        "pipeline_args": ["original_filename", "user_email", "file_data", "staging_blob", "locale"]
     }
 }
 
 
+# Recently seen idempotency keys ("<collection>/<key>"): hot redeliveries never reach Firestore
+SEEN_MESSAGES = SeenCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL)
+STATS_LOG_EVERY = 1000
+
+
 def check_and_mark_processed(idempotency_key: str, collection_name: str, ttl_hours: int = 24) -> bool:
     """
     Checks if a message is processed. Returns True if duplicate, False if new.
+    The doc is written with create(), which fails if it exists: one atomic round trip,
+    so concurrent deliveries of the same message cannot both be treated as new.
     """
+    cache_key = f"{collection_name}/{idempotency_key}"
+    if cache_key in SEEN_MESSAGES:
+        logger.warning(f"Duplicate message: {idempotency_key} (seen by this instance)")
+        return True
+    stats = SEEN_MESSAGES.stats()
+    if stats['misses'] % STATS_LOG_EVERY == 0:
+        logger.info(f"Idempotency cache: {stats}")
+
     try:
         db = get_any_client("firestore")
         doc_ref = db.collection(collection_name).document(idempotency_key)
-        doc = doc_ref.get()
-
-        if doc.exists:
-            processed_at = doc.to_dict().get('processed_at')
-            logger.warning(f"Duplicate message: {idempotency_key} (processed at {processed_at})")
-            return True
-
-        doc_ref.set({
+        doc_ref.create({
             'idempotency_key': idempotency_key,
             'processed_at': SERVER_TIMESTAMP,
             'expires_at': datetime.now(timezone.utc) + timedelta(hours=ttl_hours)
         })
+        SEEN_MESSAGES.add(cache_key)
         logger.debug(f"✅ New message detected: {idempotency_key}")
         return False
 
+    except AlreadyExists:
+        SEEN_MESSAGES.add(cache_key)
+        logger.warning(f"Duplicate message: {idempotency_key}")
+        return True
+
     except Exception as e:
         logger.error(f"❌ Error checking idempotency: {e}")
         # Fail-safe: If DB fails, assume duplicate to prevent infinite retry loops on error
         return True
 
 
-def execute_pipeline(pipeline_instance, method_name: str, upload_id: str, collection_name: str):
+def filter_new_messages(idempotency_keys: list[str], collection_name: str, max_parallel: int = 8) -> set[str]:
     """
-    Executes the pipeline method and handles Firestore status updates (Success/Failure).
+    check_and_mark_processed for many keys at once (the batch handler); the creates run concurrently.
+    :return: the keys that are new
+    """
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        duplicates = list(pool.map(lambda key: check_and_mark_processed(key, collection_name), idempotency_keys))
+    return {key for key, duplicate in zip(idempotency_keys, duplicates) if not duplicate}
+
+
+def release_processed(idempotency_key: str, collection_name: str):
+    """
+    Deletes the idempotency doc, so a redelivery of a message we refused is processed again.
+    """
+    SEEN_MESSAGES.discard(f"{collection_name}/{idempotency_key}")
+    try:
+        db = get_any_client("firestore")
+        db.collection(collection_name).document(idempotency_key).delete()
+    except Exception as e:
+        logger.error(f"❌ Error releasing idempotency key {idempotency_key}: {e}")
+
+
+def record_status(collection_name: str, upload_id: str, error_msg: str | None = None, result=None):
+    """
+    Writes the final status of one processed file to its idempotency doc.
     """
     fm = FirestoreMagic(collection_name, upload_id)
+    if error_msg is None:
+        fm.update_firejson({
+            'completed_at': firestore.SERVER_TIMESTAMP,
+            'status': 'completed',
+            'result': {'result': result} if result else {}
+        })
+    else:
+        fm.update_firejson({
+            'failed_at': firestore.SERVER_TIMESTAMP,
+            'status': 'failed',
+            'error': error_msg
+        })
+
 
+def execute_pipeline(pipeline_instance, method_name: str, upload_id: str, collection_name: str):
+    """
+    Executes the pipeline method and handles Firestore status updates (Success/Failure).
+    """
     try:
         # Dynamically call the method (run_full_pipeline or run_repair_flow)
         runner = getattr(pipeline_instance, method_name)
         result = runner()
 
-        success_payload = {
-            'completed_at': firestore.SERVER_TIMESTAMP,
-            'status': 'completed',
-            'result': {'result': result} if result else {}
-        }
-        fm.update_firejson(success_payload)
+        record_status(collection_name, upload_id, result=result)
         logger.debug(f"✅ Successfully processed {upload_id}")
         return "", 204
 
@@ -80,16 +136,84 @@ def execute_pipeline(pipeline_instance, method_name: str, upload_id: str, collec
         error_msg = str(e) or "Unknown error"
         logger.error(f"❌ Processing failed for {upload_id}: {error_msg}")
 
-        fail_payload = {
-            'failed_at': firestore.SERVER_TIMESTAMP,
-            'status': 'failed',
-            'error': error_msg
-        }
-        fm.update_firejson(fail_payload)
+        record_status(collection_name, upload_id, error_msg=error_msg)
         # We return 200 to Pub/Sub to acknowledge receipt so it doesn't retry a logic error forever
         return "Processing failed", 200
 
 
+def get_pipeline_config(style_pipeline: str, payload: dict) -> dict:
+    """
+    Returns the strategy config for style_pipeline after checking the payload has its required fields.
+    :raises ValueError: unknown style or missing fields (a bad message, not worth a retry)
+    """
+    config = PIPELINE_CONFIG.get(style_pipeline)
+    if not config:
+        logger.error(f"Unknown pipeline style: {style_pipeline}")
+        raise ValueError("Unknown pipeline style")
+    missing = [f for f in config['required_fields'] if f not in payload]
+    if 'file_fields' in config and not any(f in payload for f in config['file_fields']):
+        missing.append(" or ".join(config['file_fields']))
+    if missing:
+        logger.error(f"Missing fields for {style_pipeline}: {missing}")
+        raise ValueError(f"Missing {missing}")
+    return config
+
+
+def build_pipeline_kwargs(style_pipeline: str, payload: dict) -> dict:
+    """
+    Turns a validated message payload into ActivityProcessingPipeline arguments.
+    Shared by the push handlers and the pull worker (workshop/pull_worker.py).
+    :raises ValueError: file_data is not valid Base64
+    """
+    config = PIPELINE_CONFIG[style_pipeline]
+    pipeline_kwargs = {k: payload.get(k) for k in config['pipeline_args']}
+    pipeline_kwargs['pipeline_type'] = style_pipeline
+
+    if style_pipeline == "public":
+        pipeline_kwargs['locale'] = payload.get('locale', 'en')
+        if payload.get('file_data'):
+            try:
+                pipeline_kwargs['file_data'] = base64.b64decode(payload['file_data'])
+            except Exception as e:
+                logger.error(f"Base64 decode error: {e}")
+                raise ValueError("Invalid file data")
+    return pipeline_kwargs
+
+
+def process_payload(style_pipeline: str, payload: dict) -> str:
+    """
+    Runs one already de-duplicated message to the end and records its status.
+    Entry point for the pull worker's process pool, so it only takes picklable arguments.
+    :return: "completed" or "failed"
+    """
+    config = PIPELINE_CONFIG[style_pipeline]
+    pipeline = ActivityProcessingPipeline(**build_pipeline_kwargs(style_pipeline, payload))
+    _, code = execute_pipeline(pipeline, config['method'], payload['upload_id'], config['collection'])
+    return "completed" if code == 204 else "failed"
+
+
+def enqueue_pipeline(pipeline_instance, method_name: str, upload_id: str, collection_name: str):
+    """
+    Hands the pipeline run to the in-process work queue and acknowledges the push at once.
+    If the queue is full the idempotency doc is released and 429 tells Pub/Sub to back off and redeliver.
+    A job cut off by shutdown also gets its doc released, so a replay of the message is processed.
+    """
+    # Status first: a fast job must not have its final status overwritten by 'queued'
+    FirestoreMagic(collection_name, upload_id).update_firejson({
+        'queued_at': firestore.SERVER_TIMESTAMP,
+        'status': 'queued'
+    })
+    queued = get_work_queue().submit(
+        upload_id,
+        lambda: execute_pipeline(pipeline_instance, method_name, upload_id, collection_name),
+        on_abandon=lambda: release_processed(upload_id, collection_name))
+    if not queued:
+        logger.warning(f"Work queue full, refusing {upload_id}")
+        release_processed(upload_id, collection_name)
+        return "Too Many Requests: work queue full", 429
+    return "", 204
+
+
 def handle_message(style_pipeline: str):
     """
     Parses a Pub/Sub message and routes to the correct pipeline strategy.
@@ -104,17 +228,11 @@ def handle_message(style_pipeline: str):
         data_bytes = base64.b64decode(envelope['message']['data'])
         payload = json.loads(data_bytes.decode('utf-8'))
 
-        # 2. Get Strategy Config
-        config = PIPELINE_CONFIG.get(style_pipeline)
-        if not config:
-            logger.error(f"Unknown pipeline style: {style_pipeline}")
-            return "Bad Request: Unknown pipeline style", 400
-
-        # 3. Validate Fields
-        missing = [f for f in config['required_fields'] if f not in payload]
-        if missing:
-            logger.error(f"Missing fields for {style_pipeline}: {missing}")
-            return f"Bad Request: Missing {missing}", 400
+        # 2-3. Get Strategy Config and Validate Fields
+        try:
+            config = get_pipeline_config(style_pipeline, payload)
+        except ValueError as e:
+            return f"Bad Request: {e}", 400
 
         upload_id = payload['upload_id']
 
@@ -123,23 +241,73 @@ def handle_message(style_pipeline: str):
             return "Already processed", 200
 
         # 5. Prepare Data (Special handling for Base64 file_data in Public flow)
-        pipeline_kwargs = {k: payload.get(k) for k in config['pipeline_args']}
-        pipeline_kwargs['pipeline_type'] = style_pipeline
-
-        if style_pipeline == "public":
-            try:
-                pipeline_kwargs['file_data'] = base64.b64decode(payload['file_data'])
-                pipeline_kwargs['locale'] = payload.get('locale', 'en')
-            except Exception as e:
-                logger.error(f"Base64 decode error: {e}")
-                return "Bad Request: Invalid file data", 400
+        try:
+            pipeline_kwargs = build_pipeline_kwargs(style_pipeline, payload)
+        except ValueError as e:
+            return f"Bad Request: {e}", 400
 
         logger.debug(f"Starting {style_pipeline} pipeline for {upload_id}")
 
         # 6. Instantiate and Execute
         pipeline = ActivityProcessingPipeline(**pipeline_kwargs)
+        if PUBSUB_ASYNC_MODE == "enable":
+            return enqueue_pipeline(pipeline, config['method'], upload_id, config['collection'])
         return execute_pipeline(pipeline, config['method'], upload_id, config['collection'])
 
     except Exception as e:
         logger.error(f"Critical error in handle_message: {e}", exc_info=True)
-        return "Internal Server Error", 500
\ No newline at end of file
+        return "Internal Server Error", 500
+
+
+def handle_batch_message():
+    """
+    Parses a Pub/Sub message carrying a list of Dropbox files ({"batch_id": ..., "files": [...]})
+    and runs them as one private batch. Every file keeps its own idempotency doc and status,
+    exactly like a single private message.
+    """
+    envelope = request.get_json()
+    if not envelope or 'message' not in envelope:
+        logger.error("Invalid Pub/Sub message format.")
+        return "Bad Request: Invalid Pub/Sub message", 400
+
+    try:
+        data_bytes = base64.b64decode(envelope['message']['data'])
+        payload = json.loads(data_bytes.decode('utf-8'))
+        files = payload.get('files')
+        if not isinstance(files, list):
+            logger.error("Batch message without a 'files' list.")
+            return "Bad Request: Missing files", 400
+
+        config = PIPELINE_CONFIG["private"]
+        valid = []
+        for item in files:
+            missing = [f for f in config['required_fields'] if f not in item]
+            if missing:
+                logger.error(f"Skipping batch item with missing fields {missing}: {item}")
+                continue
+            valid.append(item)
+        # Shared clients first: if they fail, nothing is marked yet and Pub/Sub can redeliver
+        clients = open_batch_clients()
+        new_keys = filter_new_messages([item['upload_id'] for item in valid], config['collection'])
+        items = []
+        for item in valid:
+            if item['upload_id'] in new_keys:
+                new_keys.discard(item['upload_id'])    # a key repeated inside the batch runs once
+                items.append(item)
+
+        logger.debug(f"Starting batch {payload.get('batch_id')} with {len(items)} of {len(files)} files")
+        pending = {item['upload_id'] for item in items}
+        try:
+            for result in run_private_batch(items, clients=clients):
+                record_status(config['collection'], result['upload_id'], error_msg=result['error'])
+                pending.discard(result['upload_id'])
+        except Exception:
+            # Claimed but without a status: release them, so the redelivery processes them again
+            for upload_id in pending:
+                release_processed(upload_id, config['collection'])
+            raise
+        return "", 204
+
+    except Exception as e:
+        logger.error(f"Critical error in handle_batch_message: {e}", exc_info=True)
+        return "Internal Server Error", 500
@@ -1,7 +1,8 @@
 from power_core.dropbox_usage.get_from_dropbox import connect_to_dropbox
 from power_core.dropbox_usage.utils import DropboxAuth
 import logging
-from power_core.routes.pubsub_handler import handle_message
+from power_core.routes.pubsub_handler import handle_message, handle_batch_message
+from power_core.heatmap_gpx.compose_tree import publish_all_heatmaps
 from flask import Blueprint, request, jsonify, Response
 from power_core.dropbox_usage.upload_to_dropbox import upload_custom_files_session
 from power_core.project_env.config import PRIVATE_UPLOAD_TOKEN, DROpbox_WEBHOOK_PATH
@@ -53,6 +54,19 @@ def handle_pubsub_message():
 def handle_private_message():
     return handle_message("private")
 
+@bp_private.route('/private-batch-processing-handler', methods=['POST'])
+def handle_private_batch_message():
+    return handle_batch_message()
+
+@bp_private.route('/heatmap-compose-handler', methods=['POST'])
+def handle_heatmap_compose():
+    """ Scheduled (Cloud Scheduler): merges the heatmap compose trees and publishes the heatmaps."""
+    try:
+        return jsonify(publish_all_heatmaps()), 200
+    except Exception as e:
+        logger.error(f"Heatmap compose failed: {e}", exc_info=True)
+        return "Internal Server Error", 500
+
 @bp1.route(f"/{PRIVATE_UPLOAD_TOKEN}", methods=["POST"])
 def trigger_upload():
     logger.info("Uploading custom files session")
@@ -0,0 +1,57 @@
+"""
+In-process TTL/LRU set of recently seen message ids, in front of the Firestore idempotency docs.
+Pub/Sub redelivers hot duplicates to the same instance within seconds; those are answered
+from memory and never reach Firestore. Hit/miss counters are kept for the logs (stats()).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SeenCache:
+    """Thread-safe set of keys with a max size (least recently seen evicted first) and a TTL per key."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires = self._items.get(key)
+            if expires is not None and expires > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return True
+            if expires is not None:
+                del self._items[key]
+            self.misses += 1
+            return False
+
+    def add(self, key: str):
+        with self._lock:
+            self._items[key] = time.monotonic() + self.ttl_seconds
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size": len(self._items),
+            }
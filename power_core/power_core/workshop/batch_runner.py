@@ -0,0 +1,91 @@
+"""
+Batch entry point for the private pipeline: many Dropbox files per invocation.
+One Dropbox client and one Strava token are created for the whole batch and handed to every
+ActivityProcessingPipeline; GCS and Firestore clients are already process-wide (gcp_actions.client).
+Files run with bounded parallelism and one aggregated timing table is logged at the end.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gcp_actions.common_utils.timer import run_timer, log_duration_table
+from power_core.dropbox_usage.utils import DropboxAuth
+from power_core.project_env.config import BATCH_MAX_PARALLEL
+from power_core.strava.auth import update_strava_token_if_needed
+from power_core.workshop.workers import ActivityProcessingPipeline
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _process_one(item: dict, dropbox_client, strava_token: str | None) -> dict:
+    """Runs one file and turns the outcome into a result record (never raises)."""
+    start = time.perf_counter()
+    pipeline = ActivityProcessingPipeline(
+        original_filename=item["original_filename"],
+        dropbox_path=item["dropbox_path"],
+        pipeline_type="private",
+        dropbox_client=dropbox_client,
+        strava_token=strava_token,
+    )
+    result = {
+        "upload_id": item["upload_id"],
+        "original_filename": item["original_filename"],
+        "status": "completed",
+        "error": None,
+        "bike_model": None,
+        "changes_count": None,
+    }
+    try:
+        pipeline.run_full_pipeline()
+        result["bike_model"] = pipeline.bike_model
+        result["changes_count"] = pipeline.bad_lines
+    except Exception as e:
+        logger.error(f"❌ Batch item {item['original_filename']} failed: {e}")
+        result["status"] = "failed"
+        result["error"] = str(e) or "Unknown error"
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    result["stage_times"] = pipeline.stage_times
+    return result
+
+
+def open_batch_clients() -> tuple:
+    """
+    The clients shared by a batch: (Dropbox client, Strava token or None).
+    Called before any file of the batch is marked as processed, so a failure here leaves
+    the message redeliverable.
+    """
+    dropbox_client = DropboxAuth().auth_dropbox()
+    strava_token = update_strava_token_if_needed() if os.environ.get("STRAVA_UPLOAD") == "enable" else None
+    return dropbox_client, strava_token
+
+
+@run_timer
+def run_private_batch(items: list[dict], max_parallel: int = BATCH_MAX_PARALLEL, clients: tuple | None = None) -> list[dict]:
+    """
+    Processes a list of Dropbox files through the private pipeline.
+    :param items: [{"dropbox_path": ..., "original_filename": ..., "upload_id": ...}, ...]
+    :param max_parallel: files processed at the same time
+    :param clients: result of open_batch_clients (opened here if not given)
+    :return: per-file results in input order:
+        {upload_id, original_filename, status, error, bike_model, changes_count, seconds, stage_times}
+    """
+    if not items:
+        return []
+    start = time.perf_counter()
+
+    dropbox_client, strava_token = clients or open_batch_clients()
+    logger.info(f"Batch of {len(items)} files started (parallel: {max_parallel}).")
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="batch") as pool:
+        results = list(pool.map(lambda item: _process_one(item, dropbox_client, strava_token), items))
+
+    # Aggregated timing: every stage summed over the batch, plus the batch wall time
+    aggregated = {}
+    for result in results:
+        for stage, seconds in result["stage_times"].items():
+            aggregated[stage] = aggregated.get(stage, 0.0) + seconds
+    aggregated["Batch wall time"] = time.perf_counter() - start
+    failed = sum(r["status"] == "failed" for r in results)
+    log_duration_table(aggregated, f"Batch ({len(results)} files, {failed} failed)")
+    return results
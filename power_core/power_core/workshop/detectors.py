@@ -0,0 +1,193 @@
+"""
+Registry of GPS anomaly detectors for the CSV cleaning pass.
+Each detector works on a batch of CSV lines (a list it may modify in place) and keeps
+its own change count and time, so cleaner_run can run every enabled rule in one pass.
+New rules are added with @register_detector("<name>") and enabled via CLEANING_DETECTORS.
+"""
+import re
+import time
+from abc import ABC, abstractmethod
+
+from power_core.project_env.config import (
+    CLEAN_ALTITUDE_GAP_S, CLEAN_ALTITUDE_SPIKE_M, CLEAN_ALTITUDE_SPIKE_RUN, CLEAN_GPS_ACCURACY_M)
+
+import logging
+logger = logging.getLogger(__name__)
+
+DETECTORS = {}
+
+LAT_PATTERN = re.compile(r'position_lat,"(-?\d+)",semicircles,position_long,"-?\d+",semicircles,')
+SERIAL_NUMBER_PATTERN = re.compile(r'serial_number,"SN\.(\d+)"')
+TIMESTAMP_PATTERN = re.compile(r'(?:^|,)timestamp,"(\d+)"')
+ALTITUDE_PATTERN = re.compile(r'(?:enhanced_)?altitude,"(-?[\d.]+)",m,')
+GPS_ACCURACY_PATTERN = re.compile(r'gps_accuracy,"(\d+)"')
+POSITION_PATTERN = re.compile(r'position_(?:lat|long),"-?\d+",semicircles,')
+RECORD_PREFIX = "Data,"
+
+
+def register_detector(name: str):
+    """Class decorator: makes a GpsDetector subclass available under name."""
+    def decorator(cls):
+        cls.name = name
+        DETECTORS[name] = cls
+        return cls
+    return decorator
+
+
+def is_record(line: str) -> bool:
+    return line.startswith(RECORD_PREFIX) and line.split(",", 3)[2] == "record"
+
+
+class GpsDetector(ABC):
+    """
+    Abstract base class. Subclasses implement check(batch) and return how many lines they changed.
+    A line set to "" is dropped from the output.
+    counts_as_issue: whether the changes count towards changes_count / validation_failed
+    (the pipeline branch "GPS issues found"), or are silent fixes like the serial number.
+    """
+    name = "base"
+    counts_as_issue = True
+
+    def __init__(self):
+        self.changes_count = 0
+        self.elapsed = 0.0
+
+    @abstractmethod
+    def check(self, batch: list[str]) -> int:
+        """
+        Fixes the batch in place.
+        :return: number of lines changed
+        """
+
+    def run(self, batch: list[str]) -> int:
+        start = time.perf_counter()
+        changed = self.check(batch)
+        self.elapsed += time.perf_counter() - start
+        self.changes_count += changed
+        return changed
+
+
+@register_detector("negative_lat")
+class NegativeLatDetector(GpsDetector):
+    """Deletes the position pair of rows with a negative latitude."""
+
+    def check(self, batch: list[str]) -> int:
+        changed = 0
+        for i, line in enumerate(batch):
+            if not line.startswith(RECORD_PREFIX):
+                continue
+            match_lat = LAT_PATTERN.search(line)
+            if match_lat and int(match_lat.group(1)) < 0:
+                batch[i] = line.replace(match_lat.group(0), "")
+                changed += 1
+        return changed
+
+
+@register_detector("serial_number")
+class SerialNumberDetector(GpsDetector):
+    """Strips the 'SN.' prefix from serial_number values."""
+    counts_as_issue = False
+
+    def check(self, batch: list[str]) -> int:
+        changed = 0
+        for i, line in enumerate(batch):
+            if line.startswith(RECORD_PREFIX) and "SN." in line:
+                batch[i], count = SERIAL_NUMBER_PATTERN.subn(r'serial_number,"\1"', line)
+                changed += count
+        return changed
+
+
+@register_detector("duplicate_timestamp")
+class DuplicateTimestampDetector(GpsDetector):
+    """Drops record rows that repeat the timestamp of the previous record."""
+
+    def __init__(self):
+        super().__init__()
+        self.last_timestamp = None
+
+    def check(self, batch: list[str]) -> int:
+        changed = 0
+        for i, line in enumerate(batch):
+            if not is_record(line):
+                continue
+            match = TIMESTAMP_PATTERN.search(line)
+            if not match:
+                continue
+            if match.group(1) == self.last_timestamp:
+                batch[i] = ""
+                changed += 1
+            self.last_timestamp = match.group(1)
+        return changed
+
+
+@register_detector("altitude_spike")
+class AltitudeSpikeDetector(GpsDetector):
+    """
+    Removes altitude values that jump more than CLEAN_ALTITUDE_SPIKE_M from the last kept one.
+    A spike is short; a real step (pause/resume, lift, recording gap) is not. The last kept value
+    is replaced by the current one after CLEAN_ALTITUDE_SPIKE_RUN rejections in a row or when
+    more than CLEAN_ALTITUDE_GAP_S seconds passed since it, so later records are not all dropped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.last_altitude = None
+        self.last_timestamp = None
+        self.rejected_run = 0
+
+    def check(self, batch: list[str]) -> int:
+        changed = 0
+        for i, line in enumerate(batch):
+            if not is_record(line):
+                continue
+            match = ALTITUDE_PATTERN.search(line)
+            if not match:
+                continue
+            altitude = float(match.group(1))
+            time_match = TIMESTAMP_PATTERN.search(line)
+            timestamp = int(time_match.group(1)) if time_match else None
+            gap = (timestamp is not None and self.last_timestamp is not None
+                   and timestamp - self.last_timestamp > CLEAN_ALTITUDE_GAP_S)
+            if (self.last_altitude is not None and abs(altitude - self.last_altitude) > CLEAN_ALTITUDE_SPIKE_M
+                    and not gap and self.rejected_run < CLEAN_ALTITUDE_SPIKE_RUN):
+                batch[i] = ALTITUDE_PATTERN.sub("", line)
+                changed += 1
+                self.rejected_run += 1
+            else:
+                self.last_altitude = altitude
+                self.rejected_run = 0
+                if timestamp is not None:
+                    self.last_timestamp = timestamp
+        return changed
+
+
+@register_detector("gps_accuracy")
+class GpsAccuracyDetector(GpsDetector):
+    """
+    Deletes positions whose gps_accuracy (metres) is worse than CLEAN_GPS_ACCURACY_M.
+    FIT records carry no HDOP; gps_accuracy is the device's own estimate derived from it.
+    """
+
+    def check(self, batch: list[str]) -> int:
+        changed = 0
+        for i, line in enumerate(batch):
+            if not line.startswith(RECORD_PREFIX) or "gps_accuracy" not in line:
+                continue
+            match = GPS_ACCURACY_PATTERN.search(line)
+            if match and int(match.group(1)) > CLEAN_GPS_ACCURACY_M and POSITION_PATTERN.search(line):
+                batch[i] = POSITION_PATTERN.sub("", line)
+                changed += 1
+        return changed
+
+
+def build_detectors(names: str) -> list[GpsDetector]:
+    """
+    Instantiates the enabled detectors, in the configured order.
+    :param names: comma-separated detector names, e.g. "negative_lat,serial_number"
+    """
+    detectors = []
+    for name in filter(None, (n.strip() for n in names.split(","))):
+        if name not in DETECTORS:
+            raise ValueError(f"Unknown GPS detector '{name}'. Known: {', '.join(DETECTORS)}")
+        detectors.append(DETECTORS[name]())
+    return detectors
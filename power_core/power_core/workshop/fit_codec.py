@@ -0,0 +1,443 @@
+"""
+In-process FIT codec.
+Produces the same Definition/Data CSV rows as `java -jar FitCSVTool.jar -b`,
+so the rest of the pipeline (clean_data_stream, label_bike, csv_to_base)
+works unchanged, without paying for a JVM start per activity.
+The encoder does the reverse (`-c`): cleaned CSV rows back to a .FIT file.
+"""
+import csv
+import decimal
+import math
+import os
+import struct
+import tempfile
+from functools import lru_cache
+from typing import BinaryIO, Generator, Iterable
+
+import fitdecode
+from fitdecode.utils import compute_crc, get_mesg_type
+from gcp_actions.common_utils.timer import run_timer
+
+import logging
+logger = logging.getLogger(__name__)
+
+# FitCSVTool column layout: 3 leading columns, then (Field, Value, Units) triples
+CSV_LEADING_COLUMNS = ["Type", "Local Number", "Message"]
+ARRAY_SEPARATOR = "|"
+UNKNOWN_NAME = "unknown"
+UNDEFINED_DEV_NAME = "undefined-dev-data"
+
+
+def _java_number_str(value: float, digits: str, exponent: int, negative: bool) -> str:
+    """
+    Formats a number the way java.lang.Double/Float.toString does:
+    plain notation for 1e-3 <= |x| < 1e7, otherwise computerized scientific notation (1.0E7).
+    :param digits: shortest significant digits (no leading/trailing zeros)
+    :param exponent: decimal exponent of the first digit
+    """
+    sign = "-" if negative else ""
+    if 1e-3 <= abs(value) < 1e7:
+        if exponent >= 0:
+            int_part = digits[:exponent + 1].ljust(exponent + 1, "0")
+            frac_part = digits[exponent + 1:] or "0"
+        else:
+            int_part = "0"
+            frac_part = "0" * (-exponent - 1) + digits
+        return f"{sign}{int_part}.{frac_part}"
+    return f"{sign}{digits[0]}.{digits[1:] or '0'}E{exponent}"
+
+
+def _shortest_digits(text: str) -> tuple[str, int]:
+    """Splits a shortest round-trip repr into (significant digits, decimal exponent of the first digit)."""
+    _, digit_tuple, exp = decimal.Decimal(text).normalize().as_tuple()
+    return "".join(map(str, digit_tuple)), len(digit_tuple) + exp - 1
+
+
+def format_double(value: float) -> str:
+    """Java Double.toString equivalent for the scaled values FitCSVTool prints."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0:
+        return "-0.0" if math.copysign(1.0, value) < 0 else "0.0"
+    digits, exponent = _shortest_digits(repr(abs(value)))
+    return _java_number_str(value, digits, exponent, value < 0)
+
+
+def format_float32(value: float) -> str:
+    """Java Float.toString equivalent: the shortest digits that round-trip through float32."""
+    if math.isnan(value) or math.isinf(value) or value == 0:
+        return format_double(value)
+    target = struct.pack("<f", abs(value))
+    text = repr(abs(value))
+    for precision in range(0, 9):
+        candidate = f"{abs(value):.{precision}e}"
+        if struct.pack("<f", float(candidate)) == target:
+            text = candidate
+            break
+    digits, exponent = _shortest_digits(text)
+    return _java_number_str(value, digits, exponent, value < 0)
+
+
+def _scale_value(field, raw_value):
+    """
+    Applies scale/offset like the Java SDK: only when scale != 1 or offset != 0,
+    so plain integer fields keep their integer representation.
+    """
+    scale = getattr(field, "scale", None) or 1
+    offset = getattr(field, "offset", None) or 0
+    if scale == 1 and offset == 0:
+        return raw_value
+    if isinstance(raw_value, tuple):
+        return tuple(None if v is None else float(v) / scale - offset for v in raw_value)
+    if isinstance(raw_value, (int, float)):
+        return float(raw_value) / scale - offset
+    return raw_value
+
+
+def _format_scalar(value, base_type_name: str) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if base_type_name == "float32":
+            return format_float32(value)
+        return format_double(value)
+    return str(value)
+
+
+def format_field_value(field_data: fitdecode.types.FieldData) -> str | None:
+    """
+    Renders one decoded field as FitCSVTool prints it: raw integers for timestamps
+    and enums, scaled doubles where the profile defines scale/offset, arrays joined with '|'.
+    :return: None if the field is invalid (FitCSVTool skips invalid fields by default)
+    """
+    raw_value = field_data.raw_value
+    if raw_value is None:
+        return None
+
+    base_type_name = field_data.base_type.name if field_data.base_type else ""
+    if field_data.is_expanded:
+        # Expanded component values already carry the component scale/offset
+        value = raw_value
+    else:
+        value = _scale_value(field_data.field, raw_value)
+
+    if isinstance(value, (bytes, bytearray)):
+        value = tuple(value)
+    if isinstance(value, tuple):
+        items = [_format_scalar(v, base_type_name) for v in value if v is not None]
+        return ARRAY_SEPARATOR.join(items) if items else None
+    return _format_scalar(value, base_type_name)
+
+
+def _definition_row(frame: fitdecode.FitDefinitionMessage) -> list[str]:
+    row = ["Definition", str(frame.local_mesg_num),
+           frame.mesg_type.name if frame.mesg_type else UNKNOWN_NAME]
+    for field_def in frame.field_defs:
+        name = field_def.field.name if field_def.field else UNKNOWN_NAME
+        count = field_def.size // field_def.base_type.size if field_def.base_type.size else field_def.size
+        row.extend([name, str(count), ""])
+    for dev_def in frame.dev_field_defs or ():
+        name = dev_def.field.name if dev_def.field else UNDEFINED_DEV_NAME
+        base_size = dev_def.field.type.size if dev_def.field else 1
+        row.extend([name, str(dev_def.size // base_size), ""])
+    return row
+
+
+def _data_row(frame: fitdecode.FitDataMessage) -> list[str]:
+    row = ["Data", str(frame.local_mesg_num),
+           frame.mesg_type.name if frame.mesg_type else UNKNOWN_NAME]
+    # The Java SDK appends component-expanded fields after the fields defined in the file
+    defined = [f for f in frame.fields if not f.is_expanded]
+    expanded = [f for f in frame.fields if f.is_expanded]
+    for field_data in defined + expanded:
+        value = format_field_value(field_data)
+        if value is None:
+            continue
+        name = field_data.field.name if field_data.field else UNKNOWN_NAME
+        units = field_data.units or ""
+        row.extend([name, f'"{value}"', units])
+    return row
+
+
+def iter_fit_csv_rows(source: str | BinaryIO) -> Generator[list[str], None, None]:
+    """
+    Decodes a FIT file (path or binary stream) and yields FitCSVTool-style rows,
+    unpadded, in file order.
+    :param source: path to a .fit file or a readable binary stream
+    """
+    with fitdecode.FitReader(
+            source,
+            processor=None,
+            check_crc=fitdecode.CrcCheck.WARN,
+            error_handling=fitdecode.ErrorHandling.WARN
+    ) as fit_file:
+        for frame in fit_file:
+            if frame.frame_type == fitdecode.FIT_FRAME_DEFINITION:
+                yield _definition_row(frame)
+            elif frame.frame_type == fitdecode.FIT_FRAME_DATA:
+                yield _data_row(frame)
+
+
+def csv_header(max_fields: int) -> str:
+    """Header line FitCSVTool writes once it knows the widest row."""
+    cells = list(CSV_LEADING_COLUMNS)
+    for i in range(1, max_fields + 1):
+        cells.extend([f"Field {i}", f"Value {i}", f"Units {i}"])
+    return "".join(f"{c}," for c in cells) + "\n"
+
+
+def format_csv_row(row: list[str], max_fields: int) -> str:
+    """Pads a row to the header width and renders it as one CSV line."""
+    width = len(CSV_LEADING_COLUMNS) + 3 * max_fields
+    cells = row + [""] * (width - len(row))
+    return "".join(f"{c}," for c in cells) + "\n"
+
+
+@run_timer
+def decode_fit_to_csv_lines(source: str | BinaryIO) -> list[str]:
+    """
+    In-memory variant of decode_fit_to_csv: the header and padded rows as CSV lines.
+    :param source: path to a .fit file or a readable binary stream (e.g. BytesIO over upload bytes)
+    """
+    rows = list(iter_fit_csv_rows(source))
+    max_fields = max(((len(row) - len(CSV_LEADING_COLUMNS)) // 3 for row in rows), default=0)
+    return [csv_header(max_fields)] + [format_csv_row(row, max_fields) for row in rows]
+
+
+@run_timer
+def decode_fit_to_csv(source: str | BinaryIO, output_path: str) -> int:
+    """
+    Writes the FitCSVTool-compatible CSV for a FIT file.
+    Rows are spooled unpadded first, because the header width is only known after the last message.
+    :param source: path to a .fit file or a readable binary stream
+    :param output_path: destination .csv path
+    :return: number of rows written (without the header)
+    """
+    max_fields = 0
+    rows_count = 0
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode="w+", encoding="utf-8") as spool:
+        for row in iter_fit_csv_rows(source):
+            max_fields = max(max_fields, (len(row) - len(CSV_LEADING_COLUMNS)) // 3)
+            spool.write("\x1f".join(row))
+            spool.write("\n")
+            rows_count += 1
+        spool.seek(0)
+
+        tmp_path = f"{output_path}.part"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+            out.write(csv_header(max_fields))
+            for line in spool:
+                out.write(format_csv_row(line.rstrip("\n").split("\x1f"), max_fields))
+        os.replace(tmp_path, output_path)
+
+    logger.debug(f"Native FIT decode wrote {rows_count} rows ({max_fields} field columns) to {output_path}")
+    return rows_count
+
+
+# --- Encoder (CSV -> FIT) ---
+
+FIT_HEADER_SIZE = 14
+FIT_PROTOCOL_VERSION = 0x20     # 2.0
+FIT_PROFILE_VERSION = 21171     # 21.171, same profile as the bundled FitCSVTool.jar
+DEFINITION_HEADER_BIT = 0x40
+LOCAL_MESG_NUM_MASK = 0x0F
+
+# Invalid value per base type identifier, written for missing array elements / out of range values
+INVALID_VALUES = {
+    0x00: 0xFF, 0x01: 0x7F, 0x02: 0xFF, 0x83: 0x7FFF, 0x84: 0xFFFF,
+    0x85: 0x7FFFFFFF, 0x86: 0xFFFFFFFF, 0x0A: 0x00, 0x8B: 0x0000, 0x8C: 0x00000000,
+    0x0D: 0xFF, 0x8E: 0x7FFFFFFFFFFFFFFF, 0x8F: 0xFFFFFFFFFFFFFFFF, 0x90: 0x0000000000000000,
+}
+STRING_BASE_TYPE = 0x07
+FLOAT_BASE_TYPES = {0x88, 0x89}
+
+
+@lru_cache(maxsize=None)
+def _profile_fields(mesg_name: str) -> tuple[int, dict] | None:
+    """
+    Maps CSV field names of a message to (main field, field or subfield that carries scale/offset).
+    Subfield names (e.g. garmin_product) resolve to the field number of their main field.
+    :return: (global message number, name map) or None for messages outside the profile
+    """
+    try:
+        mesg_type = get_mesg_type(mesg_name)
+    except ValueError:
+        return None
+    names = {}
+    for field in mesg_type.fields.values():
+        names[field.name] = (field, field)
+    for field in mesg_type.fields.values():
+        for subfield in field.subfields or ():
+            names.setdefault(subfield.name, (field, subfield))
+    return mesg_type.mesg_num, names
+
+
+def _raw_number(text: str, scaling_field, base_type_id: int):
+    """Reverses the scale/offset FitCSVTool applied when printing the value."""
+    scale = getattr(scaling_field, "scale", None) or 1
+    offset = getattr(scaling_field, "offset", None) or 0
+    value = float(text)
+    if scale != 1 or offset != 0:
+        value = (value + offset) * scale
+    if base_type_id in FLOAT_BASE_TYPES:
+        return value
+    return round(value)
+
+
+def _pack_values(base_type, values: list, count: int) -> bytes:
+    """Packs `count` elements little-endian, padding with the base type invalid value."""
+    fmt = "<" + base_type.fmt
+    invalid = INVALID_VALUES.get(base_type.identifier)
+    chunks = []
+    for i in range(count):
+        value = values[i] if i < len(values) else None
+        if value is None:
+            chunks.append(b"\xff" * base_type.size if invalid is None else struct.pack(fmt, invalid))
+            continue
+        try:
+            chunks.append(struct.pack(fmt, value))
+        except struct.error:
+            # Out of range for the base type: the FIT way to say "no value"
+            chunks.append(struct.pack(fmt, invalid))
+    return b"".join(chunks)
+
+
+def _encode_field(main_field, scaling_field, text: str, declared_count: int | None) -> tuple[int, bytes]:
+    """
+    Converts one CSV value back to its binary field content.
+    :param declared_count: element count from the matching Definition row, if the field was listed there
+    :return: (base type identifier, packed bytes)
+    """
+    base_type = main_field.base_type
+    if base_type.identifier == STRING_BASE_TYPE:
+        encoded = text.encode("utf-8")
+        size = declared_count if declared_count else len(encoded) + 1
+        return base_type.identifier, encoded[:size - 1].ljust(size, b"\x00")
+
+    values = [_raw_number(v, scaling_field, base_type.identifier) for v in text.split(ARRAY_SEPARATOR) if v != ""]
+    count = max(declared_count or 0, len(values), 1)
+    return base_type.identifier, _pack_values(base_type, values, count)
+
+
+def _encode_data_row(row: list[str], declared: dict | None) -> tuple[int, list[tuple], bytes] | None:
+    """
+    Builds the binary layout and payload of one Data row.
+    Unknown messages, unknown fields and developer fields have no profile entry and are skipped.
+    :param declared: {field name: element count} of the local message's Definition row, or None
+        without one. With a Definition row only its fields are encoded, like FitCSVTool: the
+        component fields the decoder expands (e.g. enhanced_speed from speed) are not written back.
+    :return: (global message number, [(field number, size, base type)], payload) or None
+    """
+    profile = _profile_fields(row[2])
+    if profile is None:
+        return None
+    mesg_num, names = profile
+
+    layout = []
+    payload = []
+    seen = set()
+    for i in range(len(CSV_LEADING_COLUMNS), len(row) - 1, 3):
+        name, text = row[i], row[i + 1]
+        if not name or name not in names:
+            continue
+        main_field, scaling_field = names[name]
+        if main_field.def_num in seen or (declared is not None and main_field.name not in declared):
+            continue
+        try:
+            base_type_id, content = _encode_field(
+                main_field, scaling_field, text, declared.get(main_field.name) if declared else None)
+        except ValueError:
+            logger.warning(f"Skipping unparsable value {name}={text!r} in {row[2]}")
+            continue
+        seen.add(main_field.def_num)
+        layout.append((main_field.def_num, len(content), base_type_id))
+        payload.append(content)
+
+    if not layout:
+        return None
+    return mesg_num, layout, b"".join(payload)
+
+
+def _definition_record(local_num: int, mesg_num: int, layout: list[tuple]) -> bytes:
+    record = struct.pack("<BBBHB", DEFINITION_HEADER_BIT | local_num, 0, 0, mesg_num, len(layout))
+    return record + b"".join(struct.pack("<BBB", *field) for field in layout)
+
+
+def _iter_csv_rows(source: str | Iterable[str]) -> Generator[list[str], None, None]:
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8", newline="") as f:
+            yield from csv.reader(f)
+    else:
+        yield from csv.reader(source)
+
+
+@run_timer
+def encode_csv_to_fit(source: str | Iterable[str], output: str | BinaryIO) -> int:
+    """
+    Writes a .FIT file from FitCSVTool-style rows (the reverse of decode_fit_to_csv).
+    A definition message is emitted whenever the field layout of a local message number changes;
+    the body is spooled first because the file header carries the data size.
+    :param source: path to a .csv file or an iterable of CSV lines
+    :param output: destination .fit path (written atomically) or a writable binary stream
+    :return: number of data messages written
+    """
+    declared_counts = {}    # local number -> {field name: element count} from Definition rows
+    active_layouts = {}     # local number -> (global number, layout) last written
+    data_count = 0
+
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as body:
+        for row in _iter_csv_rows(source):
+            if len(row) < len(CSV_LEADING_COLUMNS) or not row[1].isdigit():
+                continue    # header line or blank
+            local_num = int(row[1]) & LOCAL_MESG_NUM_MASK
+
+            if row[0] == "Definition":
+                declared_counts[local_num] = {
+                    row[i]: int(row[i + 1]) for i in range(len(CSV_LEADING_COLUMNS), len(row) - 1, 3)
+                    if row[i] and row[i + 1].isdigit()
+                }
+                continue
+            if row[0] != "Data":
+                continue
+
+            encoded = _encode_data_row(row, declared_counts.get(local_num))
+            if encoded is None:
+                continue
+            mesg_num, layout, payload = encoded
+
+            records = []
+            if active_layouts.get(local_num) != (mesg_num, layout):
+                records.append(_definition_record(local_num, mesg_num, layout))
+                active_layouts[local_num] = (mesg_num, layout)
+            records.append(bytes([local_num]) + payload)
+            body.write(b"".join(records))
+            data_count += 1
+
+        data_size = body.tell()
+        body.seek(0)
+        header = struct.pack("<BBHI4s", FIT_HEADER_SIZE, FIT_PROTOCOL_VERSION, FIT_PROFILE_VERSION,
+                             data_size, b".FIT")
+        header += struct.pack("<H", compute_crc(header))
+
+        if isinstance(output, str):
+            tmp_path = f"{output}.part"
+            with open(tmp_path, "wb") as out:
+                _write_fit(out, header, body)
+            os.replace(tmp_path, output)
+        else:
+            _write_fit(output, header, body)
+
+    logger.debug(f"Native FIT encode wrote {data_count} data messages ({data_size} bytes)")
+    return data_count
+
+
+def _write_fit(out: BinaryIO, header: bytes, body: BinaryIO) -> None:
+    """Copies header + records to out and appends the file CRC (it covers the header too)."""
+    crc = compute_crc(header)
+    out.write(header)
+    while chunk := body.read(1024 * 1024):
+        crc = compute_crc(chunk, crc=crc)
+        out.write(chunk)
+    out.write(struct.pack("<H", crc))
@@ -0,0 +1,171 @@
+"""
+Binary-level GPS repair.
+Walks the FIT records and applies the clean_data_stream rules directly to the record bytes:
+- position_lat/position_long are invalidated when the latitude is negative
+  (FitCSVTool skips invalid fields, so the result decodes like the regex-cleaned CSV)
+- a string serial_number loses its 'SN.' prefix
+The file CRC is recomputed afterwards, so no CSV round trip (and no JVM) is needed.
+"""
+import os
+import struct
+
+from fitdecode.profile import MESSAGE_TYPES
+from fitdecode.utils import compute_crc
+from gcp_actions.common_utils.timer import run_timer
+
+import logging
+logger = logging.getLogger(__name__)
+
+COMPRESSED_HEADER_BIT = 0x80
+DEFINITION_HEADER_BIT = 0x40
+DEV_DATA_BIT = 0x20
+STRING_BASE_TYPE = 0x07
+
+INVALID_SINT32 = 0x7FFFFFFF
+SERIAL_NUMBER_PREFIX = b"SN."
+
+
+class _Definition:
+    """Byte offsets (inside the data message content) of the fields the repair rules touch."""
+    __slots__ = ("size", "endian", "lat", "long", "serial", "ant_device")
+
+    def __init__(self, size: int, endian: str):
+        self.size = size
+        self.endian = endian
+        self.lat = None             # offset of position_lat (sint32)
+        self.long = None            # offset of position_long (sint32)
+        self.serial = None          # (offset, size) of a string serial_number
+        self.ant_device = None      # (offset, size) of ant_device_number
+
+
+def _parse_definition(data: bytearray, pos: int, record_header: int) -> tuple[int, int, _Definition]:
+    """
+    Parses a definition message starting right after its record header.
+    :return: (local message number, position after the message, definition)
+    """
+    endian = ">" if data[pos + 1] == 1 else "<"
+    global_num = struct.unpack_from(f"{endian}H", data, pos + 2)[0]
+    num_fields = data[pos + 4]
+    pos += 5
+
+    mesg_type = MESSAGE_TYPES.get(global_num)
+    profile_fields = mesg_type.fields if mesg_type else {}
+    definition = _Definition(0, endian)
+    offset = 0
+    for _ in range(num_fields):
+        field_num, size, base_type = data[pos], data[pos + 1], data[pos + 2]
+        field = profile_fields.get(field_num)
+        name = field.name if field else None
+        if name == "position_lat" and size == 4:
+            definition.lat = offset
+        elif name == "position_long" and size == 4:
+            definition.long = offset
+        elif name == "serial_number" and base_type == STRING_BASE_TYPE:
+            definition.serial = (offset, size)
+        elif name == "ant_device_number" and size == 2:
+            definition.ant_device = (offset, size)
+        offset += size
+        pos += 3
+
+    if record_header & DEV_DATA_BIT:
+        num_dev_fields = data[pos]
+        pos += 1
+        for _ in range(num_dev_fields):
+            offset += data[pos + 1]
+            pos += 3
+
+    definition.size = offset
+    return record_header & 0x0F, pos, definition
+
+
+def _repair_records(data: bytearray, pos: int, end: int, report: dict) -> None:
+    """Applies the repair rules to every data message between pos and end, in place."""
+    definitions = {}
+    while pos < end:
+        record_header = data[pos]
+        pos += 1
+
+        if record_header & COMPRESSED_HEADER_BIT:
+            local_num = (record_header >> 5) & 0x03
+        elif record_header & DEFINITION_HEADER_BIT:
+            local_num, pos, definition = _parse_definition(data, pos, record_header)
+            definitions[local_num] = definition
+            continue
+        else:
+            local_num = record_header & 0x0F
+
+        definition = definitions.get(local_num)
+        if definition is None:
+            raise ValueError(f"Data message for undefined local message {local_num} at byte {pos - 1}")
+
+        # 1. Negative latitude: invalidate the position pair
+        if definition.lat is not None and definition.long is not None:
+            lat = struct.unpack_from(f"{definition.endian}i", data, pos + definition.lat)[0]
+            if lat < 0:
+                struct.pack_into(f"{definition.endian}i", data, pos + definition.lat, INVALID_SINT32)
+                struct.pack_into(f"{definition.endian}i", data, pos + definition.long, INVALID_SINT32)
+                report["changes_count"] += 1
+                report["validation_failed"] = True
+
+        # 2. Serial number fix ('SN.123' -> '123', null padded to the same size)
+        if definition.serial is not None:
+            offset, size = definition.serial
+            start = pos + offset
+            if data[start:start + len(SERIAL_NUMBER_PREFIX)] == SERIAL_NUMBER_PREFIX:
+                fixed = bytes(data[start + len(SERIAL_NUMBER_PREFIX):start + size])
+                data[start:start + size] = fixed.ljust(size, b"\x00")
+
+        # 3. Sensors used for bike labelling
+        if definition.ant_device is not None:
+            offset, _ = definition.ant_device
+            number = struct.unpack_from(f"{definition.endian}H", data, pos + offset)[0]
+            if number and number not in report["ant_device_numbers"]:
+                report["ant_device_numbers"].append(number)
+
+        pos += definition.size
+
+    if pos != end:
+        raise ValueError(f"Last record overruns the data section by {pos - end} bytes")
+
+
+def repair_fit_bytes(data: bytearray) -> dict:
+    """
+    Repairs a FIT file held in memory (chained FIT files included) and rewrites each file CRC.
+    :param data: the whole .fit file, modified in place
+    :return: {'changes_count': int, 'validation_failed': bool, 'ant_device_numbers': [int, ...]}
+    """
+    report = {"changes_count": 0, "validation_failed": False, "ant_device_numbers": []}
+    pos = 0
+    while pos < len(data):
+        header_size = data[pos]
+        if len(data) < pos + header_size or data[pos + 8:pos + 12] != b".FIT":
+            raise ValueError("Input file is not a valid .FIT file.")
+        data_size = struct.unpack_from("<I", data, pos + 4)[0]
+        records_end = pos + header_size + data_size
+        if len(data) < records_end + 2:
+            raise ValueError("FIT file is truncated.")
+
+        _repair_records(data, pos + header_size, records_end, report)
+        struct.pack_into("<H", data, records_end, compute_crc(data, start=pos, end=records_end))
+        pos = records_end + 2
+    return report
+
+
+@run_timer
+def repair_fit_file(input_path: str, output_path: str) -> dict:
+    """
+    Reads a .fit file, applies the GPS repair rules and writes the result atomically.
+    input_path and output_path may be the same file.
+    :return: the repair report, see repair_fit_bytes
+    """
+    with open(input_path, "rb") as f:
+        data = bytearray(f.read())
+
+    report = repair_fit_bytes(data)
+
+    tmp_path = f"{output_path}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    logger.debug(f"Binary repair of {input_path}: {report['changes_count']} positions invalidated")
+    return report
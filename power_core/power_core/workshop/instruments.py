@@ -1,19 +1,33 @@
-import io, os, re, uuid, csv
+import io, os, re, uuid, csv, json
 from pathlib import Path
 import subprocess
 import tempfile
 import datetime
 import fitdecode
 from datetime import datetime
-from typing import List, Dict, Union, Iterable, Any, Generator
-from gcp_actions.common_utils.timer import run_timer
+from functools import lru_cache
+from itertools import batched
+from typing import List, Dict, Union, Iterable, Any, Generator, TextIO
+from gcp_actions.common_utils.timer import run_timer, log_duration_table
 from gcp_actions.firestore_box.json_manipulations import FirestoreMagic
 from google.cloud import firestore
 from power_core.utilites.email_sender import send_email
+from power_core.workshop.fit_codec import decode_fit_to_csv, decode_fit_to_csv_lines, encode_csv_to_fit
+from power_core.workshop.fit_repair import repair_fit_bytes, repair_fit_file
+from power_core.workshop.jvm_pool import get_jvm_pool, jvm_worker_available
+from power_core.workshop.vector_cleaner import clean_record_lines
+from power_core.workshop.detectors import GpsDetector, build_detectors, SERIAL_NUMBER_PATTERN
 from power_core.project_env.config import (
     DONATION_HTML_SNIPPET_MONO,
     DONATION_HTML_SNIPPET_PRIVAT,
-    FRONTEND_BASE_URL)
+    FRONTEND_BASE_URL,
+    FIT_CODEC,
+    FIT_REPAIR_MODE,
+    CLEANING_ENGINE,
+    CLEANING_DETECTORS,
+    CLEANING_BATCH_SIZE,
+    GEAR_SENSORS,
+    GEAR_SENSORS_FIRESTORE_DOC)
 
 import logging
 logger = logging.getLogger(__name__)
@@ -70,6 +84,10 @@ def convert_fit_to_csv(input_path, output_path, mode):
     Converts a .fit file to .csv or vice versa using the FitCSVTool.jar.
     It uses an absolute path to the .jar file to ensure it runs correctly
     in any environment (local or container).
+    With FIT_CODEC='native' both directions run in-process (fit_codec.decode_fit_to_csv /
+    fit_codec.encode_csv_to_fit) and produce the same output without starting a JVM.
+    Otherwise the job goes to the warm JVM pool (jvm_pool) when the FitCsvWorker helper is built,
+    and falls back to one `java -jar` per file.
     """
     # Security check of the file paths
     if not is_safe_tmp_path(input_path):
@@ -94,6 +112,15 @@ def convert_fit_to_csv(input_path, output_path, mode):
     elif flag == "-c":
         pass
 
+    if flag == "-b" and FIT_CODEC == "native":
+        decode_fit_to_csv(input_path, output_path)
+        logger.debug(f"FIT decoded in-process to: {output_path}")
+        return
+    if flag == "-c" and FIT_CODEC == "native":
+        encode_csv_to_fit(input_path, output_path)
+        logger.debug(f"FIT encoded in-process to: {output_path}")
+        return
+
     # Get the directory where this Python script is located.
     # In the container, this will be /app/power_core/workshop
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -114,9 +141,52 @@ def convert_fit_to_csv(input_path, output_path, mode):
     # Check if the JAR file actually exists before running the command
     if not os.path.exists(jar_path):
         raise FileNotFoundError(f"FATAL: The JAR file could not be found at the expected path: {jar_path}")
+    if jvm_worker_available():
+        get_jvm_pool().run(flag, input_path, output_path)
+        return
     subprocess.run(command, check=True)
     #subprocess.run(command, check=True, shell=False)
 
+# Sensor ANT device numbers and their associated Strava gear_ids (used when nothing is configured)
+DEFAULT_GEAR_SENSOR_MAPPING = {
+    4315: 'b7647614',  # MTB Code 1
+    33509: 'b7647614',  # MTB Code 2
+    2230: 'b8850168',  # Gravel Code 1
+    9560: 'b8850168',  # Gravel Code 2
+}
+STOPGAP_GEAR_ID = 'b0000000'
+
+@lru_cache(maxsize=1)
+def load_gear_sensor_mapping() -> dict[int, str]:
+    """
+    Loads the sensor -> gear_id table once per process:
+    GEAR_SENSORS (JSON env) or the built-in table, then the Firestore doc bikes/<GEAR_SENSORS_FIRESTORE_DOC> on top.
+    Call load_gear_sensor_mapping.cache_clear() and gear_matcher.cache_clear() to reload.
+    :return: {ant_device_number: gear_id}
+    """
+    mapping = dict(DEFAULT_GEAR_SENSOR_MAPPING)
+    if GEAR_SENSORS:
+        mapping = {int(number): gear_id for number, gear_id in json.loads(GEAR_SENSORS).items()}
+    if GEAR_SENSORS_FIRESTORE_DOC:
+        try:
+            sensors = FirestoreMagic("bikes", GEAR_SENSORS_FIRESTORE_DOC).load_firejson() or {}
+            mapping.update({int(number): gear_id for number, gear_id in sensors.items()})
+        except Exception as e:
+            logger.warning(f"Could not load gear sensors from Firestore, using configured table: {e}")
+    logger.debug(f"Gear sensor mapping loaded: {len(mapping)} sensors")
+    return mapping
+
+@lru_cache(maxsize=1)
+def gear_matcher() -> re.Pattern:
+    """
+    Compiles all known sensor codes into one alternation regex, so a line is scanned once
+    no matter how many sensors are configured. Group 1 is the ANT device number.
+    """
+    numbers = sorted(map(str, load_gear_sensor_mapping()), key=len, reverse=True)
+    if not numbers:
+        return re.compile(r'(?!)')
+    return re.compile(r'ant_device_number,"(' + "|".join(numbers) + r')"')
+
 @run_timer
 def label_bike(data_stream: Iterable[str]) -> str:
     """
@@ -127,77 +197,142 @@ def label_bike(data_stream: Iterable[str]) -> str:
     :param data_stream: An iterable object yielding file lines (the file object itself).
     :return: The corresponding gear_id b1234567 or a stopgap ID b0000000 if no match is found.
     """
-    # 1. Define the sensor codes and their associated gear_ids
-    GEAR_MAPPING = {
-        'ant_device_number,"4315"': 'b7647614',  # MTB Code 1
-        'ant_device_number,"33509"': 'b7647614',  # MTB Code 2
-        'ant_device_number,"2230"': 'b8850168',  # Gravel Code 1
-        'ant_device_number,"9560"': 'b8850168',  # Gravel Code 2
-    }
+    # 1. Cached sensor table and its compiled matcher
+    mapping = load_gear_sensor_mapping()
+    matcher = gear_matcher()
     # 2. Iterate through the entire stream until a match is found
     # This automatically handles the "read in chunks" requirement.
     for line in data_stream:
-        # Check for any of the sensor codes in the current line
-        for code, gear_id in GEAR_MAPPING.items():
-            if code in line:
-                # 3. Stop search and return immediately upon the first match
-                logger.debug(f"Bike labeled with gear_id: {gear_id} (Code: {code})")
-                return gear_id
+        match = matcher.search(line)
+        if match:
+            # 3. Stop search and return immediately upon the first match
+            gear_id = mapping[int(match.group(1))]
+            logger.debug(f"Bike labeled with gear_id: {gear_id} (Code: {match.group(0)})")
+            return gear_id
     logger.info("No matching ANT device number found. Using stopgap ID.")
-    return 'b0000000'
+    return STOPGAP_GEAR_ID
+
+def label_bike_by_devices(ant_device_numbers: Iterable[int]) -> str:
+    """
+    Same as label_bike, for ANT device numbers already read from the binary file.
+    :param ant_device_numbers: device numbers in file order
+    :return: The first matching gear_id or the stopgap ID
+    """
+    mapping = load_gear_sensor_mapping()
+    for number in ant_device_numbers:
+        gear_id = mapping.get(number)
+        if gear_id:
+            logger.debug(f"Bike labeled with gear_id: {gear_id} (ANT device: {number})")
+            return gear_id
+    logger.info("No matching ANT device number found. Using stopgap ID.")
+    return STOPGAP_GEAR_ID
 
 @run_timer
 def clean_data_stream(data_stream: Iterable[str]) -> Generator[tuple[str, bool, int], Any, None]:
     """
     Processes a stream of text lines, applying cleaning and yielding results.
+    Runs the original rules (negative lat, serial number) through the detector registry.
     :param data_stream: An iterable object yielding file lines (e.g., the file object itself).
     :return: yield - a tuple containing the cleaned line (str) and the count of changes made (int).
 
     """
-    # Pre-compile regex patterns for efficiency
-    LAT_PATTERN = re.compile(r'position_lat,"(-?\d+)",semicircles,position_long,"-?\d+",semicircles,')
-    SERIAL_NUMBER_PATTERN = re.compile(r'serial_number,"SN\.(\d+)"')
+    detectors = build_detectors("negative_lat,serial_number")
+    for line, validation_failed, changes_count, _ in label_and_clean_stream(data_stream, detectors):
+        yield line, validation_failed, changes_count
+
+@run_timer
+def label_and_clean_stream(
+        data_stream: Iterable[str],
+        detectors: list[GpsDetector] | None = None
+) -> Generator[tuple[str, bool, int, str | None], Any, None]:
+    """
+    label_bike and the cleaning rules fused into one pass over the stream:
+    the gear_id is picked from the first line with a known ANT device number
+    while batches of lines go through every enabled detector, so the file is read only once.
+    :param data_stream: An iterable object yielding file lines (e.g., the file object itself).
+    :param detectors: detector instances (default: the CLEANING_DETECTORS set); their counters
+        and timings are filled in as the stream is consumed
+    :return: yield - (cleaned line, validation_failed, changes_count, gear_id or None until found)
+    """
+    if detectors is None:
+        detectors = build_detectors(CLEANING_DETECTORS)
+    mapping = load_gear_sensor_mapping()
+    matcher = gear_matcher()
+    gear_id = None
     changes_count = 0
     validation_failed = False
 
-    # 1. Get bike model (needs to be done before the main loop starts consuming the stream)
-    # Note: If label_bike consumes the stream, you must find another way
-    # to label the bike, perhaps by reading a small header section separately.
+    for batch in batched(data_stream, CLEANING_BATCH_SIZE):
+        batch = list(batch)
+        if gear_id is None:
+            for line in batch:
+                match = matcher.search(line)
+                if match:
+                    gear_id = mapping[int(match.group(1))]
+                    logger.debug(f"Bike labeled with gear_id: {gear_id} (Code: {match.group(0)})")
+                    break
+
+        for detector in detectors:
+            changed = detector.run(batch)
+            if changed and detector.counts_as_issue:
+                validation_failed = True
+                changes_count += changed
+
+        for line in batch:
+            if line:
+                yield line, validation_failed, changes_count, gear_id
 
-    for line in data_stream:
-        original_line = line
+@run_timer
+def label_and_clean_vectorized(data_stream: Iterable[str]) -> Generator[tuple[str, bool, int, str | None], Any, None]:
+    """
+    Same contract as label_and_clean_stream, with the record checks done by vector_cleaner
+    (negative lat, zero island, teleport, speed spike) on NumPy columns.
+    The activity is held in memory as a list of lines for the column pass.
+    :param data_stream: An iterable object yielding file lines (e.g., the file object itself).
+    :return: yield - (cleaned line, validation_failed, changes_count, gear_id or None until found)
+    """
+    lines = list(data_stream)
+    changed_lines, stats = clean_record_lines(lines)
+    logger.info(f"Vector cleaning flagged: {stats}")
 
+    mapping = load_gear_sensor_mapping()
+    matcher = gear_matcher()
+    gear_id = None
+    changes_count = 0
+    validation_failed = False
+
+    for i, line in enumerate(lines):
+        if gear_id is None:
+            match = matcher.search(line)
+            if match:
+                gear_id = mapping[int(match.group(1))]
+                logger.debug(f"Bike labeled with gear_id: {gear_id} (Code: {match.group(0)})")
+
+        if i in changed_lines:
+            line = changed_lines[i]
+            validation_failed = True
+            changes_count += 1
         if line.startswith("Data"):
-            # 2. Lat value check (negative lat deletion)
-            match_lat = LAT_PATTERN.search(line)
-            if match_lat:
-                try:
-                    lat_value = int(match_lat.group(1))
-                    if lat_value < 0:
-                        validation_failed = True
-                        # Delete the fragment if lat is negative
-                        line = line.replace(match_lat.group(0), "")
-                        changes_count += 1
-                except ValueError:
-                    # Handle cases where match_lat.group(1) is not an integer
-                    pass
-
-            # 3. Serial number fix
             line = SERIAL_NUMBER_PATTERN.sub(r'serial_number,"\1"', line)
-
-        yield line, validation_failed, changes_count
+        yield line, validation_failed, changes_count, gear_id
 
 @run_timer
-def cleaner_run(input_path: str, output_path: str, pipeline: str):
+def cleaner_run(input_path: str, output_path: str, pipeline: str, mirror: TextIO | None = None):
     """
-    Run analyze the .csv file in stream mode, without loading it in memory
+    Run analyze the .csv file in stream mode, without loading it in memory.
+    Labelling and cleaning share a single pass over the file (label_and_clean_stream,
+    or label_and_clean_vectorized with CLEANING_ENGINE='vector').
     :param input_path:
     :param output_path:
     :param pipeline: 'public' or 'private'
-    :return:
+    :param mirror: optional text stream (e.g. a GCS upload writer) that receives every cleaned line as it is written;
+        with a mirror an error is re-raised, because the stream already holds a truncated copy
+    :return: (bike_model_id, changes_count)
     """
     temp_file_name = None
     validation_failed = False
+    bike_model_id = STOPGAP_GEAR_ID
+    changes_count = 0
     logger.debug(f"Starting GPS cleaning for '{input_path}'.")
 
     if not is_safe_tmp_path(input_path):
@@ -206,17 +341,31 @@ def cleaner_run(input_path: str, output_path: str, pipeline: str):
         raise ValueError(f"Unsafe output_path for GPS cleaning: {repr(output_path)}")
 
     try:
-        with open(input_path, 'r', encoding='utf-8') as infile_label:
-            bike_model_id = label_bike(infile_label)
-            print(f"Identified Bike Model ID: {bike_model_id}")
+        gear_id = None
+        detectors = []
         with open(input_path, 'r', encoding='utf-8') as infile_clean:
+            if CLEANING_ENGINE == "vector":
+                cleaned_stream = label_and_clean_vectorized(infile_clean)
+            else:
+                detectors = build_detectors(CLEANING_DETECTORS)
+                cleaned_stream = label_and_clean_stream(infile_clean, detectors)
             with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_outfile:
                 temp_file_name = temp_outfile.name
                 logger.debug(f"Writing to temporary file: {temp_file_name}")
-                for cleaned_line, current_validation_status, changes_count in clean_data_stream(infile_clean):
+                for cleaned_line, current_validation_status, changes_count, gear_id in cleaned_stream:
                     temp_outfile.write(cleaned_line)
+                    if mirror is not None:
+                        mirror.write(cleaned_line)
                     validation_failed |= current_validation_status
                 print("Delete issues: ", changes_count)
+        if detectors:
+            logger.info("Detector changes: " + ", ".join(f"{d.name}={d.changes_count}" for d in detectors))
+            log_duration_table({d.name: d.elapsed for d in detectors}, "Detectors")
+        if gear_id is None:
+            logger.info("No matching ANT device number found. Using stopgap ID.")
+        else:
+            bike_model_id = gear_id
+        print(f"Identified Bike Model ID: {bike_model_id}")
         if not validation_failed and pipeline == "public":
             logger.warning("File passed all integrity checks. Output file is NOT written/needed.")
             os.remove(temp_file_name)
@@ -229,12 +378,71 @@ def cleaner_run(input_path: str, output_path: str, pipeline: str):
         logger.error(f"Error: Input file not found at {input_path}")
         if temp_file_name and os.path.exists(temp_file_name):
             os.remove(temp_file_name)
+        if mirror is not None:
+            raise
     except Exception as e:
         logger.critical(f"A fatal error occurred: {e}")
         if temp_file_name and os.path.exists(temp_file_name):
             os.remove(temp_file_name)
+        if mirror is not None:
+            raise
     return bike_model_id, changes_count
 
+@run_timer
+def binary_repair_run(input_path: str, output_path: str) -> tuple[str, int]:
+    """
+    Binary counterpart of decode + cleaner_run + encode: patches the .fit records in place
+    (see fit_repair) and writes the cleaned .fit, without intermediate CSV files.
+    The output is always written, also when nothing needed cleaning.
+    :param input_path: downloaded .fit
+    :param output_path: cleaned .fit
+    :return: (bike_model_id, changes_count) like cleaner_run
+    """
+    if not is_safe_tmp_path(input_path):
+        raise ValueError(f"Unsafe input_path for binary repair: {repr(input_path)}")
+    if not is_safe_tmp_path(output_path):
+        raise ValueError(f"Unsafe output_path for binary repair: {repr(output_path)}")
+
+    report = repair_fit_file(input_path, output_path)
+    bike_model_id = label_bike_by_devices(report["ant_device_numbers"])
+    if report["validation_failed"]:
+        logger.warning("Integrity check FAILED. File needed cleaning and is being saved.")
+    return bike_model_id, report["changes_count"]
+
+@run_timer
+def clean_fit_in_memory(file_data: bytes) -> tuple[bytes, str, int]:
+    """
+    In-memory counterpart of decode + cleaner_run + encode, for uploads that arrive as bytes.
+    Nothing is written to /tmp (RAM-backed on Cloud Run): FIT_REPAIR_MODE='binary' patches a copy
+    of the bytes, otherwise the fit_codec decodes to lines, the cleaning stream runs over them and
+    the codec encodes into a buffer (FitCSVTool.jar needs files, so the jar is not used here).
+    :param file_data: the uploaded .fit
+    :return: (clean .fit bytes, bike_model_id, changes_count)
+    """
+    if FIT_REPAIR_MODE == "binary":
+        data = bytearray(file_data)
+        report = repair_fit_bytes(data)
+        return bytes(data), label_bike_by_devices(report["ant_device_numbers"]), report["changes_count"]
+
+    lines = decode_fit_to_csv_lines(io.BytesIO(file_data))
+    if CLEANING_ENGINE == "vector":
+        cleaned_stream = label_and_clean_vectorized(lines)
+    else:
+        cleaned_stream = label_and_clean_stream(lines)
+
+    cleaned_lines = []
+    gear_id = None
+    changes_count = 0
+    for cleaned_line, _, changes_count, gear_id in cleaned_stream:
+        cleaned_lines.append(cleaned_line)
+    del lines
+
+    out = io.BytesIO()
+    encode_csv_to_fit(cleaned_lines, out)
+    if gear_id is None:
+        logger.info("No matching ANT device number found. Using stopgap ID.")
+    return out.getvalue(), gear_id or STOPGAP_GEAR_ID, changes_count
+
 @run_timer
 def load_email_template(locale: str, result : str) -> tuple[str, str]:
     """
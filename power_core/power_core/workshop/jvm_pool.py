@@ -0,0 +1,159 @@
+"""
+Warm JVM worker pool for FitCSVTool.jar.
+Each worker is one long-lived `java FitCsvWorker` process (see power_core/FitCsvWorker.java)
+that runs conversions sequentially over its stdin/stdout pipe.
+The pool caps how many JVMs exist at once, so the 8 gunicorn threads queue for a worker
+instead of forking 8 JVMs; crashed, timed-out and worn-out workers are replaced lazily.
+"""
+import os
+import queue
+import subprocess
+import threading
+
+from power_core.project_env.config import (
+    FIT_JVM_POOL_SIZE,
+    FIT_JVM_JOB_TIMEOUT,
+    FIT_JVM_MAX_JOBS,
+    FIT_JVM_XMX)
+
+import logging
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+JAR_PATH = os.path.join(PACKAGE_DIR, 'FitCSVTool.jar')
+WORKER_CLASS = 'FitCsvWorker'
+WORKER_CLASS_PATH = os.path.join(PACKAGE_DIR, f'{WORKER_CLASS}.class')
+STARTUP_TIMEOUT = 30
+
+
+def jvm_worker_available() -> bool:
+    """True if the compiled FitCsvWorker helper is shipped next to the jar (built in the Dockerfile)."""
+    return os.path.exists(WORKER_CLASS_PATH) and os.path.exists(JAR_PATH)
+
+
+class JvmWorker:
+    """One warm JVM. Not thread-safe: the pool hands it to a single thread at a time."""
+
+    def __init__(self):
+        self.command = [
+            "java", f"-Xmx{FIT_JVM_XMX}", "-XX:+UseSerialGC", "-XX:TieredStopAtLevel=1",
+            "-cp", f"{JAR_PATH}{os.pathsep}{PACKAGE_DIR}", WORKER_CLASS
+        ]
+        self.jobs_done = 0
+        self._replies = queue.Queue()
+        self._process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+        self._expect("READY", STARTUP_TIMEOUT)
+        logger.debug(f"JVM worker started (pid {self._process.pid})")
+
+    def _read_replies(self):
+        for line in self._process.stdout:
+            self._replies.put(line.rstrip("\n"))
+        self._replies.put(None)     # EOF: the JVM is gone
+
+    def _expect(self, expected: str, timeout: float) -> str:
+        try:
+            reply = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            self.close()
+            raise subprocess.TimeoutExpired(self.command, timeout)
+        if reply is None:
+            returncode = self._process.wait()
+            raise subprocess.CalledProcessError(returncode, self.command, output="JVM worker exited")
+        if not reply.startswith(expected):
+            raise subprocess.CalledProcessError(1, self.command, output=reply)
+        return reply
+
+    def is_alive(self) -> bool:
+        return self._process.poll() is None
+
+    def run_job(self, flag: str, input_path: str, output_path: str, timeout: float):
+        """
+        Runs one conversion; raises like subprocess.run(check=True, timeout=...) would.
+        :raises subprocess.TimeoutExpired: the job took longer than timeout (the JVM is killed)
+        :raises subprocess.CalledProcessError: the JVM crashed or FitCSVTool reported an error
+        """
+        job = f"{flag}\t{input_path}\t{output_path}\n"
+        try:
+            self._process.stdin.write(job)
+            self._process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise subprocess.CalledProcessError(-1, self.command, output=f"JVM worker pipe closed: {e}")
+        self._expect("OK", timeout)
+        self.jobs_done += 1
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        logger.debug(f"JVM worker stopped (pid {self._process.pid}, {self.jobs_done} jobs)")
+
+
+class JvmPool:
+    """
+    Bounded pool of warm JVM workers.
+    Workers are spawned on demand up to size, recycled after max_jobs
+    (FitCSVTool keeps static state), and discarded on any failure.
+    """
+
+    def __init__(self, size: int, job_timeout: float, max_jobs: int):
+        self.size = size
+        self.job_timeout = job_timeout
+        self.max_jobs = max_jobs
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    def _checkout(self) -> JvmWorker:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return JvmWorker()
+            if worker.is_alive():
+                return worker
+            logger.warning("JVM worker died while idle, starting a new one.")
+            worker.close()
+
+    def run(self, flag: str, input_path: str, output_path: str):
+        """Blocks until a worker is free, then runs the conversion on it."""
+        with self._slots:
+            worker = self._checkout()
+            try:
+                worker.run_job(flag, input_path, output_path, self.job_timeout)
+            except Exception:
+                worker.close()
+                raise
+            if worker.jobs_done >= self.max_jobs:
+                worker.close()
+            else:
+                self._idle.put(worker)
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_jvm_pool() -> JvmPool:
+    """Process-wide pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = JvmPool(FIT_JVM_POOL_SIZE, FIT_JVM_JOB_TIMEOUT, FIT_JVM_MAX_JOBS)
+            logger.info(f"JVM pool created: size={FIT_JVM_POOL_SIZE}, timeout={FIT_JVM_JOB_TIMEOUT}s, "
+                        f"max_jobs={FIT_JVM_MAX_JOBS}, Xmx={FIT_JVM_XMX}")
+        return _pool
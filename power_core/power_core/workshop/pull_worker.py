@@ -0,0 +1,163 @@
+"""
+Streaming-pull worker for the pipeline topics, an alternative to the HTTP push endpoints.
+Messages are leased through a streaming pull subscription with flow control
+(PULL_MAX_MESSAGES / PULL_MAX_BYTES outstanding), de-duplicated like the push handlers,
+and run by ActivityProcessingPipeline on a process pool of PULL_PROCESSES workers.
+- ack: the pipeline finished (completed or failed, the status is in Firestore) or the message is bad
+- nack: the worker process died; the idempotency doc is released so the redelivery runs again
+LocalSubscription feeds in-memory messages through the same path for local testing.
+Started by power_core/pull_main.py.
+"""
+import json
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from power_core.project_env.config import (
+    GCP_PROJECT_ID,
+    PULL_MAX_MESSAGES,
+    PULL_MAX_BYTES,
+    PULL_PROCESSES)
+from power_core.routes.pubsub_handler import (
+    check_and_mark_processed,
+    get_pipeline_config,
+    process_payload,
+    record_status,
+    release_processed)
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LocalMessage:
+    """Stand-in for pubsub_v1.subscriber.message.Message: data, message_id, ack() and nack()."""
+
+    def __init__(self, data: bytes, message_id: str):
+        self.data = data
+        self.message_id = message_id
+        self.size = len(data)
+        self.result = None
+        self._settled = threading.Event()
+
+    def ack(self):
+        self.result = "ack"
+        self._settled.set()
+
+    def nack(self):
+        self.result = "nack"
+        self._settled.set()
+
+
+class LocalSubscription:
+    """
+    Stand-in for a streaming pull subscription: hands payloads to the callback
+    while honouring the same flow-control limits as the real client.
+    """
+
+    def __init__(self, payloads: list[dict]):
+        self.messages = [
+            LocalMessage(json.dumps(p).encode("utf-8"), str(i)) for i, p in enumerate(payloads)
+        ]
+
+    def run(self, callback: Callable[[LocalMessage], None], max_messages: int, max_bytes: int) -> list[LocalMessage]:
+        """Delivers every message, blocking while the outstanding limits are reached; returns them settled."""
+        outstanding = []
+        for message in self.messages:
+            while True:
+                outstanding = [m for m in outstanding if not m._settled.is_set()]
+                if not outstanding or (len(outstanding) < max_messages
+                                       and sum(m.size for m in outstanding) + message.size <= max_bytes):
+                    break
+                outstanding[0]._settled.wait(0.05)
+            outstanding.append(message)
+            callback(message)
+        for message in self.messages:
+            message._settled.wait()
+        return self.messages
+
+
+class PullWorker:
+    """Dispatches leased messages of one pipeline style to a process pool."""
+
+    def __init__(self, style_pipeline: str, processes: int = PULL_PROCESSES):
+        self.style_pipeline = style_pipeline
+        self.processes = processes
+        self._pool_lock = threading.Lock()
+        self.pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # "spawn": the parent already runs gRPC threads, which must not be forked
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def _submit(self, payload: dict) -> Future:
+        """Submits to the pool; a pool broken by a dead worker process is replaced once."""
+        with self._pool_lock:
+            try:
+                return self.pool.submit(process_payload, self.style_pipeline, payload)
+            except BrokenProcessPool:
+                logger.warning("Process pool is broken, starting a new one.")
+                self.pool.shutdown(wait=False)
+                self.pool = self._new_pool()
+                return self.pool.submit(process_payload, self.style_pipeline, payload)
+
+    def on_message(self, message):
+        """Subscriber callback; returns quickly, the pipeline runs in the pool."""
+        try:
+            payload = json.loads(message.data.decode("utf-8"))
+            config = get_pipeline_config(self.style_pipeline, payload)
+        except ValueError as e:
+            logger.error(f"Dropping bad message {message.message_id}: {e}")
+            message.ack()
+            return
+
+        upload_id = payload['upload_id']
+        if check_and_mark_processed(upload_id, config['collection']):
+            message.ack()
+            return
+
+        logger.debug(f"Dispatching {self.style_pipeline} pipeline for {upload_id}")
+        future = self._submit(payload)
+        future.add_done_callback(lambda f: self._settle(f, message, upload_id, config['collection']))
+
+    def _settle(self, future: Future, message, upload_id: str, collection: str):
+        error = future.exception()
+        if error is None:
+            logger.debug(f"Pipeline for {upload_id} {future.result()}")
+            message.ack()
+        elif isinstance(error, BrokenProcessPool):
+            # A dead process breaks the whole pool: every job in flight comes back here
+            logger.error(f"❌ Worker process died during {upload_id}, message goes back to the subscription")
+            release_processed(upload_id, collection)
+            message.nack()
+        else:
+            logger.error(f"❌ Processing failed for {upload_id}: {error}")
+            record_status(collection, upload_id, error_msg=str(error) or "Unknown error")
+            message.ack()
+
+    def run_local(self, subscription: LocalSubscription) -> list[LocalMessage]:
+        try:
+            return subscription.run(self.on_message, PULL_MAX_MESSAGES, PULL_MAX_BYTES)
+        finally:
+            self.pool.shutdown()
+
+    def run_forever(self, subscription_name: str):
+        """Streams from the Pub/Sub subscription until interrupted."""
+        from google.cloud import pubsub_v1
+
+        subscriber = pubsub_v1.SubscriberClient()
+        subscription_path = subscriber.subscription_path(GCP_PROJECT_ID, subscription_name)
+        flow_control = pubsub_v1.types.FlowControl(max_messages=PULL_MAX_MESSAGES, max_bytes=PULL_MAX_BYTES)
+        streaming_pull = subscriber.subscribe(subscription_path, callback=self.on_message, flow_control=flow_control)
+        logger.info(f"Pulling {subscription_path} ({self.style_pipeline}): max_messages={PULL_MAX_MESSAGES}, "
+                    f"max_bytes={PULL_MAX_BYTES}, processes={self.processes}")
+        with subscriber:
+            try:
+                streaming_pull.result()
+            except (KeyboardInterrupt, SystemExit):
+                logger.info("Stopping pull worker...")
+                streaming_pull.cancel()
+                streaming_pull.result(timeout=30)
+            finally:
+                self.pool.shutdown(wait=True)
@@ -0,0 +1,93 @@
+"""
+Small DAG scheduler for pipeline stages.
+A stage starts as soon as all stages it depends on have finished, so independent
+I/O-bound stages (GCS uploads, Strava, email) overlap on a thread pool.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable
+
+from gcp_actions.common_utils.timer import time_stage
+
+import logging
+logger = logging.getLogger(__name__)
+
+# name -> (callable without arguments, names of the stages it depends on)
+type StageGraph = dict[str, tuple[Callable[[], object], tuple[str, ...]]]
+
+
+def _validate(stages: StageGraph) -> None:
+    for name, (_, depends_on) in stages.items():
+        unknown = [d for d in depends_on if d not in stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {unknown}")
+
+
+def critical_path(stages: StageGraph, stage_times: dict[str, float]) -> tuple[float, list[str]]:
+    """
+    Longest chain of dependent stages, by measured duration.
+    :return: (seconds, stage names along the path)
+    """
+    finish = {}
+    previous = {}
+
+    def longest(name: str) -> float:
+        if name not in finish:
+            _, depends_on = stages[name]
+            best = max(depends_on, key=longest, default=None)
+            previous[name] = best
+            finish[name] = stage_times.get(name, 0.0) + (finish[best] if best else 0.0)
+        return finish[name]
+
+    last = max(stages, key=longest)
+    path = []
+    while last:
+        path.append(last)
+        last = previous[last]
+    return finish[path[0]], path[::-1]
+
+
+def run_stage_graph(stages: StageGraph, stage_times: dict[str, float], max_workers: int) -> dict[str, float]:
+    """
+    Runs every stage once, respecting dependencies; each stage is timed into stage_times.
+    On the first failure no new stage is started, running ones are awaited and the error is re-raised.
+    :param stages: the stage graph (insertion order is the start order among ready stages)
+    :param stage_times: filled with {stage name: seconds}, like time_stage does
+    :param max_workers: threads for concurrently ready stages
+    :return: {"Critical path": s, "Sum of stages": s, "Wall time": s}
+    """
+    _validate(stages)
+    done = set()
+    running = {}
+    error = None
+    start = time.perf_counter()
+
+    def run(name: str):
+        with time_stage(name, stage_times):
+            stages[name][0]()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as pool:
+        while len(done) < len(stages):
+            if error is None:
+                for name, (_, depends_on) in stages.items():
+                    if name not in done and name not in running.values() and all(d in done for d in depends_on):
+                        running[pool.submit(run, name)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.exception() is not None and error is None:
+                    error = future.exception()
+                    logger.error(f"Stage '{name}' failed: {error}")
+                done.add(name)
+    if error is not None:
+        raise error
+
+    path_seconds, path = critical_path(stages, stage_times)
+    logger.debug(f"Critical path: {' -> '.join(path)}")
+    return {
+        "Critical path": path_seconds,
+        "Sum of stages": sum(stage_times.get(name, 0.0) for name in stages),
+        "Wall time": time.perf_counter() - start,
+    }
@@ -0,0 +1,73 @@
+"""
+Parity benchmark: FitCSVTool.jar decode vs the in-process fit_codec decoder.
+Run locally (needs Java for the reference output):
+    python -m power_core.workshop.tests.debug_fit_decode_parity /tmp/ride.fit [more.fit ...]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from power_core.workshop.fit_codec import decode_fit_to_csv
+
+JAR_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'FitCSVTool.jar'))
+MAX_REPORTED_DIFFS = 5
+
+
+def run_jar(fit_path: str, csv_path: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(["java", "-jar", JAR_PATH, "-b", fit_path, csv_path], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run_native(fit_path: str, csv_path: str) -> float:
+    start = time.perf_counter()
+    decode_fit_to_csv(fit_path, csv_path)
+    return time.perf_counter() - start
+
+
+def compare_files(jar_csv: str, native_csv: str) -> bool:
+    with open(jar_csv, 'rb') as f:
+        jar_bytes = f.read()
+    with open(native_csv, 'rb') as f:
+        native_bytes = f.read()
+
+    if jar_bytes == native_bytes:
+        print(f"  ✅ Byte-for-byte identical ({len(jar_bytes)} bytes)")
+        return True
+
+    print(f"  ❌ Output differs: jar {len(jar_bytes)} bytes, native {len(native_bytes)} bytes")
+    jar_lines = jar_bytes.decode('utf-8', errors='replace').splitlines()
+    native_lines = native_bytes.decode('utf-8', errors='replace').splitlines()
+    reported = 0
+    for line_no, (jar_line, native_line) in enumerate(zip(jar_lines, native_lines), start=1):
+        if jar_line != native_line:
+            print(f"  line {line_no}:\n    jar:    {jar_line}\n    native: {native_line}")
+            reported += 1
+            if reported >= MAX_REPORTED_DIFFS:
+                break
+    if len(jar_lines) != len(native_lines):
+        print(f"  line count: jar {len(jar_lines)}, native {len(native_lines)}")
+    return False
+
+
+def check_parity(fit_path: str) -> bool:
+    print(f"\n--- {fit_path} ---")
+    with tempfile.TemporaryDirectory(dir="/tmp") as work_dir:
+        jar_csv = os.path.join(work_dir, "jar.csv")
+        native_csv = os.path.join(work_dir, "native.csv")
+        jar_time = run_jar(fit_path, jar_csv)
+        native_time = run_native(fit_path, native_csv)
+        print(f"  jar: {jar_time:.3f} s | native: {native_time:.3f} s | speed-up: {jar_time / native_time:.1f}x")
+        return compare_files(jar_csv, native_csv)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m power_core.workshop.tests.debug_fit_decode_parity <file.fit> [...]")
+        sys.exit(1)
+
+    results = [check_parity(path) for path in sys.argv[1:]]
+    print(f"\n{sum(results)} of {len(results)} files decoded with byte-for-byte parity.")
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,88 @@
+"""
+Round-trip check: FitCSVTool.jar encode vs the in-process fit_codec encoder on the same CSV.
+Both .fit outputs are decoded again and compared message by message (raw values),
+since the binary layout (definition order, header protocol byte) may legitimately differ.
+Run locally (needs Java for the reference output):
+    python -m power_core.workshop.tests.debug_fit_encode_roundtrip /tmp/ride.fit [more.fit ...]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitdecode
+
+from power_core.workshop.fit_codec import decode_fit_to_csv, encode_csv_to_fit
+
+JAR_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'FitCSVTool.jar'))
+MAX_REPORTED_DIFFS = 5
+
+
+def run_jar(csv_path: str, fit_path: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(["java", "-jar", JAR_PATH, "-c", csv_path, fit_path], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run_native(csv_path: str, fit_path: str) -> float:
+    start = time.perf_counter()
+    encode_csv_to_fit(csv_path, fit_path)
+    return time.perf_counter() - start
+
+
+def read_messages(fit_path: str) -> list[tuple]:
+    """Data messages as (name, sorted defined fields with raw values); CRC errors raise."""
+    messages = []
+    with fitdecode.FitReader(fit_path, check_crc=fitdecode.CrcCheck.RAISE) as fit_file:
+        for frame in fit_file:
+            if frame.frame_type == fitdecode.FIT_FRAME_DATA:
+                fields = sorted(
+                    (f.name, f.raw_value) for f in frame.fields
+                    if not f.is_expanded and f.raw_value is not None
+                )
+                messages.append((frame.name, fields))
+    return messages
+
+
+def compare_messages(jar_fit: str, native_fit: str) -> bool:
+    jar_messages = read_messages(jar_fit)
+    native_messages = read_messages(native_fit)
+
+    if jar_messages == native_messages:
+        print(f"  ✅ Same {len(jar_messages)} data messages "
+              f"(jar {os.path.getsize(jar_fit)} bytes, native {os.path.getsize(native_fit)} bytes)")
+        return True
+
+    print(f"  ❌ Messages differ: jar {len(jar_messages)}, native {len(native_messages)}")
+    reported = 0
+    for index, (jar_mesg, native_mesg) in enumerate(zip(jar_messages, native_messages)):
+        if jar_mesg != native_mesg:
+            print(f"  message {index}:\n    jar:    {jar_mesg}\n    native: {native_mesg}")
+            reported += 1
+            if reported >= MAX_REPORTED_DIFFS:
+                break
+    return False
+
+
+def check_roundtrip(fit_path: str) -> bool:
+    print(f"\n--- {fit_path} ---")
+    with tempfile.TemporaryDirectory(dir="/tmp") as work_dir:
+        csv_path = os.path.join(work_dir, "source.csv")
+        jar_fit = os.path.join(work_dir, "jar.fit")
+        native_fit = os.path.join(work_dir, "native.fit")
+        decode_fit_to_csv(fit_path, csv_path)
+        jar_time = run_jar(csv_path, jar_fit)
+        native_time = run_native(csv_path, native_fit)
+        print(f"  jar: {jar_time:.3f} s | native: {native_time:.3f} s | speed-up: {jar_time / native_time:.1f}x")
+        return compare_messages(jar_fit, native_fit)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m power_core.workshop.tests.debug_fit_encode_roundtrip <file.fit> [...]")
+        sys.exit(1)
+
+    results = [check_roundtrip(path) for path in sys.argv[1:]]
+    print(f"\n{sum(results)} of {len(results)} files re-encoded with the same messages as the jar.")
+    sys.exit(0 if all(results) else 1)
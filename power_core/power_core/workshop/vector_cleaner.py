@@ -0,0 +1,126 @@
+"""
+Vectorized cleaning engine for record messages (CLEANING_ENGINE='vector').
+The record rows of the CSV are loaded into columnar NumPy arrays and the validation
+rules run as array operations instead of a regex per line:
+- negative_lat: position with negative latitude (same rule as clean_data_stream)
+- zero_island: (0, 0) fixes the GPS reports before it has a lock
+- teleport: a single point far away from both neighbours (implied speed above the limit)
+- speed_spike: speed / enhanced_speed above the plausible maximum
+Flagged fields are removed from the affected lines, like the regex engine does.
+"""
+import re
+
+import numpy as np
+
+from power_core.project_env.config import CLEAN_SPEED_SPIKE_MS, CLEAN_TELEPORT_SPEED_MS
+
+import logging
+logger = logging.getLogger(__name__)
+
+RECORD_PREFIX = "Data,"
+RECORD_MESSAGE = "record"
+FIELD_PATTERN = re.compile(r'([a-z_0-9]+),"([^"]*)",([^,]*),')
+SEMICIRCLE_TO_DEG = 180.0 / 2 ** 31
+EARTH_RADIUS_M = 6371008.8
+
+POSITION_FIELDS = ("position_lat", "position_long")
+SPEED_FIELDS = ("speed", "enhanced_speed")
+COLUMNS = ("timestamp", "position_lat", "position_long", "altitude", "speed", "heart_rate")
+
+
+def is_record_line(line: str) -> bool:
+    return line.startswith(RECORD_PREFIX) and line.split(",", 3)[2] == RECORD_MESSAGE
+
+
+def load_record_columns(lines: list[str]) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Parses the record rows into columns; missing values are NaN.
+    speed falls back to enhanced_speed, altitude to enhanced_altitude.
+    :return: (line index of every record, {column name: float64 array})
+    """
+    line_index = [i for i, line in enumerate(lines) if is_record_line(line)]
+    columns = {name: np.full(len(line_index), np.nan) for name in COLUMNS}
+
+    for row, i in enumerate(line_index):
+        for name, value, _ in FIELD_PATTERN.findall(lines[i]):
+            if name.startswith("enhanced_"):
+                name = name[len("enhanced_"):]
+                if name not in columns or not np.isnan(columns[name][row]):
+                    continue
+            if name in columns:
+                try:
+                    columns[name][row] = float(value)
+                except ValueError:
+                    pass
+    return np.asarray(line_index, dtype=np.int64), columns
+
+
+def _haversine_m(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def detect_issues(columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """
+    Runs every rule over the record columns.
+    :return: {rule name: boolean mask over the records}
+    """
+    lat = columns["position_lat"]
+    long = columns["position_long"]
+    has_position = ~np.isnan(lat) & ~np.isnan(long)
+
+    negative_lat = has_position & (lat < 0)
+    zero_island = has_position & (lat == 0) & (long == 0)
+
+    # Teleport: judged on the positions that survive the two rules above
+    teleport = np.zeros(len(lat), dtype=bool)
+    valid = np.flatnonzero(has_position & ~negative_lat & ~zero_island)
+    if len(valid) > 1:
+        lat_deg = lat[valid] * SEMICIRCLE_TO_DEG
+        long_deg = long[valid] * SEMICIRCLE_TO_DEG
+        distance = _haversine_m(lat_deg[:-1], long_deg[:-1], lat_deg[1:], long_deg[1:])
+        elapsed = np.diff(columns["timestamp"][valid])
+        elapsed = np.where(np.isnan(elapsed) | (elapsed <= 0), 1.0, elapsed)
+        implied_speed = distance / elapsed
+        speed_in = np.concatenate(([0.0], implied_speed))
+        speed_out = np.concatenate((implied_speed, [np.inf]))
+        # A jump in and a jump back out: one bad fix, not a real move
+        teleport[valid] = (speed_in > CLEAN_TELEPORT_SPEED_MS) & (speed_out > CLEAN_TELEPORT_SPEED_MS)
+
+    speed = columns["speed"]
+    speed_spike = ~np.isnan(speed) & (speed > CLEAN_SPEED_SPIKE_MS)
+
+    return {
+        "negative_lat": negative_lat,
+        "zero_island": zero_island,
+        "teleport": teleport,
+        "speed_spike": speed_spike,
+    }
+
+
+def drop_fields(line: str, names: tuple[str, ...]) -> str:
+    """Removes the (Field, Value, Units) triples of the given fields from a CSV line."""
+    return FIELD_PATTERN.sub(lambda m: "" if m.group(1) in names else m.group(0), line)
+
+
+def clean_record_lines(lines: list[str]) -> tuple[dict[int, str], dict[str, int]]:
+    """
+    Finds and fixes the bad record rows of a whole activity.
+    :param lines: all CSV lines of the activity
+    :return: ({line index: cleaned line} for the changed lines only, {rule name: records flagged})
+    """
+    line_index, columns = load_record_columns(lines)
+    issues = detect_issues(columns)
+    drop_position = issues["negative_lat"] | issues["zero_island"] | issues["teleport"]
+    drop_speed = issues["speed_spike"]
+
+    changed = {}
+    for row in np.flatnonzero(drop_position | drop_speed):
+        names = (POSITION_FIELDS if drop_position[row] else ()) + (SPEED_FIELDS if drop_speed[row] else ())
+        i = int(line_index[row])
+        changed[i] = drop_fields(lines[i], names)
+
+    stats = {rule: int(mask.sum()) for rule, mask in issues.items()}
+    logger.debug(f"Vector cleaning over {len(line_index)} records: {stats}")
+    return changed, stats
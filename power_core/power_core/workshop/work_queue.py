@@ -0,0 +1,135 @@
+"""
+Bounded in-process work queue for the Pub/Sub push handlers (PUBSUB_ASYNC_MODE='enable').
+The handler validates the message, hands the pipeline run to this queue and answers 204 at once,
+so a push request no longer holds a gunicorn thread for the whole JVM + Strava run.
+- backpressure: submit() refuses work once max_pending jobs are waiting or running,
+  the handler then answers 429 and Pub/Sub redelivers later with backoff
+- graceful drain: on SIGTERM new work is refused and running jobs get ASYNC_DRAIN_TIMEOUT
+  seconds to finish before the previous (gunicorn) SIGTERM handler runs; jobs that did not
+  finish by then get their on_abandon callback (the handler releases their idempotency doc,
+  as the acked message will not come back by itself)
+Jobs run after the response, so on Cloud Run the service needs CPU always allocated
+(--no-cpu-throttling); with request-based CPU they are throttled to a crawl.
+"""
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from power_core.project_env.config import (
+    ASYNC_QUEUE_WORKERS,
+    ASYNC_QUEUE_MAX_PENDING,
+    ASYNC_DRAIN_TIMEOUT)
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """Thread pool with a hard cap on accepted (queued + running) jobs."""
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pubsub-job")
+        self._accepting = True
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._idle = threading.Event()
+        self._idle.set()
+        self._jobs = {}             # token -> (name, on_abandon) of every accepted, unfinished job
+        self._next_token = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, name: str, job: Callable[[], object], on_abandon: Callable[[], object] | None = None) -> bool:
+        """
+        Queues job without blocking.
+        :param name: label for the logs (the upload_id)
+        :param on_abandon: called if the job has not finished when a drain times out
+        :return: False if the queue is full or draining (the caller should answer 429)
+        """
+        if not self._accepting or not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._pending += 1
+            self._idle.clear()
+            token = self._next_token
+            self._next_token += 1
+            self._jobs[token] = (name, on_abandon)
+        self._executor.submit(self._run, token, name, job)
+        logger.debug(f"Queued job {name} ({self._pending}/{self.max_pending})")
+        return True
+
+    def _run(self, token: int, name: str, job: Callable[[], object]):
+        start = time.perf_counter()
+        try:
+            job()
+        except Exception as e:
+            logger.error(f"❌ Queued job {name} failed: {e}", exc_info=True)
+        finally:
+            logger.debug(f"Job {name} left the queue after {time.perf_counter() - start:.2f}s")
+            with self._lock:
+                self._jobs.pop(token, None)
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.set()
+            self._slots.release()
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Stops accepting work and waits for the accepted jobs.
+        :return: True if every job finished within timeout
+        """
+        self._accepting = False
+        logger.info(f"Draining work queue: {self._pending} job(s) pending, timeout {timeout}s")
+        finished = self._idle.wait(timeout)
+        self._executor.shutdown(wait=False, cancel_futures=not finished)
+        if not finished:
+            with self._lock:
+                abandoned = list(self._jobs.values())
+                self._jobs.clear()
+            logger.error(f"Drain timed out, {len(abandoned)} job(s) abandoned: {[name for name, _ in abandoned]}")
+            for name, on_abandon in abandoned:
+                if on_abandon is None:
+                    continue
+                try:
+                    on_abandon()
+                except Exception as e:
+                    logger.error(f"❌ on_abandon of job {name} failed: {e}")
+        return finished
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_work_queue() -> WorkQueue:
+    """Process-wide queue, created on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WorkQueue(ASYNC_QUEUE_WORKERS, ASYNC_QUEUE_MAX_PENDING)
+            logger.info(f"Work queue created: workers={ASYNC_QUEUE_WORKERS}, max_pending={ASYNC_QUEUE_MAX_PENDING}")
+        return _queue
+
+
+def install_drain_handler():
+    """
+    Drains the queue on SIGTERM, then hands over to the handler that was installed before
+    (gunicorn's graceful worker exit). Must be called from the main thread (create_app).
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_sigterm(signum, frame):
+        get_work_queue().drain(ASYNC_DRAIN_TIMEOUT)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    logger.debug("SIGTERM drain handler installed.")
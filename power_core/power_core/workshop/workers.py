@@ -1,12 +1,18 @@
 from fit2gpx import Converter
-from gcp_actions.blob_manipulation import StorageManipulations
-from gcp_actions.common_utils.timer import time_stage, log_duration_table
+from gcp_actions.blob_manipulation import StorageManipulations, delete_blob
+from gcp_actions.client import get_bucket
+from gcp_actions.common_utils.timer import log_duration_table
 from power_core.dropbox_usage.utils import DropboxAuth
 from power_core.heatmap_gpx.append_function import append_gpx_via_compose
-from power_core.project_env.config import GCS_BUCKET_NAME, GCS_PUB_OUTPUT_BUCKET
+from power_core.project_env.config import (
+    GCS_BUCKET_NAME, GCS_PUB_OUTPUT_BUCKET, FIT_REPAIR_MODE, PIPELINE_IN_MEMORY,
+    GCS_STREAMING_UPLOAD, FIT_CODEC, CHUNK_SIZE, PIPELINE_MAX_WORKERS)
 from power_core.strava.auth import update_strava_token_if_needed
 from power_core.strava.upload import StravaUpload
-from power_core.workshop.instruments import convert_fit_to_csv, cleaner_run, write_email_with_link
+from power_core.workshop.fit_codec import encode_csv_to_fit
+from power_core.workshop.stage_graph import StageGraph, run_stage_graph
+from power_core.workshop.instruments import (
+    convert_fit_to_csv, cleaner_run, binary_repair_run, clean_fit_in_memory, write_email_with_link)
 from typing import Literal
 import logging, os, uuid
 
@@ -27,14 +33,20 @@ class ActivityProcessingPipeline:
             locale: Locale = 'en',
             user_email: str | None = None,
             file_data: bytes | None = None,
+            staging_blob: str | None = None,
             dropbox_path: str | None = None,
-            pipeline_type: str | None = None
+            pipeline_type: str | None = None,
+            dropbox_client=None,
+            strava_token: str | None = None
     ):
         """
         Initializes the pipeline with the source GCS blob path or direct file data.
         :param file_data: Raw bytes of the file, if not downloading from GCS.
+        :param staging_blob: Staging object of the uploaded file in GCS_PUB_OUTPUT_BUCKET (public flow)
         :param locale: The user's language preference
         :param pipeline_type: runs one from two styles of a pipeline
+        :param dropbox_client: authorized Dropbox client shared by a batch (see batch_runner)
+        :param strava_token: Strava access token shared by a batch
         """
 
         self.bucket_name = GCS_BUCKET_NAME
@@ -44,8 +56,12 @@ class ActivityProcessingPipeline:
 
         self.locale = locale
         self.file_data = file_data
+        self.staging_blob = staging_blob
         self.dropbox_path = dropbox_path
         self.pipeline_type = pipeline_type
+        self.dropbox_client = dropbox_client
+        self.strava_token = strava_token
+        self.stage_times = {}
 
         # --- Filename Generation Strategy ---
         if self.pipeline_type == 'private':
@@ -65,6 +81,9 @@ class ActivityProcessingPipeline:
 
         self.bad_lines = None
         self.bike_model = None
+        self.fixed_fit_data = None
+        self._csv_streamed = False
+        self._fit_streamed = False
 
         # Local temporary file paths are now based on the chosen filename
         os.makedirs("/tmp", exist_ok=True)
@@ -84,15 +103,14 @@ class ActivityProcessingPipeline:
 
     def stage_01_download_fit(self):
         """
-        Downloads the original .FIT file from Dropbox
+        Downloads the original .FIT file from Dropbox or from the GCS staging object,
         or writes it from memory if file_data is present.
         """
         # --- Private Pipeline
         if self.dropbox_path:
             logger.debug(f"Stage 1: Downloading FIT from Dropbox: {self.dropbox_path}")
             try:
-                da = DropboxAuth()
-                dbx = da.auth_dropbox()
+                dbx = self.dropbox_client or DropboxAuth().auth_dropbox()
                 dbx.files_download_to_file(self.local_fit_path, self.dropbox_path)
                 logger.debug(f"Success: .fit downloaded from Dropbox to VM at: {self.local_fit_path}")
             except Exception as e:
@@ -101,6 +119,14 @@ class ActivityProcessingPipeline:
             return
 
         # ---- Public Pipeline
+        if self.staging_blob:
+            logger.debug(f"Stage 1: Downloading FIT from staging: {self.staging_blob}")
+            # download_to_filename streams the object in chunks, the file never sits in memory
+            # The object is kept for a redelivery; run_repair_flow deletes it once the flow succeeded
+            get_bucket("GCS_PUB_OUTPUT_BUCKET").blob(self.staging_blob).download_to_filename(self.local_fit_path)
+            logger.debug(f"Success: .fit downloaded from staging to VM at: {self.local_fit_path}")
+            return
+
         if self.file_data:
             logger.debug(f"Stage 1: Writing FIT from memory to: {self.local_fit_path}")
             with open(self.local_fit_path, 'wb') as f:
@@ -119,16 +145,54 @@ class ActivityProcessingPipeline:
         logger.debug("Skipped saving the unexplored CSV.")
 
 
+    def _gcs_writer(self, bucket_env: str, blob_name: str, mode: str, content_type: str):
+        """ Resumable GCS upload stream, sent in CHUNK_SIZE parts while it is being written."""
+        blob = get_bucket(bucket_env).blob(blob_name)
+        return blob.open(mode, chunk_size=CHUNK_SIZE, content_type=content_type)
+
+    def _discard_partial_upload(self, bucket_env: str, blob_name: str):
+        """ Deletes an object finalized by a failed streaming upload; a failed delete is only logged."""
+        try:
+            delete_blob(bucket_env, blob_name)
+        except Exception as e:
+            logger.error(f"Could not remove partial object '{blob_name}': {e}")
+
     def stage_03_clean_gps_data(self):
         """
-        Cleans the unexplored CSV, fixes GPS problems, stores a bike model,
-        and uploads the fixed CSV to GCS.
+        Cleans the unexplored CSV, fixes GPS problems and stores a bike model.
+        With GCS_STREAMING_UPLOAD the private pipeline streams the CSV to GCS during cleaning
+        (the public one only uploads it when issues were found, which is known at the end).
         """
+        if GCS_STREAMING_UPLOAD == "enable" and self.pipeline_type == "private":
+            try:
+                with self._gcs_writer("GCS_BUCKET_NAME", self.gcs_fixed_csv_path, "w", "text/csv") as csv_stream:
+                    self.bike_model, self.bad_lines = cleaner_run(
+                        self.local_unexplored_csv_path,
+                        self.local_fixed_csv_path,
+                        self.pipeline_type,
+                        mirror=csv_stream
+                    )
+            except Exception as e:
+                # Closing the writer finalizes whatever was sent: do not leave a truncated CSV behind
+                logger.error(f"Streaming CSV upload failed, removing partial object: {e}")
+                self._discard_partial_upload("GCS_BUCKET_NAME", self.gcs_fixed_csv_path)
+                raise
+            self._csv_streamed = True
+            logger.info(f"GPS cleaned (Bike Model: {self.bike_model}).")
+            logger.debug(f"Streamed fixed CSV to: {self.gcs_fixed_csv_path}")
+            return self.bad_lines
+
         self.bike_model, self.bad_lines = cleaner_run(
             self.local_unexplored_csv_path,
             self.local_fixed_csv_path,
             self.pipeline_type
         )
+        return self.bad_lines
+
+    def stage_03_upload_fixed_csv(self):
+        """ Uploads the fixed CSV to GCS (always for private, only with GPS issues for public)."""
+        if self._csv_streamed:
+            return
         if self.bad_lines > 0 or self.pipeline_type == "private":
             up_csv = StorageManipulations(
                 self.bucket_name,
@@ -140,26 +204,79 @@ class ActivityProcessingPipeline:
             logger.debug(f"Uploaded fixed CSV to: {self.gcs_fixed_csv_path}")
         elif self.bad_lines == 0 and self.pipeline_type == "public":
             logger.info("No GPS issues found, skipping fixed CSV upload.")
+
+    def stage_02_03_repair_fit_binary(self):
+        """
+        Replaces stages 2-3 and the re-encode of stage 4 when FIT_REPAIR_MODE='binary':
+        patches the GPS issues directly in the .FIT records and labels the bike.
+        No CSV is produced, so there is nothing to upload to csv_clean/.
+        """
+        self.bike_model, self.bad_lines = binary_repair_run(self.local_fit_path, self.local_fixed_fit_path)
+        logger.info(f"GPS repaired in FIT records (Bike Model: {self.bike_model}, changes: {self.bad_lines}).")
         return self.bad_lines
 
     def stage_04_fixed_csv_to_fit(self):
         """
         Re-encodes the fixed CSV back into a clean .FIT file and uploads it to GCS.
         """
-        upload_bucket = self.bucket_name_output if self.pipeline_type == "public" else self.bucket_name
+        self.stage_04_encode_fixed_fit()
+        self.stage_04_upload_fixed_fit()
+
+    def stage_04_encode_fixed_fit(self):
+        """
+        Re-encodes the fixed CSV back into a clean .FIT file.
+        With GCS_STREAMING_UPLOAD and the native codec, the public pipeline encodes straight
+        into the GCS upload stream; the private one keeps the local file for Strava.
+        """
+        if GCS_STREAMING_UPLOAD == "enable" and FIT_CODEC == "native" and self.pipeline_type == "public":
+            try:
+                with self._gcs_writer("GCS_PUB_OUTPUT_BUCKET", self.gcs_fixed_fit_path, "wb",
+                                      "application/octet-stream") as fit_stream:
+                    encode_csv_to_fit(self.local_fixed_csv_path, fit_stream)
+            except Exception as e:
+                # Closing the writer finalizes whatever was sent: do not leave a broken FIT behind
+                logger.error(f"Streaming FIT upload failed, removing partial object: {e}")
+                self._discard_partial_upload("GCS_PUB_OUTPUT_BUCKET", self.gcs_fixed_fit_path)
+                raise
+            self._fit_streamed = True
+            logger.debug(f"Re-encoded FIT streamed to: {self.bucket_name_output}/{self.gcs_fixed_fit_path}")
+            return
 
         convert_fit_to_csv(
             self.local_fixed_csv_path,
             self.local_fixed_fit_path,
             mode='encode'
         )
+
+    def stage_04_upload_fixed_fit(self):
+        """ Uploads the clean .FIT file to GCS (output bucket for the public pipeline)."""
+        if self._fit_streamed:
+            return
+        upload_bucket = self.bucket_name_output if self.pipeline_type == "public" else self.bucket_name
         up_fit = StorageManipulations(
             upload_bucket,
             self.gcs_fixed_fit_path,
             self.local_fixed_fit_path,
         )
         up_fit.upload_to_gcp_bucket("filename")
-        logger.debug(f"Re-encoded FIT uploaded to: {upload_bucket}/{self.gcs_fixed_fit_path}")
+        logger.debug(f"Clean FIT uploaded to: {upload_bucket}/{self.gcs_fixed_fit_path}")
+
+    def stage_01_03_clean_in_memory(self):
+        """
+        In-memory replacement of stages 1-4 (without the upload) for the public flow:
+        the uploaded bytes are cleaned into self.fixed_fit_data, no /tmp files are written.
+        """
+        self.fixed_fit_data, self.bike_model, self.bad_lines = clean_fit_in_memory(self.file_data)
+        self.file_data = None   # the upload buffer is not needed any more
+        logger.info(f"GPS cleaned in memory (Bike Model: {self.bike_model}, changes: {self.bad_lines}).")
+        return self.bad_lines
+
+    def stage_04_upload_fixed_fit_from_memory(self):
+        """ Uploads the in-memory clean .FIT straight to GCS."""
+        bucket_env = "GCS_PUB_OUTPUT_BUCKET" if self.pipeline_type == "public" else "GCS_BUCKET_NAME"
+        blob = get_bucket(bucket_env).blob(self.gcs_fixed_fit_path)
+        blob.upload_from_string(self.fixed_fit_data, content_type="application/octet-stream")
+        logger.debug(f"Clean FIT uploaded from memory to: {blob.bucket.name}/{self.gcs_fixed_fit_path}")
 
     def stage_04_01_email_cleaned_fit(self, result: str):
         """ Generates a proxy download link and emails it to the user."""
@@ -173,6 +290,10 @@ class ActivityProcessingPipeline:
             self.user_email
         )
 
+    def stage_04_01_send_result_email(self):
+        """ Emails the download link, or the 'nothing found' info when no GPS issues were fixed."""
+        self.stage_04_01_email_cleaned_fit("find" if self.bad_lines > 0 else "not_found")
+
     def stage_05_upload_to_strava(self):
         """
         Uploads the cleaned FIT file to Strava if the environment switch is 'prod'.
@@ -180,7 +301,7 @@ class ActivityProcessingPipeline:
         """
         current_mode = os.environ.get("STRAVA_UPLOAD")
         if current_mode == "enable":
-            access_token = update_strava_token_if_needed()
+            access_token = self.strava_token or update_strava_token_if_needed()
             su = StravaUpload(
                 access_token,
                 self.local_fixed_fit_path,
@@ -222,42 +343,74 @@ class ActivityProcessingPipeline:
     #     append_gpx_via_compose(self.local_gpx_path, self.bike_model, self.gcs_gpx_path)
     #     logger.debug(f"Heatmap updated for bike model: {self.bike_model}")
 
+    def _private_stages(self) -> StageGraph:
+        """ Stage graph of the private pipeline: name -> (stage, stages it waits for)."""
+        if FIT_REPAIR_MODE == "binary":
+            return {
+                "1 Download FIT": (self.stage_01_download_fit, ()),
+                "2-3 Repair FIT records": (self.stage_02_03_repair_fit_binary, ("1 Download FIT",)),
+                "4 Upload FIT": (self.stage_04_upload_fixed_fit, ("2-3 Repair FIT records",)),
+                "5 Upload to Strava": (self.stage_05_upload_to_strava, ("2-3 Repair FIT records",)),
+            }
+        return {
+            "1 Download FIT": (self.stage_01_download_fit, ()),
+            "2 FIT to CSV": (self.stage_02_fit_to_unexplored_csv, ("1 Download FIT",)),
+            "3 Clean GPS data": (self.stage_03_clean_gps_data, ("2 FIT to CSV",)),
+            "3-a Upload fixed CSV": (self.stage_03_upload_fixed_csv, ("3 Clean GPS data",)),
+            "4 CSV to FIT": (self.stage_04_encode_fixed_fit, ("3 Clean GPS data",)),
+            "4-a Upload FIT": (self.stage_04_upload_fixed_fit, ("4 CSV to FIT",)),
+            "5 Upload to Strava": (self.stage_05_upload_to_strava, ("4 CSV to FIT",)),
+            # "6 FIT to GPX": (self.stage_06_fit_to_gpx, ("4 CSV to FIT",)),
+            # "7 Append to Heatmap": (self.stage_07_heatmap, ("6 FIT to GPX", "3 Clean GPS data")),
+        }
+
+    def _public_stages(self) -> StageGraph:
+        """ Stage graph of the public repair flow; the email waits for the FIT upload it links to."""
+        if PIPELINE_IN_MEMORY == "enable" and self.file_data:
+            return {
+                "1-3 Clean FIT in memory": (self.stage_01_03_clean_in_memory, ()),
+                "4 Upload FIT": (self.stage_04_upload_fixed_fit_from_memory, ("1-3 Clean FIT in memory",)),
+                "4-1 Send email": (self.stage_04_01_send_result_email, ("4 Upload FIT",)),
+            }
+        if FIT_REPAIR_MODE == "binary":
+            return {
+                "1 Download FIT": (self.stage_01_download_fit, ()),
+                "2-3 Repair FIT records": (self.stage_02_03_repair_fit_binary, ("1 Download FIT",)),
+                "4 Upload FIT": (self.stage_04_upload_fixed_fit, ("2-3 Repair FIT records",)),
+                "4-1 Send email": (self.stage_04_01_send_result_email, ("4 Upload FIT",)),
+            }
+        return {
+            "1 Download FIT": (self.stage_01_download_fit, ()),
+            "2 FIT to CSV": (self.stage_02_fit_to_unexplored_csv, ("1 Download FIT",)),
+            "3 Clean GPS data": (self.stage_03_clean_gps_data, ("2 FIT to CSV",)),
+            "3-a Upload fixed CSV": (self.stage_03_upload_fixed_csv, ("3 Clean GPS data",)),
+            "4 CSV to FIT": (self.stage_04_encode_fixed_fit, ("3 Clean GPS data",)),
+            "4-a Upload FIT": (self.stage_04_upload_fixed_fit, ("4 CSV to FIT",)),
+            "4-1 Send email": (self.stage_04_01_send_result_email, ("4-a Upload FIT",)),
+        }
+
+    def _run_stages(self, stages: StageGraph, label: str):
+        """
+        Runs the stage graph (independent stages in parallel) and logs per-stage times
+        plus critical-path / sum / wall totals.
+        """
+        all_stage_times = self.stage_times
+        totals = run_stage_graph(stages, all_stage_times, PIPELINE_MAX_WORKERS)
+        log_duration_table(all_stage_times, label)
+        log_duration_table(totals, f"{label} totals")
+
     def run_full_pipeline(self):
         """ Executes all stages of the private activity processing pipeline."""
         logger.info("Private pipeline running")
-        all_stage_times = {}
-        with time_stage("1 Download FIT", all_stage_times):
-            self.stage_01_download_fit()
-        with time_stage("2 FIT to CSV", all_stage_times):
-            self.stage_02_fit_to_unexplored_csv()
-        with time_stage("3 Clean GPS data", all_stage_times):
-            self.stage_03_clean_gps_data()
-        with time_stage("4 CSV to FIT", all_stage_times):
-            self.stage_04_fixed_csv_to_fit()
-        with time_stage("5 Upload to Strava", all_stage_times):
-            self.stage_05_upload_to_strava()
-        # with time_stage("6 FIT to GPX", all_stage_times):
-        #     self.stage_06_fit_to_gpx()
-        # with time_stage("7 Append to Heatmap", all_stage_times):
-        #     self.stage_07_heatmap()
-        log_duration_table(all_stage_times, "Private")
+        self._run_stages(self._private_stages(), "Private")
 
     def run_repair_flow(self):
         """ Executes the public-facing repair flow for users."""
         logger.info("Public pipeline started")
-        all_stage_times = {}
-        with time_stage("1 Download FIT", all_stage_times):
-            self.stage_01_download_fit()
-        with time_stage("2 FIT to CSV", all_stage_times):
-            self.stage_02_fit_to_unexplored_csv()
-        with time_stage("3 Clean GPS data", all_stage_times):
-            branching = self.stage_03_clean_gps_data()
-        with time_stage("4 CSV to FIT", all_stage_times):
-            self.stage_04_fixed_csv_to_fit()
-        if branching > 0:
-            with time_stage("4-a Send results in email", all_stage_times):
-                self.stage_04_01_email_cleaned_fit("find")
-        else:
-            with time_stage("4-b Send info email", all_stage_times):
-                self.stage_04_01_email_cleaned_fit("not_found")
-        log_duration_table(all_stage_times, "Public")
+        self._run_stages(self._public_stages(), "Public")
+        if self.staging_blob:
+            # Left behind objects are removed by the staging/ lifecycle rule
+            try:
+                delete_blob("GCS_PUB_OUTPUT_BUCKET", self.staging_blob)
+            except Exception as e:
+                logger.warning(f"Could not delete staging object '{self.staging_blob}': {e}")
@@ -1,12 +1,20 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_from_directory, \
-    session, abort
+    session, abort, jsonify
 from flask_babel import _
 import uuid
 import base64
+import shutil
 from gcp_actions.pubsub import publish_to_pubsub
 from gcp_actions.common_utils.local_runner import check_cloud_or_local_run
-from site_handler.utilites.site_config import GCP_TOPIC_NAME
-from gcp_actions.client import get_any_client
+from site_handler.utilites.site_config import (
+    GCP_TOPIC_NAME,
+    UPLOAD_VIA_GCS_STAGING,
+    UPLOAD_STAGING_PREFIX,
+    DIRECT_UPLOAD,
+    DIRECT_UPLOAD_MAX_BYTES,
+    DIRECT_UPLOAD_URL_MINUTES)
+from site_handler.utilites.signed_upload import g_upload_link
+from gcp_actions.client import get_any_client, get_bucket
 from gcp_actions.common_utils.generate import g_download_link
 from datetime import datetime, timezone
 from google.api_core import exceptions as google_exceptions
@@ -22,6 +30,8 @@ bp3 = Blueprint('frontend', __name__, url_prefix='/')
 
 # --- Configuration ---
 ALLOWED_EXTENSIONS = {'fit'}
+STAGING_CHUNK_SIZE = 1024 * 1024  # multiple of 256 KB, as resumable uploads require
+FIT_CONTENT_TYPE = "application/octet-stream"
 
 
 def allowed_file(filename):
@@ -30,10 +40,28 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def staging_blob_name(upload_id: str) -> str:
+    """Staging object of an upload, picked up by the backend's stage_01_download_fit."""
+    return f"{UPLOAD_STAGING_PREFIX}/{upload_id}.fit"
+
+
+def stage_upload_to_gcs(stream, upload_id: str) -> str:
+    """
+    Streams the uploaded file to a staging object in chunks (no full copy in memory).
+    :return: blob name of the staging object
+    """
+    blob_name = staging_blob_name(upload_id)
+    blob = get_bucket("GCS_PUB_OUTPUT_BUCKET").blob(blob_name)
+    with blob.open("wb", chunk_size=STAGING_CHUNK_SIZE, content_type=FIT_CONTENT_TYPE) as writer:
+        shutil.copyfileobj(stream, writer, STAGING_CHUNK_SIZE)
+    logger.info(f"Upload staged to {blob_name}")
+    return blob_name
+
+
 @bp3.route('/', methods=['GET'])
 def index():
     """ Serves the index.html file from the application root directory. """
-    return render_template('index.html')
+    return render_template('index.html', direct_upload=DIRECT_UPLOAD)
 
 @bp3.route('/robots.txt')
 def robots_txt():
@@ -67,22 +95,21 @@ def handle_file_upload():
         return redirect(url_for('frontend.index'))
 
     try:
-        # Read file data from the stream
         file.stream.seek(0)
-        file_data = file.stream.read()
-
-        # Trigger Backend Pipeline via Pub/Sub
-        # Publish the file content and user email for the workers to process
-
         upload_id = str(uuid.uuid4())
 
+        # Trigger Backend Pipeline via Pub/Sub
+        # Publish a pointer to the staged file (or the file content) and user email for the workers to process
         message_data = {
-            "file_data": base64.b64encode(file_data).decode('utf-8'),
             "user_email": user_email,
             "original_filename": file.filename,
             "upload_id": upload_id,
             "locale": session.get('language', 'en')
         }
+        if UPLOAD_VIA_GCS_STAGING == "enable":
+            message_data["staging_blob"] = stage_upload_to_gcs(file.stream, upload_id)
+        else:
+            message_data["file_data"] = base64.b64encode(file.stream.read()).decode('utf-8')
 
         # Publish the message
         publish_to_pubsub(GCP_TOPIC_NAME, message_data)
@@ -103,6 +130,88 @@ def handle_file_upload():
         current_app.logger.error(f"Processing Error: {e}")
         return redirect(url_for('frontend.index'))
 
+@bp3.route('/upload/url', methods=['POST'])
+def create_upload_url():
+    """
+    Direct upload, step 1: validates the form fields and returns a signed PUT URL
+    for a staging object, so the file goes from the browser straight to GCS.
+    The pending upload is kept in the (signed) session for /upload/complete.
+    """
+    if DIRECT_UPLOAD != "enable":
+        abort(404)
+
+    data = request.get_json(silent=True) or {}
+    user_email = data.get('email_address')
+    filename = data.get('filename', '')
+    size = data.get('size')
+
+    if not user_email:
+        return jsonify(error=_('Email address is required.')), 400
+    if not allowed_file(filename):
+        return jsonify(error=_('Invalid file type. Only .fit files are accepted.')), 400
+    if not isinstance(size, int) or not 0 < size <= DIRECT_UPLOAD_MAX_BYTES:
+        return jsonify(error=_('The file is empty or too large.')), 400
+
+    try:
+        upload_id = str(uuid.uuid4())
+        blob_name = staging_blob_name(upload_id)
+        upload_url, headers = g_upload_link(
+            bucket_env="GCS_PUB_OUTPUT_BUCKET",
+            blob_name=blob_name,
+            content_type=FIT_CONTENT_TYPE,
+            max_bytes=DIRECT_UPLOAD_MAX_BYTES,
+            expiration_minutes=DIRECT_UPLOAD_URL_MINUTES,
+            impersonate_sa=os.environ.get("S_ACCOUNT_RUN")
+        )
+    except Exception as e:
+        logger.error(f"Signed upload URL error: {e}")
+        return jsonify(error=_("An unexpected error occurred during upload or processing.")), 500
+
+    session['pending_upload'] = {
+        'upload_id': upload_id,
+        'blob_name': blob_name,
+        'user_email': user_email,
+        'original_filename': filename
+    }
+    return jsonify(upload_url=upload_url, headers=headers, upload_id=upload_id)
+
+
+@bp3.route('/upload/complete', methods=['POST'])
+def complete_direct_upload():
+    """
+    Direct upload, step 2: called by the browser after its PUT succeeded.
+    Checks the staging object landed and triggers the pipeline with a pointer message.
+    """
+    if DIRECT_UPLOAD != "enable":
+        abort(404)
+
+    data = request.get_json(silent=True) or {}
+    pending = session.get('pending_upload')
+    if not pending or pending['upload_id'] != data.get('upload_id'):
+        return jsonify(error=_('Upload session expired. Please try again.')), 400
+
+    try:
+        blob = get_bucket("GCS_PUB_OUTPUT_BUCKET").get_blob(pending['blob_name'])
+        if blob is None or not blob.size:
+            return jsonify(error=_('The file was not uploaded. Please try again.')), 400
+
+        message_data = {
+            "staging_blob": pending['blob_name'],
+            "user_email": pending['user_email'],
+            "original_filename": pending['original_filename'],
+            "upload_id": pending['upload_id'],
+            "locale": session.get('language', 'en')
+        }
+        publish_to_pubsub(GCP_TOPIC_NAME, message_data)
+        session.pop('pending_upload', None)
+        logger.info(f"Direct upload {pending['upload_id']} published ({blob.size} bytes)")
+        return jsonify(redirect=url_for('frontend.success'))
+
+    except Exception as e:
+        logger.error(f"Direct upload completion error: {e}")
+        return jsonify(error=_("An unexpected error occurred during upload or processing.")), 500
+
+
 @bp3.route('/download/<uuid:download_id>', methods=['GET'])
 def download_file(download_id):
     """
@@ -0,0 +1,63 @@
+/**
+ * @fileoverview Direct browser-to-GCS upload.
+ * Asks the backend for a signed PUT URL, sends the file straight to the staging
+ * object and then tells the backend the upload is complete.
+ */
+
+/**
+ * The file reached the staging object but the backend did not accept the upload.
+ * Sending the form again would upload the file a second time, so the caller shows the error instead.
+ */
+export class UploadCompleteError extends Error {}
+
+/**
+ * Posts JSON to a site endpoint and returns the parsed reply.
+ * @param {string} url - The endpoint URL.
+ * @param {object} body - The JSON body.
+ * @returns {Promise<object>} The JSON reply.
+ */
+async function postJson(url, body) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body),
+        credentials: 'same-origin',
+    });
+    const reply = await response.json();
+    if (!response.ok) {
+        throw new Error(reply.error || `Request failed with status ${response.status}`);
+    }
+    return reply;
+}
+
+/**
+ * Uploads the file of the form directly to GCS.
+ * @param {HTMLFormElement} form - The upload form (endpoints are read from its data attributes).
+ * @param {File} file - The selected .fit file.
+ * @param {string} email - The user's email address.
+ * @returns {Promise<string>} The URL to go to after the upload.
+ * @throws {UploadCompleteError} If only the final /upload/complete step failed.
+ */
+export async function uploadDirect(form, file, email) {
+    const signed = await postJson(form.dataset.uploadUrlEndpoint, {
+        email_address: email,
+        filename: file.name,
+        size: file.size,
+    });
+
+    const put = await fetch(signed.upload_url, {
+        method: 'PUT',
+        headers: signed.headers,
+        body: file,
+    });
+    if (!put.ok) {
+        throw new Error(`Storage upload failed with status ${put.status}`);
+    }
+
+    try {
+        const done = await postJson(form.dataset.uploadCompleteEndpoint, { upload_id: signed.upload_id });
+        return done.redirect;
+    } catch (error) {
+        throw new UploadCompleteError(error.message);
+    }
+}
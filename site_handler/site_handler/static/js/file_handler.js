@@ -4,6 +4,7 @@
  * It depends on the reusable formatFileSize utility.
  */
 import { formatFileSize } from './utils.js';
+import { uploadDirect, UploadCompleteError } from './direct_upload.js';
 
 // DOM Element references (module-level constants)
 const fileInput = document.getElementById('fit_file');
@@ -14,6 +15,7 @@ const uploadIcon = document.getElementById('upload-icon');
 const fileDisplayBox = document.getElementById('file-display-box');
 const submitBtn = document.getElementById('submit-btn');
 const uploadForm = document.getElementById('upload-form');
+const emailInput = document.getElementById('email_address');
 
 /**
  * Updates the UI based on the selected file.
@@ -74,16 +76,56 @@ function initFileInput() {
     }
 }
 
+/**
+ * Shows an error above the upload form, styled like the server's flash messages.
+ * @param {string} message - The error text.
+ */
+function showUploadError(message) {
+    const alert = document.createElement('div');
+    alert.className = 'bg-red-100 border border-red-400 text-red-700 px-4 py-3 rounded relative';
+    alert.setAttribute('role', 'alert');
+    const label = document.createElement('strong');
+    label.className = 'font-bold';
+    label.textContent = uploadForm.dataset.errorLabel;
+    const text = document.createElement('span');
+    text.className = 'block sm:inline';
+    text.textContent = ` ${message}`;
+    alert.append(label, text);
+    uploadForm.before(alert);
+}
+
 /**
  * Initializes the form submission prevention logic (for idempotency).
  */
 function initFormSubmission() {
     if (uploadForm && submitBtn) {
-        uploadForm.addEventListener('submit', function() {
+        const defaultButtonText = submitBtn.textContent;
+        uploadForm.addEventListener('submit', function(event) {
             // Disable the button to prevent multiple clicks
             submitBtn.disabled = true;
             // Change the button text to give user feedback
             submitBtn.textContent = submitBtn.dataset.processingText;
+
+            // Direct upload: the file goes to GCS, not through the site server
+            if (uploadForm.dataset.directUpload === 'enable' && fileInput.files.length > 0) {
+                event.preventDefault();
+                uploadDirect(uploadForm, fileInput.files[0], emailInput.value)
+                    .then((redirect) => { window.location.href = redirect; })
+                    .catch((error) => {
+                        if (error instanceof UploadCompleteError) {
+                            // The file is already in staging: report the error instead of uploading it again
+                            console.error("Direct upload was not accepted:", error);
+                            showUploadError(error.message);
+                            submitBtn.disabled = false;
+                            submitBtn.textContent = defaultButtonText;
+                            return;
+                        }
+                        // The signed URL or the PUT failed: fall back to the regular form post
+                        // (it also shows the server's validation messages)
+                        console.error("Direct upload failed, sending the form instead:", error);
+                        uploadForm.submit();
+                    });
+            }
         });
     } else {
         console.error("Upload form or submit button not found.");
@@ -0,0 +1,51 @@
+"""
+Upload-side counterpart of gcp_actions' g_download_link: a V4 signed PUT URL that lets the
+browser send a file straight to a GCS staging object, without passing through Flask.
+Signing impersonates S_ACCOUNT_RUN (the Cloud Run identity has no private key of its own),
+the same way the download links are signed.
+"""
+from datetime import timedelta
+
+import google.auth
+from google.auth import impersonated_credentials
+from gcp_actions.client import get_bucket
+
+import logging
+logger = logging.getLogger(__name__)
+
+SIGNING_SCOPES = ["https://www.googleapis.com/auth/devstorage.read_write"]
+
+
+def g_upload_link(bucket_env: str,
+                  blob_name: str,
+                  content_type: str,
+                  max_bytes: int,
+                  expiration_minutes: int,
+                  impersonate_sa: str) -> tuple[str, dict]:
+    """
+    Generates a short-lived signed URL for one PUT of blob_name.
+    :param bucket_env: name of the env var holding the bucket, as get_bucket expects
+    :param content_type: Content-Type the browser must send
+    :param max_bytes: upper bound enforced by GCS through the signed x-goog-content-length-range header
+    :return: (url, headers the browser must send with the PUT)
+    """
+    source_credentials, _ = google.auth.default()
+    signing_credentials = impersonated_credentials.Credentials(
+        source_credentials=source_credentials,
+        target_principal=impersonate_sa,
+        target_scopes=SIGNING_SCOPES,
+        lifetime=300
+    )
+    headers = {"x-goog-content-length-range": f"0,{max_bytes}"}
+
+    blob = get_bucket(bucket_env).blob(blob_name)
+    url = blob.generate_signed_url(
+        version="v4",
+        expiration=timedelta(minutes=expiration_minutes),
+        method="PUT",
+        content_type=content_type,
+        headers=headers,
+        credentials=signing_credentials
+    )
+    logger.debug(f"Signed upload URL generated for gs://{blob.bucket.name}/{blob_name}")
+    return url, {"Content-Type": content_type, **headers}
@@ -12,6 +12,15 @@ try:
     ALLOWED_DOMAINS = os.environ.get("ALLOWED_DOMAINS")
     GCP_TOPIC_NAME = os.environ.get("GCP_TOPIC_NAME")
     CLOUD_RUN_SERVICE = os.environ.get("CLOUD_RUN_SERVICE")
+    # 'enable': /upload streams the file to GCS_PUB_OUTPUT_BUCKET/<UPLOAD_STAGING_PREFIX> and
+    # publishes only a pointer ('staging_blob') instead of the base64 file in the message
+    UPLOAD_VIA_GCS_STAGING = os.environ.get("UPLOAD_VIA_GCS_STAGING", "disable")
+    UPLOAD_STAGING_PREFIX = os.environ.get("UPLOAD_STAGING_PREFIX", "staging")
+    # 'enable': the browser PUTs the file to a signed staging URL (/upload/url, then /upload/complete);
+    # the bucket needs a CORS rule allowing PUT from ALLOWED_DOMAINS
+    DIRECT_UPLOAD = os.environ.get("DIRECT_UPLOAD", "disable")
+    DIRECT_UPLOAD_MAX_BYTES = int(os.environ.get("DIRECT_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+    DIRECT_UPLOAD_URL_MINUTES = int(os.environ.get("DIRECT_UPLOAD_URL_MINUTES", "10"))
 
 
     S_ACCOUNT_RUN = os.environ.get("s_email_run")